@@ -0,0 +1,166 @@
+# app/audit.py
+"""Write-behind audit logging.
+
+Routes hand events to `record()`, which only enqueues them. A background
+task drains the queue and writes batches with a single multi-row INSERT,
+either every AUDIT_BATCH_SIZE events or every AUDIT_FLUSH_INTERVAL_MS,
+whichever comes first. IP encryption happens in the flusher too, so the
+request path pays neither the AES work nor a database commit.
+"""
+import asyncio
+import base64
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from . import models, database
+from .utils.IpEncryption import AES256Encryptor
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "500"))
+AUDIT_FLUSH_RETRIES = int(os.getenv("AUDIT_FLUSH_RETRIES", "3"))
+# What record() does when the queue is full:
+#   inline - write the event synchronously, as before the queue existed
+#   block  - wait for room in the queue
+#   drop   - discard the event and count it
+AUDIT_QUEUE_FULL_POLICY = os.getenv("AUDIT_QUEUE_FULL_POLICY", "inline").lower()
+
+_STOP = object()
+
+# Audit IPs are encrypted with this, and searched and decrypted with it by the admin API
+encryptor = AES256Encryptor(base64.b64decode(os.getenv("AES_256_KEY_B64")))
+
+AUDIT_QUEUE_DEPTH = metrics.gauge("audit_queue_depth", "Audit events waiting for the background writer.")
+AUDIT_DROPPED = metrics.counter("audit_events_dropped_total", "Audit events discarded because the queue was full.")
+
+
+class AuditWriter:
+    def __init__(self, maxsize: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL_MS / 1000, policy: str = AUDIT_QUEUE_FULL_POLICY):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.dropped = 0
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher after writing everything still queued."""
+        if not self.running:
+            return
+        # The sentinel queues behind pending events, so the flusher writes
+        # them (including a partially collected batch) before exiting.
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def record(self, action: str, user_id: int, ip: str):
+        event = {"action": action, "user_id": user_id, "ip": ip, "timestamp": datetime.now(timezone.utc)}
+        if not self.running:
+            await write_batch([event])
+            return
+        try:
+            self._queue.put_nowait(event)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "block":
+            await self._queue.put(event)
+        elif self.policy == "drop":
+            self.dropped += 1
+            AUDIT_DROPPED.inc()
+            logger.warning(f"Audit queue full; dropped {action} event ({self.dropped} dropped so far)")
+        else:
+            await write_batch([event])
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            event = await self._queue.get()
+            if event is _STOP:
+                return
+            batch = [event]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        for attempt in range(1, AUDIT_FLUSH_RETRIES + 1):
+            try:
+                await write_batch(batch)
+                return
+            except Exception as e:
+                logger.warning(f"Audit flush of {len(batch)} events failed (attempt {attempt}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 10) * 0.1)
+        logger.error(f"Giving up on {len(batch)} audit events")
+
+
+def encrypt_rows(events: list) -> list:
+    """Encrypt and blind-index the events' IPs."""
+    return [
+        {
+            "action": e["action"],
+            "user_id": e["user_id"],
+            "ip": encryptor.encrypt(e["ip"]),
+            "ip_hmac": encryptor.blind_index(e["ip"]),
+            "timestamp": e["timestamp"],
+        }
+        for e in events
+    ]
+
+
+async def write_batch(events: list):
+    """Insert the events with one multi-row INSERT."""
+    rows = await asyncio.to_thread(encrypt_rows, events)
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(insert(models.AuditLog), rows)
+        await db.commit()
+
+
+audit_writer = AuditWriter()
+
+
+@metrics.on_collect
+def _collect_audit_queue():
+    AUDIT_QUEUE_DEPTH.set(audit_writer.queue_depth())
+
+
+async def record(action: str, user_id: int, ip: str):
+    """Queue an audit event for the background writer."""
+    await audit_writer.record(action, user_id, ip)
@@ -1,21 +1,72 @@
 # app/auth.py
 from passlib.context import CryptContext
-from jose import jwt
+from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import hashlib
 import os
+import threading
 import pyotp
+from .utils.cache import TTLCache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Raising BCRYPT_ROUNDS makes existing hashes "deprecated"; they are
+# transparently rehashed the next time their owner logs in.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRATION_MINUTES"))
 
+# bcrypt runs in a dedicated pool so a login burst can only occupy these
+# workers, never the event loop or the storage I/O pool. bcrypt releases
+# the GIL while hashing, so threads give real parallelism here. Requests
+# beyond the workers plus PASSWORD_HASH_MAX_QUEUE waiting ones are
+# rejected immediately with PasswordHasherBusy.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "16"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE)
+
+
+class PasswordHasherBusy(Exception):
+    """The password hashing pool and its queue are full."""
+
+
 def verify_password(plain, hashed):
     return pwd_context.verify(plain, hashed)
 
 def hash_password(password):
     return pwd_context.hash(password)
 
+
+async def _run_hashing(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, functools.partial(fn, *args))
+    finally:
+        _hash_slots.release()
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hashing(pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain: str, hashed: str):
+    """Verify a password on the hashing pool.
+
+    Returns (valid, new_hash); new_hash is set when the stored hash uses
+    outdated parameters and should be replaced.
+    """
+    if not hashed:
+        # Accounts created through Google sign-in have no password
+        return False, None
+    return await _run_hashing(pwd_context.verify_and_update, plain, hashed)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -41,5 +92,41 @@ def verify_totp(secret: str, code: str) -> bool:
 def create_refresh_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=1)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
\ No newline at end of file
+    # Marks the token as only good for /user/refresh; see get_current_user
+    to_encode.update({"exp": expire, "type": "refresh"})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+# Verified token payloads, keyed by SHA-256 of the token and never kept
+# past the token's own `exp`.
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", "300"))
+_verified_tokens = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+
+def decode_token(token: str) -> dict:
+    """Verify an access token and return its payload, skipping the signature check for recently verified tokens.
+
+    Raises JWTError for invalid or expired tokens.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = _verified_tokens.get(digest)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("type") != "refresh":
+        exp = payload.get("exp")
+        _verified_tokens.set(digest, payload, expires_at=float(exp) if exp is not None else None)
+    return payload
+
+
+def decode_refresh_token(token: str) -> dict:
+    """Verify a refresh token and return its payload.
+
+    Refreshes are rare, so the signature is always checked rather than
+    trusted from the cache. Raises JWTError for invalid or expired tokens
+    and for tokens of any other type.
+    """
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("type") != "refresh":
+        raise JWTError("Not a refresh token")
+    return payload
@@ -0,0 +1,244 @@
+# app/chunk_reader.py
+"""Reading a stored file back: its chunk manifest, and its decrypted content.
+
+Downloads and the dedup checks both read stored files through here. Chunks
+are fetched from storage ahead of the one being decrypted, hedged across the
+replicas, and served from the local chunk cache when it is enabled.
+"""
+import json
+import logging
+import os
+import time
+from typing import NamedTuple, Optional
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from services import metrics
+from services.chunk_cache import chunk_cache
+from services.hedging import hedged_fetch
+from services.prefetch import fetch_in_order
+from services.storage import chunk_key, get_backend, primary_backend, secondary_backend
+from . import models
+from .utils.httpRange import chunk_span
+
+logger = logging.getLogger(__name__)
+
+# How many chunks may be buffered ahead of the one being decrypted. Parallel
+# fetches are capped by the primary backend's concurrency. Per-request
+# memory is bounded by roughly (window + 1) * chunk size.
+DOWNLOAD_PREFETCH_CHUNKS = int(os.getenv("DOWNLOAD_PREFETCH_CHUNKS", "8"))
+# Adjacent chunks in the same pack are fetched with one ranged GET of up
+# to this many bytes; each such read counts once against the window.
+DOWNLOAD_COALESCE_BYTES = int(os.getenv("DOWNLOAD_COALESCE_BYTES", str(2 * 1024 * 1024)))
+DECRYPT_BYTES = metrics.counter("download_decrypt_bytes_total", "Plaintext bytes produced by AES-GCM decryption in downloads.")
+DECRYPT_SECONDS = metrics.counter("download_decrypt_seconds_total", "Time spent in AES-GCM decryption in downloads.")
+GCM_TAG_SIZE = 16
+
+
+class ManifestError(Exception):
+    """A file's stored manifest is inconsistent, so its content can't be read."""
+
+
+class ChunkLayout(NamedTuple):
+    """Where a file's chunks are stored, beyond `{file_hash}/chunk_i` on every replica."""
+    # Per chunk, the backends holding it; only while replication is pending
+    replicas: Optional[list] = None
+    # Per chunk, (pack key, offset, encrypted length), or None while loose
+    packs: Optional[list] = None
+
+
+class ChunkRead(NamedTuple):
+    """One storage request: a loose chunk, or a run of adjacent packed chunks."""
+    key: str
+    offset: Optional[int]
+    length: Optional[int]
+    chunks: list  # Chunk indexes covered, in order
+    lengths: list  # Their encrypted lengths, for splitting a coalesced read
+    replicas: Optional[tuple]
+
+
+async def load_manifest(db: AsyncSession, file: models.FileUpload):
+    """Return (ivs, sizes, layout) for a file, validated before streaming starts.
+
+    `sizes` holds each chunk's plaintext length, or is None for files whose
+    chunk sizes were never recorded. `layout` is a ChunkLayout. Reads the
+    FileChunk manifest with one indexed query; files uploaded before the
+    manifest existed fall back to the legacy `ivs` JSON column. Raises
+    ManifestError if the manifest doesn't match the file.
+    """
+    result = await db.execute(
+        select(
+            models.FileChunk.chunk_index, models.FileChunk.iv, models.FileChunk.size,
+            models.FileChunk.replicas, models.FileChunk.pack_key, models.FileChunk.pack_offset,
+        )
+        .where(models.FileChunk.file_id == file.id)
+        .order_by(models.FileChunk.chunk_index)
+    )
+    rows = result.all()
+    if not rows and file.ivs:
+        return parse_legacy_ivs(file), None, ChunkLayout()
+
+    if [row.chunk_index for row in rows] != list(range(file.chunk_count)):
+        logger.error(f"Manifest of file {file.id} has {len(rows)} chunks, expected {file.chunk_count}")
+        raise ManifestError("Mismatch between IV count and chunk count")
+    ivs = [bytes(row.iv) for row in rows]
+    replicas = packs = None
+    if file.replication_state not in (None, "replicated"):
+        replicas = [tuple(row.replicas.split(",")) if row.replicas else None for row in rows]
+    if any(row.pack_key is not None for row in rows):
+        packs = [(row.pack_key, row.pack_offset, row.size) if row.pack_key is not None else None for row in rows]
+    layout = ChunkLayout(replicas, packs)
+    if any(row.size is None for row in rows):
+        return ivs, None, layout
+    return ivs, [row.size - GCM_TAG_SIZE for row in rows], layout
+
+
+def parse_legacy_ivs(file: models.FileUpload) -> list:
+    ivs = file.ivs
+    if isinstance(ivs, str):
+        try:
+            ivs = json.loads(ivs)
+        except json.JSONDecodeError as e:
+            logger.error(f"IVs of file {file.id} are not valid JSON: {e}")
+            raise ManifestError("Invalid IV format in database")
+
+    if len(ivs) != file.chunk_count:
+        logger.error(f"File {file.id} has {len(ivs)} IVs for {file.chunk_count} chunks")
+        raise ManifestError("Mismatch between IV count and chunk count")
+
+    parsed = []
+    for i, iv_array in enumerate(ivs):
+        if isinstance(iv_array, str):
+            try:
+                iv_array = json.loads(iv_array)
+            except Exception:
+                logger.error(f"IV {i} of file {file.id} is not valid JSON: {iv_array}")
+                raise ManifestError(f"IV at chunk {i} is not valid JSON")
+
+        if not isinstance(iv_array, list) or len(iv_array) != 12:
+            logger.error(f"IV {i} of file {file.id} is not a 12-byte array: {iv_array}")
+            raise ManifestError(f"Invalid IV format or length at chunk {i}")
+        parsed.append(bytes(iv_array))
+    return parsed
+
+
+def plan_reads(file_hash: str, indexes, layout: ChunkLayout = None, coalesce_bytes: int = DOWNLOAD_COALESCE_BYTES) -> list:
+    """Turn chunk indexes into storage reads, merging neighbours that sit back to back in a pack."""
+    layout = layout or ChunkLayout()
+    reads = []
+    for i in indexes:
+        replicas = layout.replicas[i] if layout.replicas else None
+        packed = layout.packs[i] if layout.packs else None
+        if packed is None:
+            reads.append(ChunkRead(chunk_key(file_hash, i), None, None, [i], [None], replicas))
+            continue
+        key, offset, length = packed
+        last = reads[-1] if reads else None
+        if (last is not None and last.offset is not None and last.key == key and last.replicas == replicas
+                and last.offset + last.length == offset and last.length + length <= coalesce_bytes):
+            reads[-1] = last._replace(length=last.length + length, chunks=last.chunks + [i], lengths=last.lengths + [length])
+        else:
+            reads.append(ChunkRead(key, offset, length, [i], [length], replicas))
+    return reads
+
+
+async def fetch_object(key: str, offset: int = None, length: int = None, replicas: tuple = None) -> bytes:
+    """Fetch an object, or `length` bytes of it from `offset`, hedging across both replicas.
+
+    The primary backend is asked first; if it fails or is slower than the
+    hedge threshold the secondary is asked as well and whichever answers
+    first is used. `replicas` restricts the read to the backends known to
+    hold the object.
+    """
+    primary = primary_backend()
+    secondary = secondary_backend()
+    if replicas is not None:
+        holders = [backend for backend in (primary, secondary) if backend is not None and backend.name in replicas]
+        if not holders:
+            # Stored on a backend that is no longer configured
+            holders = [get_backend(name) for name in replicas]
+        primary, secondary = holders[0], (holders[1] if len(holders) > 1 else None)
+
+    def read(backend):
+        if offset is None:
+            return lambda: backend.get(key)
+        return lambda: backend.get_range(key, offset, length)
+
+    try:
+        if secondary is None:
+            return await read(primary)()
+        return await hedged_fetch(read(primary), read(secondary))
+    except Exception as e:
+        logger.error(f"Reading {key} failed on every replica: {e}")
+        raise
+
+
+async def fetch_chunks(file_hash: str, chunk_read: ChunkRead) -> list:
+    """Return the encrypted chunks a planned read covers, from the local cache if possible."""
+    if not chunk_cache.enabled:
+        return await read_chunks(chunk_read)
+    keys = [chunk_key(file_hash, i) for i in chunk_read.chunks]
+    return await chunk_cache.get_or_fetch(keys, lambda: read_chunks(chunk_read))
+
+
+async def read_chunks(chunk_read: ChunkRead) -> list:
+    """Perform one planned read and split it into the encrypted chunks it covers."""
+    data = await fetch_object(chunk_read.key, chunk_read.offset, chunk_read.length, chunk_read.replicas)
+    if chunk_read.offset is None:
+        return [data]
+    if len(data) != chunk_read.length:
+        raise IOError(f"Short read of {chunk_read.key}: {len(data)} of {chunk_read.length} bytes")
+    pieces, position = [], 0
+    view = memoryview(data)
+    for length in chunk_read.lengths:
+        pieces.append(view[position:position + length])
+        position += length
+    return pieces
+
+
+async def decrypt_chunks(file_hash: str, ivs: list, key_bytes: bytes, indexes=None,
+                         concurrency: int = None, window: int = DOWNLOAD_PREFETCH_CHUNKS, layout: ChunkLayout = None):
+    """Yield decrypted chunks in order while the following chunks are fetched in parallel.
+
+    `indexes` restricts the stream to those chunks (default: all of them).
+    `layout` says where the chunks are, as loaded by `load_manifest`.
+    """
+    aesgcm = AESGCM(key_bytes)
+    indexes = range(len(ivs)) if indexes is None else indexes
+    reads = plan_reads(file_hash, indexes, layout)
+
+    async def fetch(n):
+        return await fetch_chunks(file_hash, reads[n])
+
+    batches = fetch_in_order(fetch, len(reads), concurrency or primary_backend().concurrency, window)
+    try:
+        n = 0
+        async for encrypted_chunks in batches:
+            for i, encrypted_chunk in zip(reads[n].chunks, encrypted_chunks):
+                started = time.perf_counter()
+                try:
+                    plaintext = aesgcm.decrypt(ivs[i], encrypted_chunk, None)
+                except Exception as e:
+                    logger.error(f"Decrypting chunk {i} of {file_hash} failed: {e!r}")
+                    raise
+                DECRYPT_SECONDS.inc(time.perf_counter() - started)
+                DECRYPT_BYTES.inc(len(plaintext))
+                yield plaintext
+            n += 1
+    finally:
+        await batches.aclose()
+
+
+async def decrypt_range(file_hash: str, ivs: list, key_bytes: bytes, offsets: list, start: int, end: int,
+                        layout: ChunkLayout = None):
+    """Yield the plaintext bytes [start, end], fetching only the chunks that cover them."""
+    first, last = chunk_span(offsets, start, end)
+    chunks = decrypt_chunks(file_hash, ivs, key_bytes, indexes=range(first, last + 1), layout=layout)
+    try:
+        index = first
+        async for plain in chunks:
+            chunk_start = offsets[index]
+            yield plain[max(start - chunk_start, 0):end - chunk_start + 1]
+            index += 1
+    finally:
+        await chunks.aclose()
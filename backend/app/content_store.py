@@ -0,0 +1,157 @@
+# app/content_store.py
+"""Reference counting for stored chunk objects.
+
+Chunk objects are keyed by content (`{file_hash}/chunk_i`) while FileUpload
+rows are per owner, so one set of objects may back several files. Each
+StoredContent row counts the completed FileUpload rows that reference its
+objects; the objects are only reclaimed when that count drops to zero.
+"""
+from sqlalchemy import delete, func, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+
+
+def _increment(file_hash: str):
+    return update(models.StoredContent).where(models.StoredContent.file_hash == file_hash).values(
+        refcount=models.StoredContent.refcount + 1
+    )
+
+
+# StoredContent.verification: whether the content was checked against its
+# hash. Unchecked content (NULL) is queued as "pending" when first needed.
+PENDING, VERIFIED, MISMATCH = "pending", "verified", "mismatch"
+
+
+async def _create(db: AsyncSession, file_hash: str, chunk_count: int, **values) -> bool:
+    """Create the content's row, counting the completed files already using it.
+
+    Content stored before reference counting existed may back several
+    files. Returns False if the row already exists.
+    """
+    refcount = await db.scalar(select(func.count(models.FileUpload.id)).where(
+        models.FileUpload.file_hash == file_hash,
+        models.FileUpload.status == "complete",
+    ))
+    try:
+        async with db.begin_nested():
+            db.add(models.StoredContent(file_hash=file_hash, chunk_count=chunk_count, refcount=refcount, **values))
+        return True
+    except IntegrityError:
+        return False
+
+
+async def acquire(db: AsyncSession, file_hash: str, chunk_count: int):
+    """Add one reference to the content, creating its row on first use.
+
+    Call once the referencing file is complete and flushed; a new row
+    counts it along with any other completed files.
+    """
+    result = await db.execute(_increment(file_hash))
+    if result.rowcount:
+        return
+    if not await _create(db, file_hash, chunk_count):
+        # Created concurrently; count ourselves against that row instead
+        await db.execute(_increment(file_hash))
+
+
+async def verification(db: AsyncSession, file_hash: str):
+    return await db.scalar(select(models.StoredContent.verification).where(models.StoredContent.file_hash == file_hash))
+
+
+async def request_verification(db: AsyncSession, file_hash: str, chunk_count: int):
+    """Queue the content for verification, creating its row if it predates refcounting."""
+    result = await db.execute(update(models.StoredContent).where(models.StoredContent.file_hash == file_hash).values(
+        verification=PENDING
+    ))
+    if not result.rowcount and not await _create(db, file_hash, chunk_count, verification=PENDING):
+        await db.execute(update(models.StoredContent).where(models.StoredContent.file_hash == file_hash).values(
+            verification=PENDING
+        ))
+
+
+async def record_verification(db: AsyncSession, file_hash: str, state: str) -> bool:
+    """Settle a pending verification. Returns False if the content is gone or was settled already."""
+    result = await db.execute(update(models.StoredContent).where(
+        models.StoredContent.file_hash == file_hash,
+        models.StoredContent.verification == PENDING,
+    ).values(verification=state))
+    return bool(result.rowcount)
+
+
+async def release(db: AsyncSession, file_hash: str) -> bool:
+    """Drop one reference. Returns True when the caller must reclaim the objects.
+
+    The row is only removed while its count is zero, so a concurrent
+    `acquire` either lands first (and keeps the objects alive) or finds no
+    row and starts a fresh upload.
+    """
+    result = await db.execute(
+        update(models.StoredContent).where(models.StoredContent.file_hash == file_hash).values(
+            refcount=models.StoredContent.refcount - 1
+        )
+    )
+    if not result.rowcount:
+        # Content stored before reference counting existed: count the
+        # completed files still pointing at it.
+        remaining = await db.scalar(select(func.count(models.FileUpload.id)).where(
+            models.FileUpload.file_hash == file_hash,
+            models.FileUpload.status == "complete",
+        ))
+        return remaining == 0
+
+    deleted = await db.execute(delete(models.StoredContent).where(
+        models.StoredContent.file_hash == file_hash,
+        models.StoredContent.refcount <= 0,
+    ))
+    return bool(deleted.rowcount)
+
+
+async def pack_count(db: AsyncSession, file_hash: str) -> int:
+    """Number of pack objects the content's chunks were compacted into."""
+    return await db.scalar(select(models.StoredContent.pack_count).where(models.StoredContent.file_hash == file_hash)) or 0
+
+
+async def find_donor(db: AsyncSession, file_hash: str):
+    """Return a completed FileUpload whose stored chunks can back a new reference."""
+    return await db.scalar(select(models.FileUpload).where(
+        models.FileUpload.file_hash == file_hash,
+        models.FileUpload.status == "complete",
+    ).order_by(models.FileUpload.id).limit(1))
+
+
+async def clone_manifest(db: AsyncSession, donor: models.FileUpload, file_id: int):
+    """Copy the donor's chunk manifest to `file_id` in one INSERT ... SELECT."""
+    columns = ["file_id", "chunk_index", "iv", "size", "replicas", "pack_key", "pack_offset"]
+    source = select(
+        literal(file_id),
+        models.FileChunk.chunk_index,
+        models.FileChunk.iv,
+        models.FileChunk.size,
+        models.FileChunk.replicas,
+        models.FileChunk.pack_key,
+        models.FileChunk.pack_offset,
+    ).where(models.FileChunk.file_id == donor.id)
+    await db.execute(models.FileChunk.__table__.insert().from_select(columns, source))
+
+
+async def relink_packs(db: AsyncSession, file_hash: str):
+    """Point manifest rows still addressing loose chunks at the content's packs.
+
+    A file that cloned its manifest while the content was being packed may
+    have missed the packer's update; run before the loose objects go.
+    """
+    packed = aliased(models.FileChunk)
+    sibling = select(packed).join(models.FileUpload, models.FileUpload.id == packed.file_id).where(
+        models.FileUpload.file_hash == file_hash,
+        packed.chunk_index == models.FileChunk.chunk_index,
+        packed.pack_key.is_not(None),
+    ).limit(1)
+    await db.execute(update(models.FileChunk).where(
+        models.FileChunk.file_id.in_(select(models.FileUpload.id).where(models.FileUpload.file_hash == file_hash)),
+        models.FileChunk.pack_key.is_(None),
+    ).values(
+        pack_key=sibling.with_only_columns(packed.pack_key).scalar_subquery(),
+        pack_offset=sibling.with_only_columns(packed.pack_offset).scalar_subquery(),
+    ).execution_options(synchronize_session=False))
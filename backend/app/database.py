@@ -1,15 +1,142 @@
 # app/database.py
-from sqlalchemy import create_engine
+import logging
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import time
 from dotenv import load_dotenv
+from sqlalchemy import event
+from services import metrics
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Async drivers for the sync URLs DATABASE_URL is usually written with.
+# ASYNC_DATABASE_URL overrides the mapping entirely.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+}
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend!r}; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def pool_options(url: str) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE_SECONDS}
+    parsed = make_url(url)
+    # In-memory SQLite uses a single shared connection, which takes no sizing
+    if parsed.get_backend_name() != "sqlite" or parsed.database not in (None, "", ":memory:"):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Route handlers use the async engine. The sync one remains for code that
+# runs outside the event loop, such as one-off scripts.
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL))
+# Objects stay usable after commit; lazy refreshes aren't possible in async code.
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def pool_status() -> dict:
+    """Connection pool occupancy for the async engine."""
+    pool = async_engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"pool": type(pool).__name__}
+    size = pool.size()
+    checked_out = pool.checkedout()
+    capacity = size + DB_MAX_OVERFLOW
+    return {
+        "pool": type(pool).__name__,
+        "size": size,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "saturation": round(checked_out / capacity, 3) if capacity else None,
+    }
+
+
+DB_POOL_CONNECTIONS = metrics.gauge("db_pool_connections", "Async engine pool connections by state.", ("state",))
+DB_POOL_SATURATION = metrics.gauge("db_pool_saturation", "Share of the async pool's capacity checked out.")
+DB_QUERY_SECONDS = metrics.histogram("db_query_seconds", "Time spent executing SQL statements.", ("statement",))
+
+
+@metrics.on_collect
+def _collect_pool_status():
+    status = pool_status()
+    for state in ("checked_in", "checked_out", "overflow"):
+        if state in status:
+            # QueuePool reports overflow as negative until the pool fills
+            DB_POOL_CONNECTIONS.set(max(status[state], 0), state=state)
+    if status.get("saturation") is not None:
+        DB_POOL_SATURATION.set(status["saturation"])
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _observe_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    # The leading keyword keeps the label set small
+    DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=statement.lstrip().split(None, 1)[0].upper())
+
+
+async def create_schema(*indexed_models):
+    """Create missing tables, upgrade existing ones, then add indexes `create_all` skipped.
+
+    Indexes are only created on columns the table is confirmed to have, so
+    a table that no migration covers yet is left as it is rather than
+    failing startup.
+    """
+    from . import migrations
+
+    def create(connection):
+        Base.metadata.create_all(bind=connection)
+        migrations.upgrade(connection)
+        inspector = inspect(connection)
+        for model in indexed_models:
+            table = model.__table__
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for index in table.indexes:
+                missing = [column.name for column in index.columns if column.name not in existing]
+                if missing:
+                    logger.error(f"Not creating index {index.name}: {table.name} has no column {', '.join(missing)}")
+                    continue
+                index.create(bind=connection, checkfirst=True)
+    async with async_engine.begin() as connection:
+        await connection.run_sync(create)
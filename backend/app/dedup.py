@@ -0,0 +1,260 @@
+# app/dedup.py
+"""Checks before an upload is satisfied from another owner's stored copy.
+
+Dedup hands the new owner the donor's key and manifest, so knowing a
+file's hash must not be enough to obtain it. The client is challenged to
+prove it holds the content: the server picks a random plaintext range and
+a nonce, and the client answers with SHA-256(nonce + those bytes). The
+challenge travels as a signed, short-lived token, so no state is kept
+between the two requests.
+
+The stored content itself is checked against its claimed hash before it
+may serve as a donor, so an upload under someone else's hash can't be
+passed on to later uploaders. Hashing means reading the whole file, so the
+first request for unchecked content only queues it; the Verifier hashes it
+in the background and records the result on the StoredContent row, and
+the client retries.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+from cryptography.exceptions import InvalidTag
+from jose import JWTError, jwt
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import auth, content_store, database, models
+from .chunk_reader import ManifestError, decrypt_chunks, decrypt_range, load_manifest
+
+logger = logging.getLogger(__name__)
+
+DEDUP_PROOF_BYTES = int(os.getenv("DEDUP_PROOF_BYTES", str(64 * 1024)))
+DEDUP_CHALLENGE_TTL_SECONDS = int(os.getenv("DEDUP_CHALLENGE_TTL_SECONDS", "300"))
+DEDUP_VERIFY_CONCURRENCY = int(os.getenv("DEDUP_VERIFY_CONCURRENCY", "2"))
+DEDUP_VERIFY_POLL_INTERVAL_SECONDS = float(os.getenv("DEDUP_VERIFY_POLL_INTERVAL_SECONDS", "30"))
+
+CHALLENGE_PURPOSE = "dedup-proof"
+
+
+class ProofRequired(Exception):
+    def __init__(self, challenge: dict):
+        super().__init__("Proof of possession required")
+        self.challenge = challenge
+
+
+class ProofRejected(Exception):
+    pass
+
+
+class ContentMismatch(Exception):
+    pass
+
+
+class VerificationPending(Exception):
+    pass
+
+
+class StorageUnavailable(Exception):
+    pass
+
+
+def issue_challenge(user_id: int, file_hash: str, size: int) -> dict:
+    length = min(DEDUP_PROOF_BYTES, size)
+    offset = secrets.randbelow(size - length + 1)
+    nonce = secrets.token_hex(16)
+    # No "sub" claim, so the token can't pass for an access token
+    token = jwt.encode({
+        "purpose": CHALLENGE_PURPOSE,
+        "uid": user_id,
+        "hash": file_hash,
+        "offset": offset,
+        "length": length,
+        "nonce": nonce,
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=DEDUP_CHALLENGE_TTL_SECONDS),
+    }, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    return {"challenge": token, "offset": offset, "length": length, "nonce": nonce}
+
+
+def read_challenge(token: str, user_id: int, file_hash: str) -> dict:
+    try:
+        claims = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    except JWTError:
+        raise ProofRejected("Invalid or expired dedup challenge")
+    if claims.get("purpose") != CHALLENGE_PURPOSE or claims.get("uid") != user_id or claims.get("hash") != file_hash:
+        raise ProofRejected("Dedup challenge was issued for another upload")
+    return claims
+
+
+async def read_plaintext(db: AsyncSession, file: models.FileUpload, offset: int, length: int) -> bytes:
+    """Decrypt `length` bytes of the file's content from `offset`."""
+    if length == 0:
+        return b""
+    ivs, sizes, layout = await load_manifest(db, file)
+    key_bytes = base64.b64decode(file.encrypted_key)
+    if sizes is not None:
+        offsets = [0]
+        for size in sizes:
+            offsets.append(offsets[-1] + size)
+        pieces = [piece async for piece in decrypt_range(file.file_hash, ivs, key_bytes, offsets, offset, offset + length - 1, layout)]
+        return b"".join(pieces)
+    # Legacy manifest without sizes: decrypt from the start
+    data, position = bytearray(), 0
+    chunks = decrypt_chunks(file.file_hash, ivs, key_bytes, layout=layout)
+    try:
+        async for plain in chunks:
+            end = position + len(plain)
+            if end > offset:
+                data += plain[max(offset - position, 0):offset + length - position]
+            position = end
+            if position >= offset + length:
+                break
+    finally:
+        await chunks.aclose()
+    return bytes(data)
+
+
+async def hash_content(db: AsyncSession, file: models.FileUpload):
+    """Return (SHA-256 hex digest, size) of the file's decrypted content."""
+    ivs, _, layout = await load_manifest(db, file)
+    digest, size = hashlib.sha256(), 0
+    async for plain in decrypt_chunks(file.file_hash, ivs, base64.b64decode(file.encrypted_key), layout=layout):
+        digest.update(plain)
+        size += len(plain)
+    return digest.hexdigest(), size
+
+
+async def check_possession(db: AsyncSession, user_id: int, donor: models.FileUpload, challenge: str = None, proof: str = None):
+    """Return once the client has proven it holds the donor's content.
+
+    Raises VerificationPending while the stored content hasn't been checked
+    against its hash yet, ContentMismatch when it doesn't match, ProofRequired
+    with a fresh challenge when none was answered, ProofRejected for a wrong
+    or stale answer, and StorageUnavailable when the content can't be read.
+    """
+    state = await content_store.verification(db, donor.file_hash)
+    if state == content_store.MISMATCH:
+        raise ContentMismatch(f"Stored content does not match {donor.file_hash}")
+    if state != content_store.VERIFIED or donor.size is None:
+        await content_store.request_verification(db, donor.file_hash, donor.chunk_count)
+        await db.commit()
+        verifier.wake()
+        raise VerificationPending(f"Stored content of {donor.file_hash} is being verified")
+
+    if not challenge or not proof:
+        raise ProofRequired(issue_challenge(user_id, donor.file_hash, donor.size))
+    claims = read_challenge(challenge, user_id, donor.file_hash)
+    try:
+        data = await read_plaintext(db, donor, claims["offset"], claims["length"])
+    except (InvalidTag, ManifestError) as e:
+        logger.error(f"Verified content of {donor.file_hash} (file {donor.id}) no longer reads back: {e!r}")
+        raise ContentMismatch(f"Stored content of {donor.file_hash} is unreadable")
+    except Exception as e:
+        logger.warning(f"Reading {donor.file_hash} for a proof of possession failed: {e}")
+        raise StorageUnavailable(f"Stored content of {donor.file_hash} can't be read right now") from e
+    expected = hashlib.sha256(claims["nonce"].encode() + data).hexdigest()
+    if not secrets.compare_digest(expected, proof.lower()):
+        logger.warning(f"Failed proof of possession for {donor.file_hash} by user {user_id}")
+        raise ProofRejected("Proof of possession failed")
+
+
+class Verifier:
+    """Hashes content queued by `request_verification` and records whether it matches.
+
+    Verification is idempotent, so processes don't coordinate; each skips
+    only the hashes it already has in hand. Content that can't be read
+    stays pending and is retried on the next poll.
+    """
+
+    def __init__(self, concurrency: int = DEDUP_VERIFY_CONCURRENCY, poll_interval: float = DEDUP_VERIFY_POLL_INTERVAL_SECONDS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the contents in hand are verified."""
+        if not self.running:
+            return
+        self._stopping = True
+        self.wake()
+        await self._task
+        self._task = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        failed = set()
+        while not self._stopping:
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    query = select(models.StoredContent.file_hash).where(
+                        models.StoredContent.verification == content_store.PENDING,
+                    )
+                    if failed:
+                        query = query.where(models.StoredContent.file_hash.not_in(failed))
+                    claimed = (await db.scalars(query.order_by(models.StoredContent.id).limit(self.concurrency))).all()
+            except Exception as e:
+                logger.warning(f"Finding content to verify failed: {e}")
+                claimed = []
+            if claimed:
+                results = await asyncio.gather(*(self._verify(file_hash) for file_hash in claimed))
+                failed.update(file_hash for file_hash, ok in zip(claimed, results) if not ok)
+                continue
+            # Everything left has failed this round; retry it after the poll interval
+            failed.clear()
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _verify(self, file_hash: str) -> bool:
+        """Hash the content and record the outcome. Returns False if it couldn't be read."""
+        try:
+            async with database.AsyncSessionLocal() as db:
+                donor = await content_store.find_donor(db, file_hash)
+                if donor is None:
+                    # Deleted in the meantime
+                    return True
+                try:
+                    digest, size = await hash_content(db, donor)
+                except (InvalidTag, ManifestError) as e:
+                    # A chunk that doesn't decrypt under the donor's key is as bad as a wrong hash
+                    logger.warning(f"Stored content of {file_hash} does not decrypt: {e!r}")
+                    digest, size = "undecryptable", None
+                if digest != file_hash.lower():
+                    if await content_store.record_verification(db, file_hash, content_store.MISMATCH):
+                        logger.error(f"Stored content of {file_hash} (file {donor.id}) hashes to {digest}; not serving it for dedup")
+                else:
+                    await content_store.record_verification(db, file_hash, content_store.VERIFIED)
+                    # Legacy rows never recorded a size; it is known now
+                    await db.execute(update(models.FileUpload).where(
+                        models.FileUpload.file_hash == file_hash, models.FileUpload.size.is_(None),
+                    ).values(size=size))
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Verifying stored content of {file_hash} failed: {e}")
+            return False
+        return True
+
+
+verifier = Verifier()
@@ -0,0 +1,242 @@
+# app/deletion.py
+"""Background reclamation of deleted files' storage objects.
+
+Deleting a file only drops its metadata and records a DeletionJob in the
+same transaction, so the request returns without touching storage. A
+background worker claims due jobs and deletes the objects from every
+replica concurrently, using the backends' batch deletes. Backends that
+fail are retried with exponential backoff; after DELETION_MAX_ATTEMPTS the
+job is marked failed and left for an operator.
+
+Jobs are claimed with a lease, so several app processes can run workers
+against the same database, and a job held by a crashed process is picked
+up again once its lease expires.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, database, replication, content_store
+from services.chunk_cache import chunk_cache
+from services.storage import chunk_key, get_backend, pack_key, replica_backends
+
+logger = logging.getLogger(__name__)
+
+DELETION_CONCURRENCY = int(os.getenv("DELETION_CONCURRENCY", "4"))
+DELETION_POLL_INTERVAL_SECONDS = float(os.getenv("DELETION_POLL_INTERVAL_SECONDS", "10"))
+DELETION_MAX_ATTEMPTS = int(os.getenv("DELETION_MAX_ATTEMPTS", "8"))
+DELETION_RETRY_BASE_SECONDS = float(os.getenv("DELETION_RETRY_BASE_SECONDS", "5"))
+DELETION_RETRY_MAX_SECONDS = float(os.getenv("DELETION_RETRY_MAX_SECONDS", "900"))
+DELETION_LEASE_SECONDS = float(os.getenv("DELETION_LEASE_SECONDS", "300"))
+
+ACTIVE_STATUSES = ("pending", "running")
+
+
+def job_keys(job: models.DeletionJob) -> list:
+    keys = [chunk_key(job.file_hash, i) for i in range(job.chunk_count)]
+    return keys + [pack_key(job.file_hash, n) for n in range(job.pack_count or 0)]
+
+
+def retry_delay(attempts: int) -> float:
+    return min(DELETION_RETRY_BASE_SECONDS * 2 ** (attempts - 1), DELETION_RETRY_MAX_SECONDS)
+
+
+async def enqueue(db: AsyncSession, file_hash: str, chunk_count: int, owner_id: int = None, pack_count: int = 0,
+                  reason: str = "deleted", delay: float = 0) -> models.DeletionJob:
+    """Add a job reclaiming the content's objects. The caller commits, then calls `deletion_worker.wake()`.
+
+    With reason "packed" only the loose chunk objects are removed, after
+    `delay` seconds, once the content has been compacted into packs.
+    """
+    if reason == "deleted":
+        # Copies still queued would recreate objects the job deletes
+        await replication.cancel(db, file_hash)
+        # This job removes the loose chunks too, and must not be followed
+        # by one removing those of a later re-upload
+        await db.execute(delete(models.DeletionJob).where(
+            models.DeletionJob.file_hash == file_hash,
+            models.DeletionJob.reason == "packed",
+            models.DeletionJob.status == "pending",
+        ))
+    job = models.DeletionJob(
+        file_hash=file_hash,
+        chunk_count=chunk_count,
+        pack_count=pack_count,
+        reason=reason,
+        owner_id=owner_id,
+        status="pending",
+        backends=[backend.name for backend in replica_backends()],
+        attempts=0,
+        next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+    )
+    db.add(job)
+    await db.flush()
+    return job
+
+
+async def pending_for(db: AsyncSession, file_hash: str):
+    """Return an unfinished job for the content, if any."""
+    return await db.scalar(select(models.DeletionJob).where(
+        models.DeletionJob.file_hash == file_hash,
+        models.DeletionJob.status.in_(ACTIVE_STATUSES),
+    ).limit(1))
+
+
+def job_status(job: models.DeletionJob) -> dict:
+    return {
+        "job_id": job.id,
+        "file_hash": job.file_hash,
+        "status": job.status,
+        "attempts": job.attempts,
+        "remaining_backends": job.backends if job.status != "done" else [],
+        "last_error": job.last_error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class DeletionWorker:
+    def __init__(self, concurrency: int = DELETION_CONCURRENCY, poll_interval: float = DELETION_POLL_INTERVAL_SECONDS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the jobs in hand finish; unclaimed ones wait for the next start."""
+        if not self.running:
+            return
+        self._stopping = True
+        self.wake()
+        await self._task
+        self._task = None
+
+    def wake(self):
+        """Look for work now instead of at the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                claimed = await self._claim()
+            except Exception as e:
+                logger.warning(f"Claiming deletion jobs failed: {e}")
+                claimed = []
+            if claimed:
+                await asyncio.gather(*(self._process(job) for job in claimed))
+                continue
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), await self._idle_timeout())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _idle_timeout(self) -> float:
+        """Sleep until the next retry falls due, or at most one poll interval."""
+        try:
+            async with database.AsyncSessionLocal() as db:
+                next_due = await db.scalar(
+                    select(func.min(models.DeletionJob.next_attempt_at)).where(models.DeletionJob.status == "pending")
+                )
+        except Exception:
+            return self.poll_interval
+        if next_due is None:
+            return self.poll_interval
+        if next_due.tzinfo is None:
+            next_due = next_due.replace(tzinfo=timezone.utc)
+        wait = (next_due - datetime.now(timezone.utc)).total_seconds()
+        return min(max(wait, 0.01), self.poll_interval)
+
+    async def _claim(self) -> list:
+        now = datetime.now(timezone.utc)
+        due = or_(
+            and_(models.DeletionJob.status == "pending", models.DeletionJob.next_attempt_at <= now),
+            and_(models.DeletionJob.status == "running", models.DeletionJob.lease_expires_at <= now),
+        )
+        claimed = []
+        async with database.AsyncSessionLocal() as db:
+            candidates = (await db.scalars(
+                select(models.DeletionJob.id).where(due).order_by(models.DeletionJob.next_attempt_at).limit(self.concurrency)
+            )).all()
+            for job_id in candidates:
+                # Conditional update: only one worker wins each job
+                result = await db.execute(
+                    update(models.DeletionJob).where(models.DeletionJob.id == job_id, due).values(
+                        status="running",
+                        attempts=models.DeletionJob.attempts + 1,
+                        lease_expires_at=now + timedelta(seconds=DELETION_LEASE_SECONDS),
+                    )
+                )
+                if result.rowcount:
+                    claimed.append(job_id)
+            await db.commit()
+            if not claimed:
+                return []
+            return (await db.scalars(select(models.DeletionJob).where(models.DeletionJob.id.in_(claimed)))).all()
+
+    async def _process(self, job: models.DeletionJob):
+        if job.reason == "packed":
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    await content_store.relink_packs(db, job.file_hash)
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"Relinking packs of {job.file_hash} failed: {e}")
+                return
+        keys = job_keys(job)
+        names = list(job.backends)
+        outcomes = await asyncio.gather(
+            *(get_backend(name).delete_many(keys) for name in names), return_exceptions=True
+        )
+        remaining, errors = [], []
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, BaseException):
+                remaining.append(name)
+                errors.append(f"{name}: {outcome}")
+            elif outcome:
+                remaining.append(name)
+                errors.append(f"{name}: {len(outcome)} of {len(keys)} objects failed")
+
+        now = datetime.now(timezone.utc)
+        values = {"backends": remaining, "lease_expires_at": None, "last_error": "; ".join(errors) or None}
+        if not remaining:
+            values.update(status="done", finished_at=now)
+            if job.reason == "deleted":
+                # A download racing the delete may have cached chunks again;
+                # drop them before the hash can be uploaded with new IVs.
+                await chunk_cache.invalidate([chunk_key(job.file_hash, i) for i in range(job.chunk_count)])
+            logger.info(f"Deleted {len(keys)} objects of {job.file_hash} from {', '.join(names)}")
+        elif job.attempts >= DELETION_MAX_ATTEMPTS:
+            values.update(status="failed", finished_at=now)
+            logger.error(f"Giving up on deletion job {job.id} for {job.file_hash}: {values['last_error']}")
+        else:
+            delay = retry_delay(job.attempts)
+            values.update(status="pending", next_attempt_at=now + timedelta(seconds=delay))
+            logger.warning(f"Deletion job {job.id} attempt {job.attempts} failed, retrying in {delay:.0f}s: {values['last_error']}")
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await db.execute(update(models.DeletionJob).where(models.DeletionJob.id == job.id).values(**values))
+                await db.commit()
+        except Exception as e:
+            # The lease expires and the job runs again; deletes are idempotent
+            logger.warning(f"Recording deletion job {job.id} failed: {e}")
+
+
+deletion_worker = DeletionWorker()
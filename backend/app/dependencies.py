@@ -0,0 +1,69 @@
+# app/dependencies.py
+import os
+from fastapi import Depends, HTTPException, Request
+from jose import JWTError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, auth
+from .database import get_db
+from .utils.cache import TTLCache
+
+# Principals are cached per email so the chunk hot path doesn't hit the
+# users table on every request. Role changes made through the admin API
+# invalidate the entry immediately; the TTL bounds staleness for changes
+# made elsewhere (other workers, direct DB edits).
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60"))
+_principals = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+
+class Principal:
+    """The authenticated user as seen by route handlers, detached from any DB session."""
+
+    __slots__ = ("id", "email", "role")
+
+    def __init__(self, id: int, email: str, role: str):
+        self.id = id
+        self.email = email
+        self.role = role
+
+
+async def load_principal(db: AsyncSession, email: str):
+    """Return the cached principal for `email`, loading it from the DB on a miss. None if no such user."""
+    principal = _principals.get(email)
+    if principal is not None:
+        return principal
+    result = await db.execute(select(models.User.id, models.User.email, models.User.role).where(models.User.email == email))
+    row = result.first()
+    if row is None:
+        return None
+    principal = Principal(row.id, row.email, row.role)
+    _principals.set(email, principal)
+    return principal
+
+
+def invalidate_user(email: str):
+    _principals.pop(email)
+
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)) -> Principal:
+    """Authenticate the request from its access_token cookie.
+
+    Refresh tokens are only accepted by /user/refresh, which exchanges
+    them for a new access token.
+    """
+    token = request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Token missing")
+    try:
+        payload = auth.decode_token(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("type") == "refresh":
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    email = payload.get("sub")
+    user = await load_principal(db, email) if email else None
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
@@ -1,10 +1,20 @@
 # app/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .routes import user
-from .routes import file_upload,file_download,file_validation,superadmin_routes
+from .routes import file_upload,file_download,file_validation,superadmin_routes,monitoring
 # Add this temporarily to main.py
 from .database import Base, engine
-from . import models
+from . import models, database
+from .audit import audit_writer
+from .deletion import deletion_worker
+from .replication import replicator
+from .packing import packer
+from .dedup import verifier
+from services.chunk_cache import chunk_cache
+from services.metrics import MetricsMiddleware
+from .utils import virusTotal
+from .utils.yaraScanner import YARA_BACKEND, yara_engine
 
 #now we will setup cors
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,10 +26,34 @@ origins = [
 
 ]
 
-models.Base.metadata.create_all(bind=engine)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await database.create_schema(models.FileUpload, models.AuditLog, models.DeletionJob, models.ReplicationTask)
+    await audit_writer.start()
+    await deletion_worker.start()
+    await replicator.start()
+    await packer.start()
+    await verifier.start()
+    await chunk_cache.start()
+    if YARA_BACKEND == "local":
+        await yara_engine.start()
+    yield
+    # Flush queued audit events before the process exits
+    await audit_writer.stop()
+    await deletion_worker.stop()
+    await replicator.stop()
+    await packer.stop()
+    await verifier.stop()
+    await chunk_cache.stop()
+    await yara_engine.stop()
+    await virusTotal.close_client()
+    await file_validation.close_scanner_client()
+    await database.async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173"],  # React dev server
@@ -27,6 +61,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so latency includes CORS handling and the full response body
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(user.router)
@@ -34,6 +70,7 @@ app.include_router(file_upload.router)
 app.include_router(file_download.router)
 app.include_router(file_validation.router)
 app.include_router(superadmin_routes.router)
+app.include_router(monitoring.router)
 
 
 
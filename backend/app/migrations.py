@@ -0,0 +1,135 @@
+# app/migrations.py
+"""Schema upgrades for databases created by earlier releases.
+
+`create_all` only creates missing tables; it never alters one that
+exists. Each step registered here brings an existing table up to the
+current models and is idempotent, so startup runs every step each time
+instead of tracking a schema version. Steps run in order, inside the
+schema transaction, after `create_all` and before the model indexes are
+created.
+"""
+import json
+import logging
+from sqlalchemy import bindparam, inspect, text
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(step):
+    MIGRATIONS.append(step)
+    return step
+
+
+def column_names(connection, table: str) -> set:
+    return {column["name"] for column in inspect(connection).get_columns(table)}
+
+
+def index_names(connection, table: str) -> set:
+    inspector = inspect(connection)
+    names = {index["name"] for index in inspector.get_indexes(table)}
+    return names | {constraint["name"] for constraint in inspector.get_unique_constraints(table)}
+
+
+def add_column(connection, table: str, column: str, ddl: str) -> bool:
+    """Add `column` to `table` unless it exists. Returns True when it was added."""
+    if column in column_names(connection, table):
+        return False
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    logger.info(f"Added column {table}.{column}")
+    return True
+
+
+def upgrade(connection):
+    for step in MIGRATIONS:
+        step(connection)
+
+
+def _legacy_iv_count(ivs) -> int:
+    # Baseline uploads stored a JSON-encoded string in the JSON column
+    while isinstance(ivs, str):
+        try:
+            ivs = json.loads(ivs)
+        except ValueError:
+            return 0
+    return len(ivs) if isinstance(ivs, list) else 0
+
+
+@migration
+def files_upload_sessions(connection):
+    """Upload sessions: files.status and files.size, unique per owner and hash."""
+    if add_column(connection, "files", "status", "VARCHAR DEFAULT 'complete'"):
+        # Every row written before sessions existed is a finished upload
+        connection.execute(text("UPDATE files SET status = 'complete' WHERE status IS NULL"))
+    add_column(connection, "files", "size", "BIGINT")
+    # Plaintext size is the sum of the manifest's encrypted sizes less one GCM
+    # tag per chunk. Files with only a legacy `ivs` list have no recorded
+    # chunk sizes; they keep a NULL size and downloads fall back accordingly.
+    connection.execute(text(
+        "UPDATE files SET size = (SELECT SUM(c.size - 16) FROM file_chunks c WHERE c.file_id = files.id) "
+        "WHERE size IS NULL AND status = 'complete' "
+        "AND EXISTS (SELECT 1 FROM file_chunks c WHERE c.file_id = files.id) "
+        "AND NOT EXISTS (SELECT 1 FROM file_chunks c WHERE c.file_id = files.id AND c.size IS NULL)"
+    ))
+
+    if "uq_files_owner_hash" in index_names(connection, "files"):
+        return
+    # Before the constraint, racing first chunks could record the same
+    # upload twice. The rows share the same `{file_hash}/chunk_i` objects, so
+    # keep the one with a full IV list (the newest, if several) and drop the rest.
+    duplicates = connection.execute(text(
+        "SELECT owner_id, file_hash FROM files WHERE owner_id IS NOT NULL AND file_hash IS NOT NULL "
+        "GROUP BY owner_id, file_hash HAVING COUNT(*) > 1"
+    )).all()
+    for owner_id, file_hash in duplicates:
+        rows = connection.execute(text(
+            "SELECT id, chunk_count, ivs, (SELECT COUNT(*) FROM file_chunks c WHERE c.file_id = files.id) "
+            "FROM files WHERE owner_id = :owner_id AND file_hash = :file_hash"
+        ), {"owner_id": owner_id, "file_hash": file_hash}).all()
+        keep = max(rows, key=lambda row: (max(row[3], _legacy_iv_count(row[2])) >= (row[1] or 0), row[0]))[0]
+        drop = [row[0] for row in rows if row[0] != keep]
+        for statement in ("DELETE FROM file_chunks WHERE file_id IN :ids", "DELETE FROM files WHERE id IN :ids"):
+            connection.execute(text(statement).bindparams(bindparam("ids", expanding=True)), {"ids": drop})
+        logger.warning(f"Removed duplicate file rows {drop} of owner {owner_id} for {file_hash}; kept {keep}")
+    # A unique index rather than ALTER TABLE ... ADD CONSTRAINT, which SQLite lacks
+    connection.execute(text("CREATE UNIQUE INDEX uq_files_owner_hash ON files (owner_id, file_hash)"))
+    logger.info("Added unique index uq_files_owner_hash")
+
+
+@migration
+def files_replication_state(connection):
+    """files.replication_state; everything stored before the outbox is on every replica."""
+    if add_column(connection, "files", "replication_state", "VARCHAR DEFAULT 'replicated'"):
+        connection.execute(text("UPDATE files SET replication_state = 'replicated' WHERE replication_state IS NULL"))
+
+
+# Audit rows backfilled per statement; each batch is decrypted in parallel
+AUDIT_BACKFILL_BATCH_SIZE = 1000
+
+
+@migration
+def audit_ip_blind_index(connection):
+    """audit_logs.ip_hmac, backfilled by decrypting each stored IP."""
+    from .audit import encryptor
+
+    add_column(connection, "audit_logs", "ip_hmac", "VARCHAR(64)")
+    # Also catches rows written by an older process during a rolling deploy.
+    # IPs that no longer decrypt get an empty index, which no lookup matches,
+    # so they aren't retried on every start.
+    last_id, filled = 0, 0
+    while True:
+        rows = connection.execute(text(
+            "SELECT id, ip FROM audit_logs WHERE ip_hmac IS NULL AND ip IS NOT NULL AND id > :last_id "
+            "ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": AUDIT_BACKFILL_BATCH_SIZE}).all()
+        if not rows:
+            break
+        ips = encryptor.decrypt_many([row.ip for row in rows])
+        connection.execute(text("UPDATE audit_logs SET ip_hmac = :ip_hmac WHERE id = :id"), [
+            {"id": row.id, "ip_hmac": encryptor.blind_index(ip) if ip is not None else ""}
+            for row, ip in zip(rows, ips)
+        ])
+        last_id, filled = rows[-1].id, filled + len(rows)
+    if filled:
+        logger.info(f"Backfilled the IP blind index of {filled} audit log rows")
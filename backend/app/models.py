@@ -1,5 +1,5 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime , JSON
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime , JSON, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -14,23 +14,144 @@ class User(Base):
 
 class FileUpload(Base):
     __tablename__ = "files"
+    # One upload session per owner and content; also lets concurrent chunk
+    # requests race to create it safely.
+    # The listing indexes match /my-files' keyset pagination; file_hash alone
+    # serves downloads and dedup lookups across owners.
+    __table_args__ = (
+        UniqueConstraint("owner_id", "file_hash", name="uq_files_owner_hash"),
+        Index("ix_files_owner_status_created_id", "owner_id", "status", "created_at", "id"),
+        Index("ix_files_owner_status_name_id", "owner_id", "status", "file_name", "id"),
+        Index("ix_files_status_created_id", "status", "created_at", "id"),
+        Index("ix_files_file_hash", "file_hash"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     file_name = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))    
     file_hash = Column(String)
     chunk_count = Column(Integer)
-    ivs = Column(JSON)  # Base64-encoded IVs for each chunk
+    size = Column(BigInteger)  # Plaintext size in bytes, when declared by the client
+    status = Column(String, default="uploading", server_default="complete")  # uploading | complete
+    ivs = Column(JSON)  # Legacy per-file IV list; new uploads use FileChunk rows
     aws_url = Column(String)  # AWS S3 URL
     azure_url = Column(String)  # Azure Blob Storage URL
     encrypted_key = Column(String)  # Base64-encoded AES key (encrypted)
+    # replicated | pending | degraded. Until "replicated", some chunks are
+    # only on the replicas listed in their FileChunk row.
+    replication_state = Column(String, default="replicated")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class FileChunk(Base):
+    __tablename__ = "file_chunks"
+    # The unique key doubles as the index the download manifest query uses.
+    __table_args__ = (UniqueConstraint("file_id", "chunk_index", name="uq_file_chunks_file_index"),)
+
+    id = Column(Integer, primary_key=True)
+    file_id = Column(Integer, ForeignKey("files.id", ondelete="CASCADE"), nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    iv = Column(LargeBinary(12), nullable=False)  # AES-GCM nonce
+    size = Column(Integer)  # Encrypted size in bytes (plaintext + 16-byte tag)
+    replicas = Column(String)  # Comma-separated storage backends holding the chunk
+    # Once packed, the chunk is bytes [pack_offset, pack_offset + size) of the pack object
+    pack_key = Column(String)
+    pack_offset = Column(BigInteger)
+
+
+class StoredContent(Base):
+    __tablename__ = "stored_contents"
+
+    id = Column(Integer, primary_key=True)
+    file_hash = Column(String, unique=True, nullable=False)
+    chunk_count = Column(Integer)
+    refcount = Column(Integer, nullable=False, default=0)  # Completed FileUpload rows using these chunks
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # NULL (unchecked) | verified | mismatch: whether the content hashes to
+    # file_hash; checked before it first serves as a dedup donor
+    verification = Column(String)
+    # Packing into larger objects: NULL (loose) | packing | retry | packed | failed
+    pack_state = Column(String)
+    pack_count = Column(Integer, nullable=False, default=0)  # Pack objects {file_hash}/pack_n
+    pack_attempts = Column(Integer, nullable=False, default=0)
+    pack_claimed_by = Column(String)
+    pack_lease_expires_at = Column(DateTime(timezone=True))  # While packing; also when a retry is due
+
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
+    # Keyset pagination walks (timestamp, id); the filtered variants lead
+    # with the filter column so each page is a single index range scan.
+    __table_args__ = (
+        Index("ix_audit_logs_timestamp_id", "timestamp", "id"),
+        Index("ix_audit_logs_user_timestamp_id", "user_id", "timestamp", "id"),
+        Index("ix_audit_logs_action_timestamp_id", "action", "timestamp", "id"),
+        Index("ix_audit_logs_ip_hmac_timestamp_id", "ip_hmac", "timestamp", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     action = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
     ip = Column(String)
+    ip_hmac = Column(String(64))  # Blind index of the plaintext IP for equality lookups
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class VirusTotalVerdict(Base):
+    __tablename__ = "virustotal_verdicts"
+    file_hash = Column(String, primary_key=True)
+    verdict = Column(String, nullable=False)  # clean | malicious | not_found
+    result = Column(JSON)  # The lookup result as returned to callers
+    checked_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+class ScanVerdict(Base):
+    __tablename__ = "scan_verdicts"
+    file_hash = Column(String, primary_key=True)  # SHA-256 of the scanned content
+    verdict = Column(String, nullable=False)  # clean | malicious
+    result = Column(JSON)  # The merged /validate result
+    checked_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+class DeletionJob(Base):
+    __tablename__ = "deletion_jobs"
+    # The worker polls for due jobs; uploads check for pending ones by hash.
+    __table_args__ = (
+        Index("ix_deletion_jobs_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_deletion_jobs_file_hash_status", "file_hash", "status"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    file_hash = Column(String, nullable=False)
+    chunk_count = Column(Integer, nullable=False)
+    pack_count = Column(Integer, nullable=False, default=0)
+    # deleted: the content is gone; packed: only its loose chunk objects are
+    reason = Column(String, nullable=False, default="deleted")
+    owner_id = Column(Integer, ForeignKey("users.id"))  # Who requested the deletion
+    status = Column(String, nullable=False, default="pending")  # pending | running | done | failed
+    backends = Column(JSON, nullable=False)  # Storage backends still holding the objects
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    lease_expires_at = Column(DateTime(timezone=True))  # While running; an expired lease is picked up again
+    finished_at = Column(DateTime(timezone=True))
+
+class ReplicationTask(Base):
+    """Outbox row: copy one chunk object from `source` to the `target` backend."""
+    __tablename__ = "replication_outbox"
+    __table_args__ = (
+        UniqueConstraint("file_hash", "chunk_index", "target", name="uq_replication_outbox_chunk_target"),
+        Index("ix_replication_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    file_hash = Column(String, nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    source = Column(String, nullable=False)
+    target = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | running | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String)
+    claimed_by = Column(String)  # Token of the replicator batch holding the lease
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    lease_expires_at = Column(DateTime(timezone=True))
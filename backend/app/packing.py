@@ -0,0 +1,254 @@
+# app/packing.py
+"""Compaction of a file's chunk objects into a few large pack objects.
+
+Uploads store every ~300 KB chunk as its own object, so request counts and
+per-object overhead dominate for large files. Once content is complete
+(and fully replicated), the Packer copies its chunks, in order, into pack
+objects of about PACK_TARGET_SIZE bytes on every replica, streaming them
+with the backends' multipart writers. The manifest then records each
+chunk's pack and offset, and downloads read chunks with ranged GETs,
+coalescing neighbours into a single request.
+
+The loose chunk objects are removed by a deletion job after
+PACK_CHUNK_GRACE_SECONDS, so downloads that loaded the old manifest can
+finish. Pack layout is a pure function of the chunk sizes, so every
+replica gets identical packs and a re-run produces the same objects.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, bindparam, exists, or_, select, update
+from . import models, database, deletion
+from services.storage import iter_chunks, pack_key, primary_backend, replica_backends
+
+logger = logging.getLogger(__name__)
+
+PACK_TARGET_SIZE = int(os.getenv("PACK_TARGET_SIZE", str(32 * 1024 * 1024)))
+# Content with fewer chunks stays loose; packing it saves little
+PACK_MIN_CHUNKS = int(os.getenv("PACK_MIN_CHUNKS", "8"))
+PACK_CHUNK_GRACE_SECONDS = float(os.getenv("PACK_CHUNK_GRACE_SECONDS", "600"))
+PACK_CONCURRENCY = int(os.getenv("PACK_CONCURRENCY", "2"))
+PACK_POLL_INTERVAL_SECONDS = float(os.getenv("PACK_POLL_INTERVAL_SECONDS", "30"))
+PACK_MAX_ATTEMPTS = int(os.getenv("PACK_MAX_ATTEMPTS", "5"))
+PACK_RETRY_BASE_SECONDS = float(os.getenv("PACK_RETRY_BASE_SECONDS", "60"))
+PACK_LEASE_SECONDS = float(os.getenv("PACK_LEASE_SECONDS", "1800"))
+
+
+class PackingError(Exception):
+    pass
+
+
+def plan_packs(sizes: list, target_size: int = PACK_TARGET_SIZE) -> list:
+    """Return (pack_index, offset) for each chunk, filling packs in chunk order."""
+    placements = []
+    pack_index, offset = 0, 0
+    for size in sizes:
+        if offset and offset + size > target_size:
+            pack_index, offset = pack_index + 1, 0
+        placements.append((pack_index, offset))
+        offset += size
+    return placements
+
+
+async def write_packs(file_hash: str, sizes: list, placements: list):
+    """Stream the chunks from the primary into pack objects on every replica."""
+    backends = replica_backends()
+    writers = []
+
+    async def close_all():
+        await asyncio.gather(*(writer.close() for writer in writers))
+        writers.clear()
+
+    try:
+        current = None
+        index = 0
+        async for data in iter_chunks(primary_backend(), file_hash, len(sizes)):
+            if len(data) != sizes[index]:
+                raise PackingError(f"Chunk {index} is {len(data)} bytes, manifest says {sizes[index]}")
+            pack_index, _ = placements[index]
+            if pack_index != current:
+                await close_all()
+                writers.extend(backend.open_writer(pack_key(file_hash, pack_index)) for backend in backends)
+                current = pack_index
+            await asyncio.gather(*(writer.write(data) for writer in writers))
+            index += 1
+        await close_all()
+    except BaseException:
+        await asyncio.gather(*(writer.abort() for writer in writers), return_exceptions=True)
+        raise
+
+
+async def delete_packs(file_hash: str, pack_count: int):
+    keys = [pack_key(file_hash, n) for n in range(pack_count)]
+    for backend in replica_backends():
+        failed = await backend.delete_many(keys)
+        if failed:
+            logger.warning(f"{len(failed)} packs of {file_hash} could not be deleted from {backend.name}")
+
+
+class Packer:
+    def __init__(self, concurrency: int = PACK_CONCURRENCY, poll_interval: float = PACK_POLL_INTERVAL_SECONDS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the contents in hand are packed."""
+        if not self.running:
+            return
+        self._stopping = True
+        self.wake()
+        await self._task
+        self._task = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                token, claimed = await self._claim()
+            except Exception as e:
+                logger.warning(f"Claiming content to pack failed: {e}")
+                token, claimed = None, []
+            if claimed:
+                await asyncio.gather(*(self._pack(token, content) for content in claimed))
+                continue
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self):
+        now = datetime.now(timezone.utc)
+        token = uuid.uuid4().hex
+        content = models.StoredContent
+        due = or_(
+            content.pack_state.is_(None),
+            and_(content.pack_state.in_(("packing", "retry")), content.pack_lease_expires_at <= now),
+        )
+        # Only once every replica has every chunk
+        ready = exists().where(
+            models.FileUpload.file_hash == content.file_hash,
+            models.FileUpload.status == "complete",
+            or_(models.FileUpload.replication_state.is_(None), models.FileUpload.replication_state == "replicated"),
+        )
+        async with database.AsyncSessionLocal() as db:
+            candidates = (await db.scalars(
+                select(content.id).where(due, ready, content.chunk_count >= PACK_MIN_CHUNKS)
+                .order_by(content.id).limit(self.concurrency)
+            )).all()
+            if not candidates:
+                return token, []
+            await db.execute(update(content).where(content.id.in_(candidates), due).values(
+                pack_state="packing",
+                pack_claimed_by=token,
+                pack_attempts=content.pack_attempts + 1,
+                pack_lease_expires_at=now + timedelta(seconds=PACK_LEASE_SECONDS),
+            ).execution_options(synchronize_session=False))
+            await db.commit()
+            claimed = (await db.scalars(select(content).where(content.pack_claimed_by == token))).all()
+        return token, claimed
+
+    async def _pack(self, token: str, content: models.StoredContent):
+        file_hash = content.file_hash
+        try:
+            async with database.AsyncSessionLocal() as db:
+                donor = await db.scalar(select(models.FileUpload.id).where(
+                    models.FileUpload.file_hash == file_hash, models.FileUpload.status == "complete",
+                ).limit(1))
+                sizes = (await db.scalars(
+                    select(models.FileChunk.size).where(models.FileChunk.file_id == donor).order_by(models.FileChunk.chunk_index)
+                )).all() if donor is not None else []
+            if donor is None:
+                return  # Deleted since it was claimed
+            if len(sizes) != content.chunk_count or any(size is None for size in sizes):
+                # Chunks uploaded before sizes were recorded can't be located in a pack
+                await self._settle(token, file_hash, pack_state="failed")
+                return
+
+            placements = plan_packs(sizes)
+            pack_count = placements[-1][0] + 1
+            await write_packs(file_hash, sizes, placements)
+        except Exception as e:
+            attempts = content.pack_attempts
+            if attempts >= PACK_MAX_ATTEMPTS:
+                logger.error(f"Giving up packing {file_hash}: {e}")
+                await self._settle(token, file_hash, pack_state="failed")
+            else:
+                delay = PACK_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+                logger.warning(f"Packing {file_hash} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+                await self._settle(token, file_hash, pack_state="retry",
+                                   pack_lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=delay))
+            return
+
+        try:
+            if not await self._publish(token, content, placements, pack_count):
+                # The content was deleted meanwhile; the packs are now orphans
+                await delete_packs(file_hash, pack_count)
+                return
+        except Exception as e:
+            # Lease expiry retries; the rewritten packs are identical
+            logger.warning(f"Recording packs of {file_hash} failed: {e}")
+            return
+        logger.info(f"Packed {content.chunk_count} chunks of {file_hash} into {pack_count} objects")
+
+    async def _publish(self, token: str, content: models.StoredContent, placements: list, pack_count: int) -> bool:
+        """Switch the manifest over to the packs and schedule the loose chunks' removal."""
+        file_hash = content.file_hash
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(update(models.StoredContent).where(
+                models.StoredContent.id == content.id,
+                models.StoredContent.pack_claimed_by == token,
+            ).values(pack_state="packed", pack_count=pack_count, pack_lease_expires_at=None))
+            if not result.rowcount:
+                still_stored = await db.scalar(select(models.StoredContent.id).where(models.StoredContent.file_hash == file_hash))
+                # Another packer took over after our lease expired; its packs are ours
+                return still_stored is not None
+
+            chunks = models.FileChunk.__table__
+            files = select(models.FileUpload.id).where(models.FileUpload.file_hash == file_hash)
+            await db.execute(
+                chunks.update().where(chunks.c.file_id.in_(files), chunks.c.chunk_index == bindparam("index"))
+                .values(pack_key=bindparam("key"), pack_offset=bindparam("offset")),
+                [
+                    {"index": index, "key": pack_key(file_hash, pack_index), "offset": offset}
+                    for index, (pack_index, offset) in enumerate(placements)
+                ],
+            )
+            await deletion.enqueue(db, file_hash, content.chunk_count, reason="packed", delay=PACK_CHUNK_GRACE_SECONDS)
+            await db.commit()
+        return True
+
+    async def _settle(self, token: str, file_hash: str, **values):
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await db.execute(update(models.StoredContent).where(
+                    models.StoredContent.file_hash == file_hash,
+                    models.StoredContent.pack_claimed_by == token,
+                ).values(**values))
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Recording packing state of {file_hash} failed: {e}")
+
+
+packer = Packer()
@@ -0,0 +1,252 @@
+# app/replication.py
+"""Write-primary-then-replicate for chunk objects.
+
+With UPLOAD_REPLICATION_MODE=async a chunk is acknowledged once it is
+stored on one backend (the primary, or the secondary if the primary
+fails) and a ReplicationTask for each other replica has been committed
+with its manifest row. With "sync" every replica is written during the
+request as before, and the outbox only repairs replicas whose write failed.
+
+The Replicator drains the outbox in the background. It claims due tasks
+in batches under a lease, copies them with bounded concurrency, and
+retries failures with exponential backoff. A copied chunk is added to the
+replica list of its FileChunk rows, and once a content hash has no tasks
+left its files are marked replicated. Until then downloads only read each
+chunk from the replicas listed for it.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, delete, func, not_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, database
+from services.storage import chunk_key, get_backend
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_REPLICATION_MODE = os.getenv("UPLOAD_REPLICATION_MODE", "sync").lower()
+REPLICATION_BATCH_SIZE = int(os.getenv("REPLICATION_BATCH_SIZE", "100"))
+REPLICATION_CONCURRENCY = int(os.getenv("REPLICATION_CONCURRENCY", "8"))
+# After a wake-up, wait this long so chunks arriving together share a batch
+REPLICATION_LINGER_MS = int(os.getenv("REPLICATION_LINGER_MS", "100"))
+REPLICATION_POLL_INTERVAL_SECONDS = float(os.getenv("REPLICATION_POLL_INTERVAL_SECONDS", "10"))
+REPLICATION_MAX_ATTEMPTS = int(os.getenv("REPLICATION_MAX_ATTEMPTS", "10"))
+REPLICATION_RETRY_BASE_SECONDS = float(os.getenv("REPLICATION_RETRY_BASE_SECONDS", "2"))
+REPLICATION_RETRY_MAX_SECONDS = float(os.getenv("REPLICATION_RETRY_MAX_SECONDS", "600"))
+REPLICATION_LEASE_SECONDS = float(os.getenv("REPLICATION_LEASE_SECONDS", "300"))
+
+
+def retry_delay(attempts: int) -> float:
+    return min(REPLICATION_RETRY_BASE_SECONDS * 2 ** (attempts - 1), REPLICATION_RETRY_MAX_SECONDS)
+
+
+async def enqueue(db: AsyncSession, file: models.FileUpload, chunk_index: int, source: str, targets: list):
+    """Record that a chunk stored on `source` must be copied to `targets`.
+
+    The caller commits the tasks together with the chunk's manifest row,
+    then calls `replicator.wake()`. A retried chunk replaces its earlier tasks.
+    """
+    if not targets:
+        return
+    await db.execute(delete(models.ReplicationTask).where(
+        models.ReplicationTask.file_hash == file.file_hash,
+        models.ReplicationTask.chunk_index == chunk_index,
+        models.ReplicationTask.target.in_(targets),
+    ))
+    now = datetime.now(timezone.utc)
+    db.add_all([
+        models.ReplicationTask(
+            file_hash=file.file_hash, chunk_index=chunk_index, source=source, target=target,
+            status="pending", attempts=0, next_attempt_at=now,
+        )
+        for target in targets
+    ])
+    # An explicit UPDATE, so it also lands when the loaded row already read "pending"
+    await db.execute(update(models.FileUpload).where(models.FileUpload.id == file.id)
+                     .values(replication_state="pending").execution_options(synchronize_session=False))
+    file.replication_state = "pending"
+
+
+async def cancel(db: AsyncSession, file_hash: str):
+    """Drop outstanding tasks for content whose objects are being deleted."""
+    await db.execute(delete(models.ReplicationTask).where(models.ReplicationTask.file_hash == file_hash))
+
+
+class Replicator:
+    def __init__(self, batch_size: int = REPLICATION_BATCH_SIZE, concurrency: int = REPLICATION_CONCURRENCY,
+                 poll_interval: float = REPLICATION_POLL_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the batch in hand is recorded; the rest stays in the outbox."""
+        if not self.running:
+            return
+        self._stopping = True
+        self.wake()
+        await self._task
+        self._task = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                token, tasks = await self._claim()
+            except Exception as e:
+                logger.warning(f"Claiming replication tasks failed: {e}")
+                token, tasks = None, []
+            if tasks:
+                await self._process(token, tasks)
+                continue
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), await self._idle_timeout())
+                await asyncio.sleep(REPLICATION_LINGER_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _idle_timeout(self) -> float:
+        """Sleep until the next retry falls due, or at most one poll interval."""
+        try:
+            async with database.AsyncSessionLocal() as db:
+                next_due = await db.scalar(
+                    select(func.min(models.ReplicationTask.next_attempt_at)).where(models.ReplicationTask.status == "pending")
+                )
+        except Exception:
+            return self.poll_interval
+        if next_due is None:
+            return self.poll_interval
+        if next_due.tzinfo is None:
+            next_due = next_due.replace(tzinfo=timezone.utc)
+        wait = (next_due - datetime.now(timezone.utc)).total_seconds()
+        return min(max(wait, 0.01), self.poll_interval)
+
+    async def _claim(self):
+        now = datetime.now(timezone.utc)
+        token = uuid.uuid4().hex
+        due = or_(
+            and_(models.ReplicationTask.status == "pending", models.ReplicationTask.next_attempt_at <= now),
+            and_(models.ReplicationTask.status == "running", models.ReplicationTask.lease_expires_at <= now),
+        )
+        async with database.AsyncSessionLocal() as db:
+            candidates = (await db.scalars(
+                select(models.ReplicationTask.id).where(due)
+                .order_by(models.ReplicationTask.next_attempt_at).limit(self.batch_size)
+            )).all()
+            if not candidates:
+                return token, []
+            # Re-checking `due` means a task another replicator claimed meanwhile is skipped
+            await db.execute(
+                update(models.ReplicationTask).where(models.ReplicationTask.id.in_(candidates), due).values(
+                    status="running",
+                    claimed_by=token,
+                    attempts=models.ReplicationTask.attempts + 1,
+                    lease_expires_at=now + timedelta(seconds=REPLICATION_LEASE_SECONDS),
+                ).execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            tasks = (await db.scalars(select(models.ReplicationTask).where(models.ReplicationTask.claimed_by == token))).all()
+        return token, tasks
+
+    async def _process(self, token: str, tasks: list):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def copy(task):
+            key = chunk_key(task.file_hash, task.chunk_index)
+            async with slots:
+                try:
+                    data = await get_backend(task.source).get(key)
+                    await get_backend(task.target).put(key, data)
+                except Exception as e:
+                    return f"{task.source} -> {task.target}: {e}"
+            return None
+
+        errors = await asyncio.gather(*(copy(task) for task in tasks))
+        try:
+            await self._record(token, tasks, errors)
+        except Exception as e:
+            # The leases expire and the tasks run again; copies are idempotent
+            logger.warning(f"Recording {len(tasks)} replication results failed: {e}")
+
+    async def _record(self, token: str, tasks: list, errors: list):
+        now = datetime.now(timezone.utc)
+        copied, degraded, cancelled = set(), set(), []
+        async with database.AsyncSessionLocal() as db:
+            for task, error in zip(tasks, errors):
+                mine = and_(models.ReplicationTask.id == task.id, models.ReplicationTask.claimed_by == token)
+                if error is None:
+                    result = await db.execute(delete(models.ReplicationTask).where(mine))
+                    if not result.rowcount:
+                        # Replaced by a retried chunk, or the content was deleted
+                        cancelled.append(task)
+                        continue
+                    await db.execute(
+                        update(models.FileChunk).where(
+                            models.FileChunk.chunk_index == task.chunk_index,
+                            models.FileChunk.file_id.in_(
+                                select(models.FileUpload.id).where(models.FileUpload.file_hash == task.file_hash)
+                            ),
+                            not_(models.FileChunk.replicas.contains(task.target)),
+                        ).values(replicas=models.FileChunk.replicas + "," + task.target)
+                        .execution_options(synchronize_session=False)
+                    )
+                    copied.add(task.file_hash)
+                    continue
+
+                values = {"last_error": error, "lease_expires_at": None, "claimed_by": None}
+                if task.attempts >= REPLICATION_MAX_ATTEMPTS:
+                    values["status"] = "failed"
+                    degraded.add(task.file_hash)
+                    logger.error(f"Giving up replicating chunk {task.chunk_index} of {task.file_hash}: {error}")
+                else:
+                    delay = retry_delay(task.attempts)
+                    values.update(status="pending", next_attempt_at=now + timedelta(seconds=delay))
+                    logger.warning(f"Replicating chunk {task.chunk_index} of {task.file_hash} failed "
+                                   f"(attempt {task.attempts}), retrying in {delay:.0f}s: {error}")
+                await db.execute(update(models.ReplicationTask).where(mine).values(**values))
+
+            for file_hash in degraded:
+                await db.execute(update(models.FileUpload).where(models.FileUpload.file_hash == file_hash)
+                                 .values(replication_state="degraded"))
+            for file_hash in copied - degraded:
+                # One statement, so a task enqueued meanwhile keeps the file pending
+                outstanding = select(models.ReplicationTask.id).where(models.ReplicationTask.file_hash == file_hash)
+                await db.execute(update(models.FileUpload).where(
+                    models.FileUpload.file_hash == file_hash,
+                    models.FileUpload.replication_state == "pending",
+                    ~outstanding.exists(),
+                ).values(replication_state="replicated").execution_options(synchronize_session=False))
+            await db.commit()
+
+            for task in cancelled:
+                # A copy that finished after its content was deleted would be orphaned
+                if await db.scalar(select(models.FileUpload.id).where(models.FileUpload.file_hash == task.file_hash).limit(1)) is None:
+                    await get_backend(task.target).delete_many([chunk_key(task.file_hash, task.chunk_index)])
+        replicated = sum(error is None for error in errors) - len(cancelled)
+        if replicated:
+            logger.info(f"Replicated {replicated} chunks")
+
+
+replicator = Replicator()
@@ -1,193 +1,198 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, Query, Request
-from sqlalchemy.orm import Session
-from jose import jwt, JWTError
-from .. import models, database
-from services.aws import download_chunks_from_s3
-from services.azure import download_chunks_azure
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from .. import models
 import os
 import base64
-import json
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from ..utils.IpEncryption import AES256Encryptor
+import logging
+import secrets
+from ..chunk_reader import ChunkLayout, ManifestError, decrypt_chunks, decrypt_range, load_manifest
+from ..dependencies import Principal, get_current_user, get_db
+from .. import audit
+from ..utils.httpRange import RangeNotSatisfiable, parse_range_header
+from ..utils.pagination import InvalidCursor, encode_cursor, keyset_after
 router = APIRouter(tags=["Download"])
-SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-ALGORITHM = os.getenv("JWT_ALGORITHM")
+logger = logging.getLogger(__name__)
 
+MY_FILES_PAGE_MAX = int(os.getenv("MY_FILES_PAGE_MAX", "200"))
 
 
+async def multipart_ranges(file_hash: str, ivs: list, key_bytes: bytes, offsets: list, ranges: list, boundary: str,
+                           layout: ChunkLayout = None):
+    for header, (start, end) in zip(part_headers(ranges, boundary, offsets[-1]), ranges):
+        yield header
+        async for piece in decrypt_range(file_hash, ivs, key_bytes, offsets, start, end, layout):
+            yield piece
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
 
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def part_headers(ranges: list, boundary: str, total: int) -> list:
+    return [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: application/octet-stream\r\n"
+            f"Content-Range: bytes {start}-{end}/{total}\r\n\r\n"
+        ).encode()
+        for start, end in ranges
+    ]
+
+
+async def _prepend(first: bytes, rest):
+    yield first
+    async for chunk in rest:
+        yield chunk
+
 
 @router.get("/download")
 async def download_file(
     request: Request,
     file_hash: str = Query(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
 ):
-    print(f"\n=== Starting download for file_hash: {file_hash} ===")
-    
-    # TODO: Replace hardcoded token with real auth from cookies or headers
-    token = request.cookies.get("access_token")
-
-    try:
-        print("Decoding JWT token...")  # DEBUG
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"Decoded payload: {payload}")  # DEBUG
-        user_email = payload.get("sub")
-        print(f"Extracted email from token: {user_email}")  # DEBUG
-
-        user = db.query(models.User).filter(models.User.email == user_email).first()
-        if not user:
-            print("User not found in database")  # DEBUG
-            raise HTTPException(status_code=403, detail="User not found")
-        else:
-            print(f"User found: {user.email} (ID: {user.id})")  # DEBUG
-
-    except JWTError as e:
-        print(f"JWT decoding failed: {e}")  # DEBUG
-        raise HTTPException(status_code=403, detail="Invalid token")
-    
     # Log download attempt
     client_ip = request.client.host
-    encrypted_ip = encryptor.encrypt(client_ip)
-    print(f"Download request from IP: {client_ip}, user: {user_email}")
-    audit_log = models.AuditLog(
-        action="download",
-        user_id=user.id,
-        ip=encrypted_ip
-    )
-    db.add(audit_log)
-    db.commit()
-    print("Audit log entry committed")  # DEBUG
-
-    # Retrieve file metadata
-    print(f"Fetching file metadata for hash: {file_hash}")  # DEBUG
-    file = db.query(models.FileUpload).filter(models.FileUpload.file_hash == file_hash).first()
+    logger.info(f"Download of {file_hash} requested by {user.email} from {client_ip}")
+    await audit.record("download", user.id, client_ip)
+
+    # Retrieve file metadata; only the caller's own copy is served
+    file = await db.scalar(select(models.FileUpload).where(
+        models.FileUpload.file_hash == file_hash,
+        models.FileUpload.owner_id == user.id,
+        models.FileUpload.status == "complete",
+    ).limit(1))
     if not file:
-        print("File not found in DB")  # DEBUG
         raise HTTPException(status_code=404, detail="File not found")
 
-    print(f"File found: {file.file_name}, chunk count: {file.chunk_count}")  # DEBUG
-    print(f"IVs stored: {file.ivs} (type: {type(file.ivs)})")  # DEBUG
+    logger.debug(f"Serving file {file.id} ({file.chunk_count} chunks)")
 
-    # Download encrypted chunks with AWS primary, Azure fallback
-    print("Attempting to download chunks from AWS S3...")  # DEBUG
     try:
-        print(f"Downloaded {len(chunks)} chunks from S3")  # DEBUG
-        chunks = download_chunks_from_s3(file_hash, file.chunk_count)
-        print("chunk size:", len(chunks[0]))  # DEBUG
-    except Exception as aws_error:
-        print(f"AWS S3 download failed: {aws_error}")  # DEBUG
-        print("Falling back to Azure Blob Storage...")  # DEBUG
-        try:
-            chunks = download_chunks_azure(file_hash, file.chunk_count)
-            print(f"Downloaded {len(chunks)} chunks from Azure Blob Storage")  # DEBUG
-            
-        except Exception as azure_error:
-            print(f"Azure fallback failed: {azure_error}")  # DEBUG
-            raise HTTPException(status_code=500, detail="Failed to download file from both AWS and Azure")
-
-
-    # Prepare decryption
-    decrypted_data = bytearray()
-    key_b64 = file.encrypted_key
-    print(f"Encrypted key (base64): {key_b64}")  # DEBUG
-
-    key_bytes = base64.b64decode(key_b64)
-    print(f"Decoded key bytes length: {len(key_bytes)}")  # DEBUG
+        ivs, sizes, layout = await load_manifest(db, file)
+    except ManifestError as e:
+        logger.error(f"Manifest of file {file.id} is unreadable: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    key_bytes = base64.b64decode(file.encrypted_key)
+    headers = {"Content-Disposition": f"attachment; filename={file.file_name}"}
+
+    if sizes is None:
+        # Chunk sizes unknown (legacy upload): ranges can't be mapped.
+        return await start_stream(decrypt_chunks(file_hash, ivs, key_bytes, layout=layout), 200, headers)
+
+    offsets = [0]
+    for size in sizes:
+        offsets.append(offsets[-1] + size)
+    total = offsets[-1]
+    etag = f'"{file_hash}"'
+    headers.update({"Accept-Ranges": "bytes", "ETag": etag})
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        range_header = None
+    try:
+        ranges = parse_range_header(range_header, total)
+    except RangeNotSatisfiable:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{total}"})
+
+    if ranges is None:
+        headers["Content-Length"] = str(total)
+        return await start_stream(decrypt_chunks(file_hash, ivs, key_bytes, layout=layout), 200, headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+        headers["Content-Length"] = str(end - start + 1)
+        return await start_stream(decrypt_range(file_hash, ivs, key_bytes, offsets, start, end, layout), 206, headers)
+
+    boundary = secrets.token_hex(16)
+    length = sum(len(h) for h in part_headers(ranges, boundary, total))
+    length += sum(end - start + 1 + 2 for start, end in ranges) + len(f"--{boundary}--\r\n")
+    headers["Content-Length"] = str(length)
+    return await start_stream(
+        multipart_ranges(file_hash, ivs, key_bytes, offsets, ranges, boundary, layout), 206, headers,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+    )
 
-    ivs = file.ivs
-    if isinstance(ivs, str):
-        print("IVs is a string; attempting JSON parse")  # DEBUG
-        try:
-            ivs = json.loads(ivs)
-            print(f"Parsed IVs: {ivs[:2]}... (total: {len(ivs)})")  # DEBUG
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing failed for IVs: {e}")  # DEBUG
-            raise HTTPException(status_code=500, detail="Invalid IV format in database")
-    
-    if len(ivs) != file.chunk_count:
-        print(f"IV count ({len(ivs)}) != chunk count ({file.chunk_count})")  # DEBUG
-        raise HTTPException(status_code=500, detail="Mismatch between IV count and chunk count")
-
-    aesgcm = AESGCM(key_bytes)
-    print("AES-GCM initialized with key")  # DEBUG
-
-    for i, encrypted_chunk in enumerate(chunks):
-        print(f"\n--- Decrypting chunk {i} ---")
-        print(f"Encrypted size: {len(encrypted_chunk)} bytes")  # DEBUG
-        iv_array = ivs[i]
-
-        if isinstance(iv_array, str):
-            try:
-                iv_array = json.loads(iv_array)
-                print(f"Parsed IV[{i}] from JSON string")  # DEBUG
-            except Exception:
-                print(f"ERROR: IV[{i}] is not valid JSON: {iv_array}")  # DEBUG
-                raise HTTPException(status_code=500, detail=f"IV at chunk {i} is not valid JSON")
-
-        print(f"Final IV[{i}]: {iv_array} (type: {type(iv_array)})")  # DEBUG
-        if not isinstance(iv_array, list) or len(iv_array) != 12:
-            print(f"ERROR: IV[{i}] format incorrect: {iv_array}")  # DEBUG
-            raise HTTPException(status_code=500, detail=f"Invalid IV format or length at chunk {i}")
 
-        try:
-            iv = bytes(iv_array)
-            print(f"IV bytes: {iv.hex()}")  # DEBUG
-            decrypted_chunk = aesgcm.decrypt(iv, encrypted_chunk, None)
-            print(f"Decrypted chunk size: {len(decrypted_chunk)} bytes")  # DEBUG
-            decrypted_data.extend(decrypted_chunk)
-        except Exception as e:
-            print(f"Decryption failed at chunk {i}: {e}")  # DEBUG
-            raise HTTPException(status_code=500, detail=f"Decryption failed at chunk {i}")
-
-    print("\n=== Download and decryption successful ===")
-    print(f"Total decrypted file size: {len(decrypted_data)} bytes")
-
-    return Response(
-        content=bytes(decrypted_data),
-        media_type="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename={file.file_name}"}
-    )
+async def start_stream(body, status_code: int, headers: dict, media_type: str = "application/octet-stream"):
+    """Wrap an async generator in a StreamingResponse.
 
+    The first piece is pulled before committing to a status code, so that
+    a storage outage still surfaces as an error instead of a truncated body.
+    """
+    try:
+        first = await body.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except Exception as e:
+        await body.aclose()
+        logger.error(f"Failed to fetch the first chunk of a download: {e}")
+        raise HTTPException(status_code=500, detail="Failed to download file from storage")
 
+    return StreamingResponse(_prepend(first, body), status_code=status_code, media_type=media_type, headers=headers)
 
 
 @router.get("/my-files")
-async def get_user_files(request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("refresh_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="Missing token")
-
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
-        user_email = payload.get("sub")
-        user = db.query(models.User).filter(models.User.email == user_email).first()
-        if not user:
-            raise HTTPException(status_code=403, detail="User not found")
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Invalid token")
+async def get_user_files(
+    limit: int = Query(50, ge=1, le=MY_FILES_PAGE_MAX),
+    cursor: Optional[str] = None,
+    sort: str = Query("created_at", pattern="^(created_at|file_name)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    prefix: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+):
+    """List completed files, one keyset-paginated page at a time."""
+    sort_column = getattr(models.FileUpload, sort)
+    descending = order == "desc"
+    # Only the listed columns; never the ivs blob or the key
+    query = select(
+        models.FileUpload.id,
+        models.FileUpload.file_name,
+        models.FileUpload.file_hash,
+        models.FileUpload.created_at,
+        models.FileUpload.chunk_count,
+        models.FileUpload.size,
+    ).where(models.FileUpload.status == "complete")
 
     # Role-based access
-    if user.role in ("admin", "superadmin"):
-        files = db.query(models.FileUpload).all()
+    if user.role not in ("admin", "superadmin"):
+        query = query.where(models.FileUpload.owner_id == user.id)
+    if prefix:
+        query = query.where(models.FileUpload.file_name.startswith(prefix, autoescape=True))
+    if cursor:
+        try:
+            query = query.where(keyset_after(sort_column, models.FileUpload.id, cursor, descending))
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if descending:
+        query = query.order_by(sort_column.desc(), models.FileUpload.id.desc())
     else:
-        files = db.query(models.FileUpload).filter(models.FileUpload.owner_id == user.id).all()
-
-    return [
-        {
-            "file_name": f.file_name,
-            "file_hash": f.file_hash,
-            "uploaded_at": f.created_at,
-            "chunk_count": f.chunk_count
-        } for f in files
-    ]
+        query = query.order_by(sort_column.asc(), models.FileUpload.id.asc())
+
+    # Fetch one extra row to learn whether another page follows
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(getattr(last, sort), last.id)
+
+    return {
+        "items": [
+            {
+                "file_name": f.file_name,
+                "file_hash": f.file_hash,
+                "uploaded_at": f.created_at,
+                "chunk_count": f.chunk_count,
+                "size": f.size,
+            } for f in rows[:limit]
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 
@@ -1,34 +1,404 @@
-from fastapi import APIRouter, UploadFile, Form, File, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-from .. import models, database
-from services.aws import upload_chunk_to_s3,delete_chunks_from_s3
-from services.azure import upload_chunk_to_blob,delete_chunks_azure
+from fastapi import APIRouter, UploadFile, Form, File, Depends, HTTPException, Request, Response
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, content_store, audit, dedup, deletion, replication
+from ..deletion import deletion_worker
+from ..replication import UPLOAD_REPLICATION_MODE, replicator
+from ..packing import packer
+from ..dependencies import Principal, get_current_user, get_db
+from services import metrics
+from services.chunk_cache import chunk_cache
+from services.storage import chunk_key, primary_backend, replica_backends
 from fastapi import Query
-from jose import JWTError, jwt
+import asyncio
+import logging
 import os
+from datetime import datetime, timedelta, timezone
 import json
 import base64
 from fastapi.responses import JSONResponse
-from ..utils.IpEncryption import AES256Encryptor
 
 
+router = APIRouter(tags=["Upload"])
+logger = logging.getLogger(__name__)
+
+# An in-progress session older than this no longer blocks another owner
+# from uploading the same content.
+UPLOAD_SESSION_STALE_HOURS = float(os.getenv("UPLOAD_SESSION_STALE_HOURS", "24"))
+
+
+async def log_upload(request: Request, user: Principal):
+    client_ip = request.client.host
+    logger.info(f"Upload requested by {user.email} from {client_ip}")
+    await audit.record("upload", user.id, client_ip)
+
+
+def parse_iv(iv: str) -> bytes:
+    """Decode the frontend's JSON byte array into a 12-byte AES-GCM nonce."""
+    iv_parsed = json.loads(iv)
+    if not isinstance(iv_parsed, list) or len(iv_parsed) != 12:
+        raise ValueError("Invalid IV format")
+    return bytes(iv_parsed)
+
+
+async def upsert_chunk(db: AsyncSession, file_id: int, chunk_index: int, iv: bytes, size: int, replicas: str):
+    """Record one chunk in the manifest; a retried chunk overwrites its previous row."""
+    values = dict(file_id=file_id, chunk_index=chunk_index, iv=iv, size=size, replicas=replicas)
+    dialect = db.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(models.FileChunk).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["file_id", "chunk_index"],
+            set_=dict(iv=stmt.excluded.iv, size=stmt.excluded.size, replicas=stmt.excluded.replicas),
+        )
+        await db.execute(stmt)
+        return
 
-AES_256_KEY_B64 = os.getenv("AES_256_KEY_B64")
-AES_256_KEY = base64.b64decode(AES_256_KEY_B64) 
-encryptor = AES256Encryptor(AES_256_KEY)
+    result = await db.execute(
+        update(models.FileChunk).filter_by(file_id=file_id, chunk_index=chunk_index).values(
+            iv=iv, size=size, replicas=replicas
+        )
+    )
+    if not result.rowcount:
+        db.add(models.FileChunk(**values))
 
 
-router = APIRouter(tags=["Upload"])
+async def received_chunk_indexes(db: AsyncSession, file_id: int) -> list:
+    result = await db.scalars(select(models.FileChunk.chunk_index).where(models.FileChunk.file_id == file_id))
+    return list(result)
+
+
+async def count_received(db: AsyncSession, file_id: int) -> int:
+    return await db.scalar(select(func.count(models.FileChunk.id)).where(models.FileChunk.file_id == file_id))
+
+
+async def find_owned_file(db: AsyncSession, file_hash: str, user: Principal):
+    return await db.scalar(select(models.FileUpload).filter_by(file_hash=file_hash, owner_id=user.id))
 
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "defaultsecret")
-ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 
-def get_db():
-    db = database.SessionLocal()
+async def session_status(db: AsyncSession, file: models.FileUpload) -> dict:
+    """Describe an upload session, including a bitmap of the chunks received so far.
+
+    Bit i of the base64 `received_bitmap` (byte i // 8, least significant
+    bit first) is set once chunk i has been stored.
+    """
+    bitmap = bytearray((file.chunk_count + 7) // 8)
+    received = 0
+    if file.status == "complete":
+        # Every chunk is stored, including for files (and dedup copies of
+        # them) whose manifest is only the legacy `ivs` column
+        for index in range(file.chunk_count):
+            bitmap[index // 8] |= 1 << (index % 8)
+        received = file.chunk_count
+    else:
+        for index in await received_chunk_indexes(db, file.id):
+            if 0 <= index < file.chunk_count:
+                bitmap[index // 8] |= 1 << (index % 8)
+                received += 1
+    return {
+        "session_id": file.id,
+        "file_hash": file.file_hash,
+        "status": file.status,
+        "chunk_count": file.chunk_count,
+        "received_count": received,
+        "received_bitmap": base64.b64encode(bytes(bitmap)).decode(),
+        "replication_state": file.replication_state,
+    }
+
+
+async def get_owned_session(db: AsyncSession, session_id: int, user: Principal) -> models.FileUpload:
+    file = await db.scalar(select(models.FileUpload).filter_by(id=session_id, owner_id=user.id))
+    if not file:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return file
+
+
+async def open_session(db: AsyncSession, user: Principal, file_name: str, file_hash: str,
+                 chunk_count: int, key: str, size: int = None,
+                 challenge: str = None, proof: str = None) -> models.FileUpload:
+    """Create the upload session for (user, file_hash), or return the one already in progress.
+
+    Resuming with a different key discards the chunks received so far,
+    since they were encrypted under the old key. If the content is already
+    stored, the new file is completed immediately by referencing the
+    existing chunks instead of re-uploading them, once the client has
+    answered a proof-of-possession challenge (dedup.ProofRequired carries it).
+    """
+    file = await find_owned_file(db, file_hash, user)
+    if file is not None:
+        if file.status == "complete":
+            raise HTTPException(status_code=400, detail="File already uploaded")
+        if file.encrypted_key != key or file.chunk_count != chunk_count:
+            await db.execute(delete(models.FileChunk).where(models.FileChunk.file_id == file.id))
+            file.encrypted_key = key
+            file.chunk_count = chunk_count
+            file.file_name = file_name
+            file.size = size
+            await db.commit()
+        return file
+
+    donor = await content_store.find_donor(db, file_hash)
+    if donor is not None:
+        try:
+            await dedup.check_possession(db, user.id, donor, challenge, proof)
+        except dedup.ProofRejected as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except dedup.ContentMismatch:
+            raise HTTPException(status_code=409, detail="Stored content for this hash is corrupt; it can't be uploaded until it is removed")
+        except dedup.VerificationPending:
+            raise HTTPException(status_code=409, detail="Stored content for this hash is being verified; retry shortly",
+                                headers={"Retry-After": "5"})
+        except dedup.StorageUnavailable:
+            raise HTTPException(status_code=503, detail="Storage is unavailable; retry shortly", headers={"Retry-After": "5"})
+        return await reference_existing(db, user, file_name, donor)
+
+    # Objects of deleted content may still be being reclaimed; a new upload
+    # would write under the same keys and be deleted along with them.
+    if await deletion.pending_for(db, file_hash) is not None:
+        raise HTTPException(status_code=409, detail="This content is still being deleted; retry shortly")
+
+    # Chunk objects are keyed by content, so two owners uploading the same
+    # content at once would overwrite each other's ciphertext.
+    other = await db.scalar(select(models.FileUpload).filter_by(file_hash=file_hash, status="uploading").limit(1))
+    if other is not None:
+        stale_before = datetime.now(timezone.utc) - timedelta(hours=UPLOAD_SESSION_STALE_HOURS)
+        created_at = other.created_at
+        if created_at is not None and created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if created_at is None or created_at > stale_before:
+            raise HTTPException(status_code=409, detail="This content is being uploaded by another session; retry shortly")
+        logger.warning(f"Discarding stale upload session {other.id} for {file_hash}")
+        stale_chunk_count, stale_owner_id = other.chunk_count, other.owner_id
+        await delete_file_record(db, other)
+        # Chunks it already stored are reclaimed like a deleted file's; the
+        # new upload has to wait, or the job would delete its chunks too.
+        await deletion.enqueue(db, file_hash, stale_chunk_count, stale_owner_id)
+        await db.commit()
+        deletion_worker.wake()
+        raise HTTPException(status_code=409, detail="This content is still being deleted; retry shortly")
+
+    backend = primary_backend()
+    file = models.FileUpload(
+        file_name=file_name,
+        file_hash=file_hash,
+        owner_id=user.id,
+        chunk_count=chunk_count,
+        size=size,
+        encrypted_key=key,
+        status="uploading",
+        aws_url=backend.url_for(f"{file_hash}/") if backend.name == "s3" else None,
+        azure_url=backend.url_for(f"{file_hash}/") if backend.name == "azure" else None,
+    )
+    db.add(file)
     try:
-        yield db
-    finally:
-        db.close()
+        await db.commit()
+    except IntegrityError:
+        # Another chunk request created the session concurrently
+        await db.rollback()
+        file = await find_owned_file(db, file_hash, user)
+    return file
+
+
+async def reference_existing(db: AsyncSession, user: Principal, file_name: str, donor: models.FileUpload) -> models.FileUpload:
+    """Complete a new file for `user` backed by the donor's already-stored chunks.
+
+    The chunks stay encrypted under the donor's key, so that key and the
+    donor's manifest are copied; no chunk bytes move.
+    """
+    file = models.FileUpload(
+        file_name=file_name,
+        file_hash=donor.file_hash,
+        owner_id=user.id,
+        chunk_count=donor.chunk_count,
+        size=donor.size,
+        ivs=donor.ivs,
+        encrypted_key=donor.encrypted_key,
+        status="complete",
+        replication_state=donor.replication_state,
+        aws_url=donor.aws_url,
+        azure_url=donor.azure_url,
+    )
+    db.add(file)
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="File already uploaded")
+    await content_store.clone_manifest(db, donor, file.id)
+    await content_store.acquire(db, donor.file_hash, donor.chunk_count)
+    await db.commit()
+    logger.info(f"Deduplicated upload of {donor.file_hash} for user {user.id}")
+    return file
+
+
+async def store_chunk(db: AsyncSession, file: models.FileUpload, chunk_index: int, iv_bytes: bytes, chunk_bytes: bytes) -> dict:
+    """Store one encrypted chunk and record it in the manifest.
+
+    In sync replication mode every replica is written concurrently; in
+    async mode only the first that succeeds, primary first. Replicas left
+    without the chunk get outbox tasks committed with its manifest row.
+    """
+    if not 0 <= chunk_index < file.chunk_count:
+        raise HTTPException(status_code=400, detail=f"chunkIndex must be between 0 and {file.chunk_count - 1}")
+
+    key = chunk_key(file.file_hash, chunk_index)
+    backends = replica_backends()
+    replicas = {}
+    if UPLOAD_REPLICATION_MODE == "async":
+        for backend in backends:
+            try:
+                await backend.put(key, chunk_bytes)
+                replicas[backend.name] = "ok"
+                break
+            except Exception as e:
+                logger.warning(f"{backend.name} upload failed for chunk {chunk_index} of {file.file_hash}: {e}")
+                replicas[backend.name] = "failed"
+    else:
+        results = await asyncio.gather(*(backend.put(key, chunk_bytes) for backend in backends), return_exceptions=True)
+        for backend, result in zip(backends, results):
+            if isinstance(result, Exception):
+                logger.warning(f"{backend.name} upload failed for chunk {chunk_index} of {file.file_hash}: {result}")
+                replicas[backend.name] = "failed"
+            else:
+                replicas[backend.name] = "ok"
+    stored = [name for name, state in replicas.items() if state == "ok"]
+    if not stored:
+        raise HTTPException(status_code=502, detail="Failed to upload chunk to any storage replica")
+    if stored[0] != backends[0].name:
+        metrics.STORAGE_FALLBACKS.inc(operation="upload", reason="error")
+
+    missing = [backend.name for backend in backends if backend.name not in stored]
+    await upsert_chunk(db, file.id, chunk_index, iv_bytes, len(chunk_bytes), ",".join(stored))
+    await replication.enqueue(db, file, chunk_index, stored[0], missing)
+    await db.commit()
+    if missing:
+        replicator.wake()
+        for name in missing:
+            replicas.setdefault(name, "queued")
+    return replicas
+
+
+async def complete_session(db: AsyncSession, file: models.FileUpload):
+    received = await count_received(db, file.id)
+    if received != file.chunk_count:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload incomplete. Expected {file.chunk_count} chunks, got {received}"
+        )
+    # Concurrent last chunks (or repeated /complete calls) all get here;
+    # only the request that flips the status takes the content reference.
+    result = await db.execute(
+        update(models.FileUpload)
+        .where(models.FileUpload.id == file.id, models.FileUpload.status == "uploading")
+        .values(status="complete")
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        await db.refresh(file)
+        return
+    await content_store.acquire(db, file.file_hash, file.chunk_count)
+    await db.commit()
+    packer.wake()
+
+
+async def delete_file_record(db: AsyncSession, file: models.FileUpload):
+    await db.execute(delete(models.FileChunk).where(models.FileChunk.file_id == file.id))
+    await db.delete(file)
+    await db.flush()
+
+
+@router.post("/upload/sessions")
+async def initiate_upload(
+    request: Request,
+    body: schemas.UploadSessionCreate,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+):
+    """Start (or resume) an upload session. Chunks may then be sent in any order and in parallel."""
+    if body.totalChunks < 1:
+        raise HTTPException(status_code=400, detail="totalChunks must be at least 1")
+
+    try:
+        file = await open_session(db, user, body.fileName, body.fileHash, body.totalChunks, body.key, body.size,
+                                  body.challenge, body.proof)
+    except dedup.ProofRequired as e:
+        # The content is already stored; the client proves it holds it by
+        # hashing the nonce and the given plaintext range, then asks again.
+        return {"status": "proof_required", "file_hash": body.fileHash, **e.challenge}
+    await log_upload(request, user)
+    # A session that is already complete was satisfied from stored content;
+    # the client has nothing left to send.
+    return await session_status(db, file)
+
+
+@router.get("/upload/sessions/{session_id}")
+async def get_upload_session(
+    session_id: int,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+):
+    return await session_status(db, await get_owned_session(db, session_id, user))
+
+
+@router.put("/upload/sessions/{session_id}/chunks/{chunk_index}")
+async def upload_session_chunk(
+    session_id: int,
+    chunk_index: int,
+    chunk: UploadFile = File(...),
+    iv: str = Form(...),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+):
+    try:
+        iv_bytes = parse_iv(iv)
+    except Exception:
+        raise HTTPException(status_code=400, detail="IV must be a JSON array of bytes (12 elements)")
+
+    file = await get_owned_session(db, session_id, user)
+    if file.status != "uploading":
+        raise HTTPException(status_code=409, detail="Upload session is not accepting chunks")
+
+    replicas = await store_chunk(db, file, chunk_index, iv_bytes, await chunk.read())
+    return {"status": "chunk uploaded", "chunkIndex": chunk_index, "replicas": replicas}
+
+
+@router.post("/upload/sessions/{session_id}/complete")
+async def complete_upload_session(
+    session_id: int,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+):
+    file = await get_owned_session(db, session_id, user)
+    if file.status != "complete":
+        await complete_session(db, file)
+    return await session_status(db, file)
+
+
+@router.delete("/upload/sessions/{session_id}")
+async def abort_upload_session(
+    session_id: int,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+):
+    file = await get_owned_session(db, session_id, user)
+    if file.status == "complete":
+        raise HTTPException(status_code=409, detail="Upload already completed; use /delete-file")
+
+    file_hash, chunk_count = file.file_hash, file.chunk_count
+    await delete_file_record(db, file)
+    job = None
+    if await content_store.find_donor(db, file_hash) is None:
+        job = await deletion.enqueue(db, file_hash, chunk_count, user.id)
+    await db.commit()
+    if job is not None:
+        deletion_worker.wake()
+    return {"message": "Upload aborted", "deletion_job_id": job.id if job else None}
+
 
 @router.post("/upload")
 async def upload_chunk(
@@ -40,95 +410,40 @@ async def upload_chunk(
     fileHash: str = Form(...),
     totalChunks: int = Form(...),
     key: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
 ):
-    # Check malware status only for first chunk
-    
-
-    # Authenticate user
-    try:
-        token = request.cookies.get("access_token")
-        if not token:
-            raise HTTPException(status_code=401, detail="Token missing")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_email = payload.get("sub")
-        user = db.query(models.User).filter(models.User.email == user_email).first()
-        if not user:
-            raise HTTPException(status_code=403, detail="User not found")
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
-    # Read file chunk as bytes (prevent file pointer issue)
-    chunk_bytes = await chunk.read()
-
-    # Upload encrypted chunk to Azure and AWS
-    azure_url = upload_chunk_to_blob(fileHash, chunkIndex, chunk_bytes)
-    aws_url = upload_chunk_to_s3(fileHash, chunkIndex, chunk_bytes)
-
-    # Log upload attempt
-    if chunkIndex == 0:
-        client_ip = request.client.host
-        encrypted_ip = encryptor.encrypt(client_ip)
-        print(f"Upload request from IP: {client_ip}, user: {user_email}")
-        audit_log = models.AuditLog(
-            action="upload",
-            user_id=user.id,
-            ip=encrypted_ip
-        )
-        db.add(audit_log)
-        db.commit()
-        print("Audit log entry committed")
+    """Single-request chunk upload kept for older clients.
 
+    The session is opened by whichever chunk arrives first and completed
+    once every chunk has been stored, so chunks need not arrive in order.
+    """
     # Parse IV from frontend
     try:
-        iv_parsed = json.loads(iv)
-        if not isinstance(iv_parsed, list):
-            raise ValueError("Invalid IV format")
+        iv_bytes = parse_iv(iv)
     except Exception:
         raise HTTPException(status_code=400, detail="IV must be a JSON array of bytes (12 elements)")
 
-    # File record logic
-    existing_file = db.query(models.FileUpload).filter_by(file_hash=fileHash, owner_id=user.id).first()
-
-    if chunkIndex == 0:
-        if existing_file:
-            raise HTTPException(status_code=400, detail="File already uploaded")
-
-        new_file = models.FileUpload(
-            file_name=fileName,
-            file_hash=fileHash,
-            azure_url=azure_url,
-            aws_url=aws_url,
-            owner_id=user.id,
-            chunk_count=totalChunks,
-            ivs=json.dumps([iv_parsed]),
-            encrypted_key=key,
-        )
-        db.add(new_file)
-
-    else:
-        if not existing_file:
-            raise HTTPException(status_code=404, detail="File record not found")
-
+    file = await find_owned_file(db, fileHash, user)
+    if file is not None and file.status == "complete" and chunkIndex != 0:
+        # Completed from already-stored content by an earlier chunk; nothing to write
+        return {"status": "chunk uploaded", "chunkIndex": chunkIndex, "deduplicated": True}
+    if file is None or file.status != "uploading":
         try:
-            iv_list = json.loads(existing_file.ivs)
-        except:
-            iv_list = []
-
-        iv_list.append(iv_parsed)
-        existing_file.ivs = json.dumps(iv_list)
-        db.add(existing_file)
+            file = await open_session(db, user, fileName, fileHash, totalChunks, key)
+        except dedup.ProofRequired:
+            # This endpoint has no way to answer the challenge, and uploading
+            # anyway would overwrite the stored objects other files use.
+            raise HTTPException(status_code=409, detail="This content is already stored; upload it through /upload/sessions")
+        await log_upload(request, user)
+        if file.status == "complete":
+            return {"status": "chunk uploaded", "chunkIndex": chunkIndex, "deduplicated": True}
 
-        if chunkIndex == totalChunks - 1:
-            if len(iv_list) != totalChunks:
-                db.rollback()
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"IV count mismatch. Expected {totalChunks}, got {len(iv_list)}"
-                )
+    replicas = await store_chunk(db, file, chunkIndex, iv_bytes, await chunk.read())
 
-    db.commit()
-    return {"status": "chunk uploaded", "chunkIndex": chunkIndex}
+    if await count_received(db, file.id) == file.chunk_count:
+        await complete_session(db, file)
+    return {"status": "chunk uploaded", "chunkIndex": chunkIndex, "replicas": replicas}
 
 
 
@@ -136,52 +451,53 @@ async def upload_chunk(
 @router.delete("/delete-file")
 async def delete_file(
     request: Request,
+    response: Response,
     file_hash: str = Query(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
 ):
-    # Decode user from JWT
-    try:
-        token = request.cookies.get("access_token")
-        if not token:
-            raise HTTPException(status_code=401, detail="Token missing")
-
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_email = payload.get("sub")
-        user = db.query(models.User).filter(models.User.email == user_email).first()
-        if not user:
-            raise HTTPException(status_code=403, detail="User not found")
-    except JWTError:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     # Find file owned by user
-    file_record = db.query(models.FileUpload).filter_by(file_hash=file_hash).first()
+    file_record = await find_owned_file(db, file_hash, user)
     if not file_record:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Delete chunks from S3 and azure
-    try:
-        delete_chunks_from_s3(file_hash, file_record.chunk_count)
-        delete_chunks_azure(file_hash, file_record.chunk_count)
-         # Log download attempt
-        client_ip = request.client.host
-        encrypted_ip = encryptor.encrypt(client_ip)
-
-        print(f"delete request from IP: {client_ip}, user: {user_email}")
-        audit_log = models.AuditLog(
-            action="deleted",
-            user_id=user.id,
-            ip=encrypted_ip
-        )
-        db.add(audit_log)
-        db.commit()
-        print("Audit log entry committed")  # DEBUG
+    # Drop this owner's reference; storage is only reclaimed once no other
+    # file uses the same chunks. The objects are deleted by a background
+    # job recorded in the same transaction, so the request doesn't wait on
+    # storage and a failure there is retried rather than lost.
+    chunk_count = file_record.chunk_count
+    was_complete = file_record.status == "complete"
+    pack_count = await content_store.pack_count(db, file_hash)
+    await delete_file_record(db, file_record)
+    if was_complete:
+        reclaim = await content_store.release(db, file_hash)
+    else:
+        reclaim = await content_store.find_donor(db, file_hash) is None
 
-    except Exception as e:
-        print("Error deleting chunks from S3:", e)
-        return JSONResponse(status_code=500, content={"error": "Failed to delete file chunks from S3 or Azure"})
+    job = None
+    if reclaim:
+        job = await deletion.enqueue(db, file_hash, chunk_count, user.id, pack_count=pack_count)
+    await db.commit()
+    if job is not None:
+        deletion_worker.wake()
+        await chunk_cache.invalidate([chunk_key(file_hash, i) for i in range(chunk_count)])
+        response.status_code = 202
 
-    # Delete DB record
-    db.delete(file_record)
-    db.commit()
+    client_ip = request.client.host
+    logger.info(f"Delete of {file_hash} requested by {user.email} from {client_ip}")
+    await audit.record("deleted", user.id, client_ip)
 
-    return {"message": "File deleted successfully"}
\ No newline at end of file
+    return {"message": "File deleted successfully", "deletion_job_id": job.id if job else None}
+
+
+@router.get("/delete-file/jobs/{job_id}")
+async def get_deletion_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+):
+    """Progress of reclaiming a deleted file's storage."""
+    job = await db.scalar(select(models.DeletionJob).filter_by(id=job_id, owner_id=user.id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return deletion.job_status(job)
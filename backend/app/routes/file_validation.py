@@ -1,23 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Request
 from fastapi.responses import JSONResponse
-import shutil, os, uuid, boto3, requests
-from ..utils.virusTotal import check_file_hash_with_virustotal
-from azure.storage.blob import BlobServiceClient
+import asyncio, hashlib, os, uuid
+import httpx
+from ..utils.virusTotal import VirusTotalRateLimited, check_file_hash_with_virustotal
+from ..utils import scanPipeline
+from ..utils.scanPipeline import CLEAN, ERROR, MALICIOUS, VALIDATION_SCANNERS
 from ..schemas import VirusTotalRequest
+from ..utils.multipartStream import MultipartFileStream, MultipartStreamError
+from ..utils.yaraScanner import YARA_BACKEND, YARA_MAX_SCAN_BYTES, YaraScanTimeout, YaraUnavailable, yara_engine
+from services.aws import S3Backend
+from services.azure import AzureBackend
 import json
+import logging
 from fastapi import Query
 from typing import Literal
 
+logger = logging.getLogger(__name__)
+
 
 router = APIRouter(tags=["VALIDATE"])
 
 # ENV config
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION")
 S3_BUCKET = os.getenv("AWS_S3_BUCKET_NAME")
 LAMBDA_URL = os.getenv("LAMBDA_URL")
-AZURE_FUNCTION_URL = os.getenv("AZURE_FUNCTION_URL")
 
 
 
@@ -25,66 +30,164 @@ AZURE_FUNCTION_URL = os.getenv("AZURE_FUNCTION_URL")
 AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING_2")  # should be securely stored
 CONTAINER_NAME = "check-for-scan"
 AZURE_FUNCTION_URL = os.getenv("AZURE_FUNCTION_URL")  # the URL of your Azure Function
+SCANNER_TIMEOUT_SECONDS = float(os.getenv("SCANNER_TIMEOUT_SECONDS", "30"))
+
+# Staging areas the remote scanners read from: the YARA Lambda pulls from
+# S3, the ClamAV Azure Function from its own blob container.
+scan_s3 = S3Backend(bucket=S3_BUCKET)
+scan_blob = AzureBackend(container=CONTAINER_NAME, connection_string=AZURE_STORAGE_CONNECTION_STRING)
+
+
+_scanner_client = None
+
+
+def get_scanner_client() -> httpx.AsyncClient:
+    """Pooled client for the remote scanners; unlike `requests`, its calls can be cancelled."""
+    global _scanner_client
+    if _scanner_client is None:
+        _scanner_client = httpx.AsyncClient(timeout=SCANNER_TIMEOUT_SECONDS)
+    return _scanner_client
+
+
+async def close_scanner_client():
+    global _scanner_client
+    if _scanner_client is not None:
+        await _scanner_client.aclose()
+        _scanner_client = None
+
+
+def scan_key(filename: str, prefix: str = "") -> str:
+    return f"{prefix}{uuid.uuid4()}_{os.path.basename(filename or 'upload')}"
+
+
+async def delete_from_s3(key: str):
+    if await scan_s3.delete_many([key]):
+        logger.warning(f"S3 deletion failed: {key}")
+    else:
+        logger.debug(f"Deleted from S3: {key}")
+
+async def delete_from_blob(blob_name: str):
+    if await scan_blob.delete_many([blob_name]):
+        logger.warning(f"Blob deletion failed: {blob_name}")
+    else:
+        logger.debug(f"Deleted from Azure Blob: {blob_name}")
+
+# The validate endpoints read the request body themselves instead of
+# taking an UploadFile, so the upload is never spooled; this keeps the
+# file field in the API docs.
+FILE_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    }
+}
+
+
+async def discard_staged(staged: dict):
+    """Remove scanner staging copies, finished or not."""
+    for name, (backend, writer) in staged.items():
+        if writer.url is None:
+            await writer.abort()
+        elif await backend.delete_many([writer.key]):
+            logger.warning(f"Staged {name} copy deletion failed: {writer.key}")
+
+
+async def ingest_upload(request: Request, targets: dict = None, buffer_limit: int = None) -> dict:
+    """Read the request's `file` field once, hashing it and copying it to every target.
+
+    `targets` maps a name to a (backend, key prefix) pair. Each piece is
+    written to all of them as it arrives, so memory stays bounded by the
+    writers' part buffers and nothing touches local disk. With
+    `buffer_limit` the file is also kept in memory, and anything larger
+    is refused with 413. Returns the stored keys by target name, the
+    buffered data (or None), SHA-256, size and client filename.
+    """
+    targets = targets or {}
+    stream = MultipartFileStream(request, "file")
+    sha256 = hashlib.sha256()
+    buffer = bytearray() if buffer_limit is not None else None
+    staged = {}
+    size = 0
+
+    def open_writers():
+        for name, (backend, prefix) in targets.items():
+            staged[name] = (backend, backend.open_writer(scan_key(stream.filename, prefix)))
 
-blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
-
-
-# AWS S3 client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION,
-)
-
-
-
-def delete_from_s3(key: str):
     try:
-        s3_client.delete_object(Bucket=S3_BUCKET, Key=key)
-        print(f"Deleted from S3: {key}")
-    except Exception as e:
-        print(f"[Warning] S3 deletion failed: {e}")
-
-def delete_from_blob(blob_name: str):
+        async for data in stream:
+            if size == 0:
+                open_writers()
+            size += len(data)
+            if buffer is not None:
+                if size > buffer_limit:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {buffer_limit} byte scan limit")
+                buffer += data
+            sha256.update(data)
+            await asyncio.gather(*(writer.write(data) for _, writer in staged.values()))
+        if size == 0:
+            # Empty file: the field was present but carried no bytes
+            open_writers()
+        closed = await asyncio.gather(*(writer.close() for _, writer in staged.values()), return_exceptions=True)
+        for outcome in closed:
+            if isinstance(outcome, BaseException):
+                raise outcome
+    except MultipartStreamError as e:
+        await discard_staged(staged)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        await discard_staged(staged)
+        raise
+    return {
+        "keys": {name: writer.key for name, (_, writer) in staged.items()},
+        "data": bytes(buffer) if buffer is not None else None,
+        "sha256": sha256.hexdigest(),
+        "size": size,
+        "filename": stream.filename,
+    }
+
+
+async def scan_yara_local(request: Request):
     try:
-        blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=blob_name)
-        blob_client.delete_blob()
-        print(f"Deleted from Azure Blob: {blob_name}")
-    except Exception as e:
-        print(f"[Warning] Blob deletion failed: {e}")
-
-def save_and_upload(file: UploadFile, prefix="for_scan/") -> str:
-    tmp_filename = f"/tmp/{uuid.uuid4()}_{file.filename}"
-    with open(tmp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    s3_key = f"{prefix}{os.path.basename(tmp_filename)}"
-    s3_client.upload_file(tmp_filename, S3_BUCKET, s3_key)
-    os.remove(tmp_filename)
-    return s3_key
-
-@router.post("/validate/yara")
-async def validate_yara(file: UploadFile = File(...)):
+        upload = await ingest_upload(request, buffer_limit=YARA_MAX_SCAN_BYTES)
+        matches = await yara_engine.scan(upload["data"])
+    except YaraUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"YARA scanner unavailable: {e}")
+    except YaraScanTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    logger.info(f"YARA matches: {matches}")
+
+    if matches:
+        raise HTTPException(
+            status_code=422,
+            detail=f"YARA scan failed: malware detected. Matched rules: {matches}"
+        )
+    return JSONResponse(content={"status": "success", "source": "local_yara", "result": matches, "sha256": upload["sha256"]})
+
+
+@router.post("/validate/yara", openapi_extra=FILE_UPLOAD_BODY)
+async def validate_yara(request: Request):
+    if YARA_BACKEND == "local":
+        return await scan_yara_local(request)
     try:
-        s3_key = save_and_upload(file, prefix="yara/")
+        upload = await ingest_upload(request, {"yara": (scan_s3, "yara/")})
+        s3_key = upload["keys"]["yara"]
         payload = {"s3_key": s3_key, "bucket": S3_BUCKET}
-        res = requests.post(LAMBDA_URL, json=payload, timeout=30)
+        res = await get_scanner_client().post(LAMBDA_URL, json=payload)
         res.raise_for_status()
         result = res.json()  
-        print(f"YARA scan result: {result}")
+        logger.debug(f"YARA scan result: {result}")
 
 
     
         matches = result.get("yara", [])
-        print(f"YARA matches: {matches}")
+        logger.info(f"YARA matches: {matches}")
 
         # Delete file from S3 after scan
-        try:
-            s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_key)
-        except Exception as delete_err:
-            print(f"[Warning] Failed to delete from S3: {delete_err}")
-            # print("failed")
+        await delete_from_s3(s3_key)
 
 
         if matches: 
@@ -93,33 +196,30 @@ async def validate_yara(file: UploadFile = File(...)):
                 detail=f"YARA scan failed: malware detected. Matched rules: {matches}"
             )
 
-        return JSONResponse(content={"status": "success", "source": "aws_yara", "result": matches})
+        return JSONResponse(content={"status": "success", "source": "aws_yara", "result": matches, "sha256": upload["sha256"]})
 
-    except requests.exceptions.RequestException as err:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as err:
         raise HTTPException(status_code=502, detail=f"AWS Lambda error: {err}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/validate/clamav")
-async def validate_clamav(file: UploadFile = File(...)):
+@router.post("/validate/clamav", openapi_extra=FILE_UPLOAD_BODY)
+async def validate_clamav(request: Request):
     try:
-        blob_name = f"{uuid.uuid4()}_{file.filename}"
-        blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=blob_name)
-        blob_data = await file.read()
-        blob_client.upload_blob(blob_data, overwrite=True)
+        upload = await ingest_upload(request, {"clamav": (scan_blob, "")})
+        blob_name = upload["keys"]["clamav"]
 
         payload = {"blob_name": blob_name}
-        res = requests.post(AZURE_FUNCTION_URL, json=payload, timeout=30)
+        res = await get_scanner_client().post(AZURE_FUNCTION_URL, json=payload)
         res.raise_for_status()
         result = res.json()  
-        print(f"ClamAV scan result: {result}")
+        logger.debug(f"ClamAV scan result: {result}")
 
         # Delete blob after scan
-        try:
-            blob_client.delete_blob()
-        except Exception as delete_err:
-            print(f"[Warning] Failed to delete blob: {delete_err}")
+        await delete_from_blob(blob_name)
 
         # === UTILIZE SCAN RESULT ===
         if result.get("status") == "infected":
@@ -137,10 +237,13 @@ async def validate_clamav(file: UploadFile = File(...)):
             "status": "success",
             "source": "azure_clamav",
             "result": result,
-            "blob_name": blob_name
+            "blob_name": blob_name,
+            "sha256": upload["sha256"]
         })
 
-    except requests.exceptions.RequestException as err:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as err:
         raise HTTPException(status_code=502, detail=f"Azure Function error: {err}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -155,12 +258,11 @@ async def validate_virustotal(payload: VirusTotalRequest):
             raise HTTPException(status_code=400, detail="fileHash is required")
 
         result = await check_file_hash_with_virustotal(fileHash)
-        print(f"VirusTotal scan result for {fileHash}: {result}")
+        logger.info(f"VirusTotal scan result for {fileHash}: {result}")
         if not result:
             raise HTTPException(status_code=404, detail="File hash not found in VirusTotal")
 
-        positives = result.get("positives") or 0
-        if positives and int(positives) > 0:
+        if result.get("malicious_votes"):
             raise HTTPException(
                 status_code=422,
                 detail=f"VirusTotal scan failed: malware detected. Details: {result}"
@@ -168,5 +270,100 @@ async def validate_virustotal(payload: VirusTotalRequest):
 
         return JSONResponse(content={"status": "success", "source": "virustotal", "result": result})
 
-    except requests.exceptions.RequestException as err:
+    except VirusTotalRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except httpx.HTTPError as err:
         raise HTTPException(status_code=502, detail=f"VirusTotal error: {err}")
+
+
+# Scanners for /validate. Each returns {"verdict": clean|malicious|error, ...}.
+
+async def yara_remote_scan(s3_key: str) -> dict:
+    res = await get_scanner_client().post(LAMBDA_URL, json={"s3_key": s3_key, "bucket": S3_BUCKET})
+    res.raise_for_status()
+    matches = res.json().get("yara", [])
+    return {"verdict": MALICIOUS if matches else CLEAN, "source": "aws_yara", "matches": matches}
+
+
+async def yara_local_scan(data: bytes) -> dict:
+    matches = await yara_engine.scan(data)
+    return {"verdict": MALICIOUS if matches else CLEAN, "source": "local_yara", "matches": matches}
+
+
+async def clamav_scan(blob_name: str) -> dict:
+    res = await get_scanner_client().post(AZURE_FUNCTION_URL, json={"blob_name": blob_name})
+    res.raise_for_status()
+    result = res.json()
+    status = result.get("status")
+    verdict = MALICIOUS if status == "infected" else ERROR if status == "error" else CLEAN
+    return {"verdict": verdict, "source": "azure_clamav", "message": result.get("message")}
+
+
+async def virustotal_scan(file_hash: str) -> dict:
+    result = await check_file_hash_with_virustotal(file_hash)
+    if "error" in result:
+        return {"verdict": ERROR, "source": "virustotal", "detail": result["error"]}
+    votes = result.get("malicious_votes") or 0
+    return {"verdict": MALICIOUS if votes else CLEAN, "source": "virustotal", "found": result["found"], "malicious_votes": votes}
+
+
+@router.post("/validate", openapi_extra=FILE_UPLOAD_BODY)
+async def validate(request: Request):
+    """Scan an upload with every configured scanner at once.
+
+    The file is read once and staged for the remote scanners while it
+    arrives. YARA, ClamAV and the VirusTotal hash lookup then run
+    concurrently, and the rest are cancelled as soon as one finds
+    malware. Decisive verdicts are cached by SHA-256.
+    """
+    local_yara = "yara" in VALIDATION_SCANNERS and YARA_BACKEND == "local"
+    targets = {}
+    if "yara" in VALIDATION_SCANNERS and not local_yara:
+        targets["yara"] = (scan_s3, "yara/")
+    if "clamav" in VALIDATION_SCANNERS:
+        targets["clamav"] = (scan_blob, "")
+
+    try:
+        upload = await ingest_upload(request, targets, buffer_limit=YARA_MAX_SCAN_BYTES if local_yara else None)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Could not stage upload for scanning: {e}")
+
+    staged = upload["keys"]
+    rules_version = yara_engine.version if local_yara else None
+    try:
+        result = await scanPipeline.load_cached(upload["sha256"], rules_version)
+        cached = result is not None
+        if not cached:
+            scanners = {}
+            if "yara" in VALIDATION_SCANNERS:
+                scanners["yara"] = yara_local_scan(upload["data"]) if local_yara else yara_remote_scan(staged["yara"])
+            if "clamav" in VALIDATION_SCANNERS:
+                scanners["clamav"] = clamav_scan(staged["clamav"])
+            if "virustotal" in VALIDATION_SCANNERS:
+                scanners["virustotal"] = virustotal_scan(upload["sha256"])
+            results = await scanPipeline.run_scanners(scanners)
+            result = {"verdict": scanPipeline.merge_verdict(results), "scanners": results, "rules_version": rules_version}
+            await scanPipeline.store_cached(upload["sha256"], result)
+    finally:
+        await asyncio.gather(
+            *([delete_from_s3(staged["yara"])] if "yara" in staged else []),
+            *([delete_from_blob(staged["clamav"])] if "clamav" in staged else []),
+        )
+
+    body = {
+        "verdict": result["verdict"],
+        "scanners": result["scanners"],
+        "sha256": upload["sha256"],
+        "size": upload["size"],
+        "filename": upload["filename"],
+        "cached": cached,
+    }
+    logger.info(f"Validation of {upload['sha256']}: {result['verdict']} (cached={cached})")
+    if result["verdict"] == MALICIOUS:
+        raise HTTPException(status_code=422, detail=body)
+    if result["verdict"] != CLEAN:
+        # A scanner failed or was unavailable and none found malware
+        raise HTTPException(status_code=502, detail=body)
+    return JSONResponse(content={"status": "success", **body})
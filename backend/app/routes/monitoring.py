@@ -0,0 +1,20 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from services import metrics
+import os
+import secrets
+
+router = APIRouter(tags=["Monitoring"])
+
+# Bearer token the scraper must send; unset leaves /metrics open, e.g. when
+# only reachable from inside the cluster.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint."""
+    if METRICS_TOKEN:
+        supplied = request.headers.get("authorization", "").removeprefix("Bearer ")
+        if not secrets.compare_digest(supplied.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,97 +1,156 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .. import models, database, auth, schemas
-from typing import List
+from ..audit import encryptor
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+import csv
+import io
+import json
 import logging
 import os
-from jose import JWTError, jwt
-from ..utils.IpEncryption import AES256Encryptor
-import base64
+from ..dependencies import Principal, get_current_user, get_db, invalidate_user
+from services.chunk_cache import chunk_cache
+from ..utils.pagination import InvalidCursor, encode_cursor, keyset_after
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "defaultsecret")
-ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 
-AES_256_KEY_B64 = os.getenv("AES_256_KEY_B64")
-AES_256_KEY = base64.b64decode(AES_256_KEY_B64) 
-encryptor = AES256Encryptor(AES_256_KEY)
+AUDIT_PAGE_MAX = int(os.getenv("AUDIT_PAGE_MAX", "1000"))
+AUDIT_EXPORT_BATCH_SIZE = int(os.getenv("AUDIT_EXPORT_BATCH_SIZE", "1000"))
+AUDIT_LOG_FIELDS = ["id", "action", "user_id", "ip", "timestamp"]
 
 # --- Dependencies ---
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def get_current_user(request: Request, db: Session = Depends(get_db)):
-    print(request.cookies)
-    token = request.cookies.get("refresh_token")
-    print(token)
-    if not token:
-        raise HTTPException(status_code=401, detail="Access token missing")
-
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    user = db.query(models.User).filter(models.User.email == payload.get("sub")).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    return user
-
-def superadmin_required(current_user: models.User = Depends(get_current_user)):
+def superadmin_required(current_user: Principal = Depends(get_current_user)):
     logging.info(f"Current user role: {current_user.role}")
     if current_user.role != "superadmin":
         raise HTTPException(status_code=403, detail="Only superadmin can perform this action")
     return current_user
 # --- Routes ---
 @router.get("/users", response_model=List[schemas.UserOut])
-def get_all_users(db: Session = Depends(get_db), current_user: models.User = Depends(superadmin_required)):
-    return db.query(models.User).all()
+async def get_all_users(db: AsyncSession = Depends(get_db), current_user: Principal = Depends(superadmin_required)):
+    return (await db.scalars(select(models.User))).all()
 
 
 
 @router.patch("/update-role/{user_id}")
-def update_user_role(user_id: int, role: str, db: Session = Depends(get_db), current_user: models.User = Depends(superadmin_required)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def update_user_role(user_id: int, role: str, db: AsyncSession = Depends(get_db), current_user: Principal = Depends(superadmin_required)):
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if role not in ["user", "admin"]:
         raise HTTPException(status_code=400, detail="Invalid role")
     user.role = role
-    db.commit()
+    await db.commit()
+    invalidate_user(user.email)
     return {"message": f"User {user.email}'s role updated to {role}"}
 
 
 
-@router.get("/audit-logs")
-async def get_audit_logs(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(superadmin_required)
-):
-    logs = db.query(models.AuditLog).all()
-    if not logs:
-        return []
-
+def audit_log_query(user_id=None, action=None, ip=None, since=None, until=None, cursor=None):
+    """Newest-first audit log query; `cursor` resumes after the last row of a page."""
+    query = select(models.AuditLog).order_by(models.AuditLog.timestamp.desc(), models.AuditLog.id.desc())
+    if ip is not None:
+        # IPs are stored encrypted with a random IV; match on the blind index instead
+        query = query.where(models.AuditLog.ip_hmac == encryptor.blind_index(ip))
+    if user_id is not None:
+        query = query.where(models.AuditLog.user_id == user_id)
+    if action is not None:
+        query = query.where(models.AuditLog.action == action)
+    if since is not None:
+        query = query.where(models.AuditLog.timestamp >= since)
+    if until is not None:
+        query = query.where(models.AuditLog.timestamp < until)
+    if cursor is not None:
+        query = query.where(keyset_after(models.AuditLog.timestamp, models.AuditLog.id, cursor))
+    return query
+
+
+def serialize_logs(logs) -> list:
+    """Serialize a batch of rows, decrypting their IPs in one pass."""
+    ips = encryptor.decrypt_many([log.ip for log in logs])
     result = []
-    for log in logs:
-        try:
-            print(f"Decrypting IP for log ID {log.id}")  # DEBUG
-            decrypted_ip = encryptor.decrypt(log.ip)
-        except Exception as e:
-            print(f"Error decrypting IP for log ID {log.id}: {e}")
-            decrypted_ip = "Decryption Failed"
-
+    for log, ip in zip(logs, ips):
+        if ip is None:
+            logger.error(f"Error decrypting IP for log ID {log.id}")
+            ip = "Decryption Failed"
         result.append({
             "id": log.id,
             "action": log.action,
             "user_id": log.user_id,
-            "ip": decrypted_ip,
+            "ip": ip,
             "timestamp": log.timestamp.isoformat() if log.timestamp else None
         })
-
     return result
+
+
+async def export_audit_logs(query, fmt: str):
+    """Stream every matching row with a server-side cursor and its own session.
+
+    The request's session is closed once the handler returns, so the
+    export opens one that lives as long as the response body.
+    """
+    async with database.AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=AUDIT_EXPORT_BATCH_SIZE))
+        batches = result.scalars().partitions()
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=AUDIT_LOG_FIELDS)
+            writer.writeheader()
+            async for logs in batches:
+                writer.writerows(await asyncio.to_thread(serialize_logs, logs))
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            async for logs in batches:
+                entries = await asyncio.to_thread(serialize_logs, logs)
+                yield "".join(json.dumps(entry) + "\n" for entry in entries)
+
+
+@router.get("/audit-logs")
+async def get_audit_logs(
+    limit: int = Query(100, ge=1, le=AUDIT_PAGE_MAX),
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    action: Optional[str] = None,
+    ip: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    format: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(superadmin_required)
+):
+    """Page through audit logs newest first, or export every match with format=ndjson|csv."""
+    try:
+        query = audit_log_query(user_id, action, ip, since, until, cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if format != "json":
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+        headers = {"Content-Disposition": f'attachment; filename="audit-logs.{format}"'}
+        return StreamingResponse(export_audit_logs(query, format), media_type=media_type, headers=headers)
+
+    # Fetch one extra row to learn whether another page follows
+    logs = (await db.scalars(query.limit(limit + 1))).all()
+    next_cursor = encode_cursor(logs[limit - 1].timestamp, logs[limit - 1].id) if len(logs) > limit else None
+    return {"items": await asyncio.to_thread(serialize_logs, logs[:limit]), "next_cursor": next_cursor}
+
+
+@router.get("/db-pool")
+async def get_db_pool(current_user: Principal = Depends(superadmin_required)):
+    """Connection pool occupancy, for spotting DB saturation under load."""
+    return database.pool_status()
+
+
+@router.get("/chunk-cache")
+async def get_chunk_cache(current_user: Principal = Depends(superadmin_required)):
+    """Local chunk cache occupancy, hit ratio and storage bytes saved."""
+    return chunk_cache.stats()
@@ -1,14 +1,17 @@
 # app/routes/user.py
 import logging
 from fastapi import APIRouter, Depends, HTTPException, status, Form, Request, Response
-from sqlalchemy.orm import Session
-from .. import models, schemas, database, auth
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, auth
+from ..dependencies import get_db, load_principal
 from fastapi.security import OAuth2PasswordRequestForm
 import os
-from jose import JWTError, jwt
+from jose import JWTError
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from fastapi.responses import JSONResponse
+from services.io_pool import run_blocking
 
 router = APIRouter(prefix="/user", tags=["Users"])
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "defaultsecret")
@@ -25,19 +28,11 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.post("/register", response_model=schemas.RegisterResponse)
-def register(response: Response, user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(response: Response, user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     try:
         logger.info(f"Attempting registration for email: {user.email}")
-        existing = db.query(models.User).filter(models.User.email == user.email).first()
+        existing = await db.scalar(select(models.User).where(models.User.email == user.email))
         if existing:
             logger.warning(f"Registration failed: Email {user.email} already registered")
             raise HTTPException(status_code=400, detail="Email already registered")
@@ -45,13 +40,13 @@ def register(response: Response, user: schemas.UserCreate, db: Session = Depends
         secret = auth.generate_2fa_secret()
         new_user = models.User(
             email=user.email,
-            hashed_password=auth.hash_password(user.password),
+            hashed_password=await auth.hash_password_async(user.password),
             twofa_secret=secret,
             role=user.role
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
 
         totp_uri = auth.get_totp_uri(user.email, secret)
         access_token = auth.create_access_token(data={"sub": user.email})
@@ -71,19 +66,29 @@ def register(response: Response, user: schemas.UserCreate, db: Session = Depends
             }
         }
 
+    except auth.PasswordHasherBusy:
+        logger.warning("Password hashing pool saturated; rejecting request")
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error during registration: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
 @router.post("/login", response_model=schemas.LoginResponse)
-def login(response: Response, username: str = Form(...), password: str = Form(...), twofa_code: str = Form(...), db: Session = Depends(get_db)):
+async def login(response: Response, username: str = Form(...), password: str = Form(...), twofa_code: str = Form(...), db: AsyncSession = Depends(get_db)):
     try:
         logger.info(f"Login attempt: {username}")
-        user = db.query(models.User).filter(models.User.email == username).first()
-        if not user or not auth.verify_password(password, user.hashed_password):
+        user = await db.scalar(select(models.User).where(models.User.email == username))
+        valid, new_hash = await auth.verify_and_update_password(password, user.hashed_password) if user else (False, None)
+        if not valid:
             logger.warning(f"Login failed for {username}: Invalid credentials")
             raise HTTPException(status_code=401, detail="Invalid credentials")
+        if new_hash:
+            user.hashed_password = new_hash
+            await db.commit()
+            logger.info(f"Rehashed password for {username} with current parameters")
 
         if not auth.verify_totp(user.twofa_secret, twofa_code):
             logger.warning(f"Login failed for {username}: Invalid 2FA code")
@@ -105,6 +110,11 @@ def login(response: Response, username: str = Form(...), password: str = Form(..
             }
         }
 
+    except auth.PasswordHasherBusy:
+        logger.warning("Password hashing pool saturated; rejecting request")
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error during login: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -123,20 +133,20 @@ async def logout(response: Response):
 
 
 @router.post("/refresh")
-def refresh_token(response: Response, request: Request, db: Session = Depends(get_db)):
+async def refresh_token(response: Response, request: Request, db: AsyncSession = Depends(get_db)):
     try:
         refresh_token = request.cookies.get("refresh_token")
         if not refresh_token:
             logger.warning("Refresh token not found in cookies")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No refresh token found")
 
-        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = auth.decode_refresh_token(refresh_token)
         user_email = payload.get("sub")
         if not user_email:
             logger.warning("Refresh token payload missing 'sub'")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
 
-        user = db.query(models.User).filter(models.User.email == user_email).first()
+        user = await load_principal(db, user_email)
         if not user:
             logger.warning(f"User not found for refresh token email: {user_email}")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
@@ -159,13 +169,15 @@ def refresh_token(response: Response, request: Request, db: Session = Depends(ge
     except JWTError as e:
         logger.warning(f"JWT decode error: {str(e)}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error during token refresh: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
 
 
 @router.post("/login/google")
-async def login_with_google(data: dict, response: Response, db: Session = Depends(get_db)):
+async def login_with_google(data: dict, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         logger.info("Google login attempt")
         token = data.get("token")
@@ -173,13 +185,14 @@ async def login_with_google(data: dict, response: Response, db: Session = Depend
             logger.warning("Google login failed: Token not provided")
             raise HTTPException(status_code=400, detail="Token is required")
 
-        idinfo = id_token.verify_oauth2_token(token, google_requests.Request())
+        # Fetches Google's signing certificates over blocking HTTP
+        idinfo = await run_blocking(id_token.verify_oauth2_token, token, google_requests.Request())
         email = idinfo.get('email')
         if not email:
             logger.warning("Google login failed: Email not found in token")
             raise HTTPException(status_code=400, detail="Email not found in token")
 
-        user = db.query(models.User).filter(models.User.email == email).first()
+        user = await db.scalar(select(models.User).where(models.User.email == email))
         if not user:
             user = models.User(
                 email=email,
@@ -188,8 +201,8 @@ async def login_with_google(data: dict, response: Response, db: Session = Depend
                 role="user"
             )
             db.add(user)
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
             logger.info(f"New user created via Google login: {email}")
         else:
             logger.info(f"Existing Google user logged in: {email}")
@@ -1,5 +1,6 @@
 # app/schemas.py
 from pydantic import BaseModel, EmailStr
+from typing import Optional
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -13,6 +14,17 @@ class UserInfo(BaseModel):
 class VirusTotalRequest(BaseModel):
     fileHash: str
 
+class UploadSessionCreate(BaseModel):
+    fileName: str
+    fileHash: str
+    totalChunks: int
+    key: str
+    size: Optional[int] = None
+    # Answer to a dedup challenge: the token returned with "proof_required"
+    # and SHA-256(nonce + plaintext[offset:offset + length]) in hex
+    challenge: Optional[str] = None
+    proof: Optional[str] = None
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
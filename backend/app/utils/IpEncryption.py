@@ -1,19 +1,37 @@
 import os
 import base64
+import hashlib
+import hmac
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives import padding, hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
 
+# Key for the deterministic blind index. When unset it is derived from the
+# encryption key, so the index stays stable as long as that key does.
+IP_BLIND_INDEX_KEY_B64 = os.getenv("IP_BLIND_INDEX_KEY_B64")
+
+BLOCK_SIZE = 16
+
+
 class AES256Encryptor:
-    def __init__(self, key: bytes):
-    
+    def __init__(self, key: bytes, index_key: bytes = None):
         self.key = key
+        self._algorithm = algorithms.AES(key)
+        self._backend = default_backend()
+        if index_key is None and IP_BLIND_INDEX_KEY_B64:
+            index_key = base64.b64decode(IP_BLIND_INDEX_KEY_B64)
+        if index_key is None:
+            index_key = HKDF(
+                algorithm=hashes.SHA256(), length=32, salt=None, info=b"audit-ip-blind-index"
+            ).derive(key)
+        self.index_key = index_key
 
     def encrypt(self, plaintext: str) -> str:
         iv = os.urandom(16)
         padder = padding.PKCS7(128).padder()
         padded_data = padder.update(plaintext.encode()) + padder.finalize()
-        cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=default_backend())
+        cipher = Cipher(self._algorithm, modes.CBC(iv), backend=self._backend)
         encryptor = cipher.encryptor()
         ciphertext = encryptor.update(padded_data) + encryptor.finalize()
         encrypted_data = base64.b64encode(iv + ciphertext).decode('utf-8')
@@ -24,9 +42,59 @@ class AES256Encryptor:
 
         iv = encrypted_data[:16]
         ciphertext = encrypted_data[16:]
-        cipher = Cipher(algorithms.AES(self.key), modes.CBC(iv), backend=default_backend())
+        cipher = Cipher(self._algorithm, modes.CBC(iv), backend=self._backend)
         decryptor = cipher.decryptor()
         padded_plaintext = decryptor.update(ciphertext) + decryptor.finalize()
         unpadder = padding.PKCS7(128).unpadder()
         plaintext = unpadder.update(padded_plaintext) + unpadder.finalize()
         return plaintext.decode('utf-8')
+
+    def blind_index(self, plaintext: str) -> str:
+        """Deterministic keyed HMAC-SHA256 of `plaintext`, for equality lookups."""
+        return hmac.new(self.index_key, plaintext.encode(), hashlib.sha256).hexdigest()
+
+    def decrypt_many(self, values: list) -> list:
+        """Decrypt a batch; entries that fail to decrypt come back as None.
+
+        CBC decryption is the AES decryption of each block XORed with the
+        block before it (the IV for the first). So every value's blocks go
+        through one ECB decryptor in a single call, and only the XOR and
+        unpadding are done per value.
+        """
+        decoded = []
+        for value in values:
+            try:
+                data = base64.b64decode(value)
+            except Exception:
+                data = None
+            if data is not None and (len(data) < 2 * BLOCK_SIZE or len(data) % BLOCK_SIZE):
+                data = None
+            decoded.append(data)
+
+        decryptor = Cipher(self._algorithm, modes.ECB(), backend=self._backend).decryptor()
+        blocks = decryptor.update(b"".join(data[BLOCK_SIZE:] for data in decoded if data is not None))
+        blocks += decryptor.finalize()
+
+        results, position = [], 0
+        for data in decoded:
+            if data is None:
+                results.append(None)
+                continue
+            length = len(data) - BLOCK_SIZE
+            decrypted = int.from_bytes(blocks[position:position + length], "big")
+            position += length
+            # The IV and every ciphertext block but the last
+            previous = int.from_bytes(data[:-BLOCK_SIZE], "big")
+            results.append(_unpad((decrypted ^ previous).to_bytes(length, "big")))
+        return results
+
+
+def _unpad(padded: bytes):
+    """Strip PKCS7 padding and decode, or None if either is invalid."""
+    count = padded[-1]
+    if not 1 <= count <= BLOCK_SIZE or padded[-count:] != bytes([count]) * count:
+        return None
+    try:
+        return padded[:-count].decode("utf-8")
+    except UnicodeDecodeError:
+        return None
@@ -0,0 +1,65 @@
+import bisect
+
+# Requests with more ranges than this are answered with the whole file.
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header: str, total: int):
+    """Parse a `Range: bytes=...` header against a body of `total` bytes.
+
+    Returns a list of inclusive (start, end) pairs, or None when the header
+    should be ignored (missing, malformed, non-byte unit or too many
+    ranges). Raises RangeNotSatisfiable when no range overlaps the body.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    parts = [p.strip() for p in spec.split(",") if p.strip()]
+    if not parts or len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if first == "":
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(0, total - length), total - 1
+            else:
+                start = int(first)
+                if last and int(last) < start:
+                    return None
+                end = min(int(last), total - 1) if last else total - 1
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start <= end and start < total:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+def chunk_span(offsets: list, start: int, end: int):
+    """Map the inclusive byte range [start, end] onto chunk indexes.
+
+    `offsets[i]` is the plaintext offset where chunk i begins, with the
+    total size appended. Returns (first_chunk, last_chunk).
+    """
+    first = bisect.bisect_right(offsets, start) - 1
+    last = bisect.bisect_right(offsets, end) - 1
+    return first, last
@@ -0,0 +1,78 @@
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # Older releases shipped as `multipart`
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+class MultipartStreamError(Exception):
+    pass
+
+
+class MultipartFileStream:
+    """Iterates one file field of a multipart/form-data request as it arrives.
+
+    Unlike `UploadFile`, nothing is spooled to memory or disk: each piece
+    of the field is yielded as soon as it has been read off the socket.
+    `filename` is set once the field's headers have been parsed. Other
+    fields are skipped.
+    """
+
+    def __init__(self, request, field: str = "file"):
+        self.request = request
+        self.field = field.encode()
+        self.filename = None
+
+    async def __aiter__(self):
+        content_type, params = parse_options_header(self.request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise MultipartStreamError("Expected a multipart/form-data body")
+
+        pending = []
+        state = {"active": False, "found": False, "headers": {}, "name": b"", "value": b""}
+
+        def on_part_begin():
+            state["headers"] = {}
+
+        def on_header_field(data, start, end):
+            state["name"] += data[start:end]
+
+        def on_header_value(data, start, end):
+            state["value"] += data[start:end]
+
+        def on_header_end():
+            state["headers"][state["name"].lower()] = state["value"]
+            state["name"], state["value"] = b"", b""
+
+        def on_headers_finished():
+            _, options = parse_options_header(state["headers"].get(b"content-disposition", b""))
+            state["active"] = options.get(b"name") == self.field and not state["found"]
+            if state["active"]:
+                self.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+
+        def on_part_data(data, start, end):
+            if state["active"]:
+                pending.append(bytes(data[start:end]))
+
+        def on_part_end():
+            if state["active"]:
+                state["active"] = False
+                state["found"] = True
+
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        })
+        async for chunk in self.request.stream():
+            parser.write(chunk)
+            if pending:
+                data = b"".join(pending)
+                pending.clear()
+                yield data
+        parser.finalize()
+        if not state["found"]:
+            raise MultipartStreamError(f"Missing file field '{self.field.decode()}'")
@@ -0,0 +1,36 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(value, row_id: int) -> str:
+    """Opaque cursor for the row with sort key `value` and primary key `row_id`."""
+    payload = {"id": row_id}
+    if isinstance(value, datetime):
+        payload["t"] = value.isoformat()
+    else:
+        payload["v"] = value
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Inverse of `encode_cursor`; returns (value, row_id)."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value = datetime.fromisoformat(payload["t"]) if "t" in payload else payload["v"]
+        return value, int(payload["id"])
+    except Exception:
+        raise InvalidCursor()
+
+
+def keyset_after(column, id_column, cursor: str, descending: bool = True):
+    """WHERE clause selecting the rows after `cursor` in (column, id) order."""
+    value, row_id = decode_cursor(cursor)
+    if descending:
+        return or_(column < value, and_(column == value, id_column < row_id))
+    return or_(column > value, and_(column == value, id_column > row_id))
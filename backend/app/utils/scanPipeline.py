@@ -0,0 +1,119 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from .. import database, models
+from .cache import TTLCache
+from services import metrics
+
+# Scanners /validate runs; drop ones a deployment has no backend for,
+# e.g. VALIDATION_SCANNERS=yara,virustotal without the ClamAV function.
+VALIDATION_SCANNERS = [s.strip().lower() for s in os.getenv("VALIDATION_SCANNERS", "yara,clamav,virustotal").split(",") if s.strip()]
+
+# How long a merged verdict is trusted. Only decisive verdicts are cached;
+# a clean one is kept short since rules and signatures keep changing.
+VALIDATION_TTL_SECONDS = {
+    "clean": float(os.getenv("VALIDATION_CACHE_TTL_CLEAN_SECONDS", "3600")),
+    "malicious": float(os.getenv("VALIDATION_CACHE_TTL_MALICIOUS_SECONDS", str(30 * 24 * 3600))),
+}
+VALIDATION_MEMORY_CACHE_SIZE = int(os.getenv("VALIDATION_MEMORY_CACHE_SIZE", "10000"))
+
+CLEAN, MALICIOUS, ERROR, CANCELLED = "clean", "malicious", "error", "cancelled"
+INCONCLUSIVE = "inconclusive"
+
+SCANNER_SECONDS = metrics.histogram("scanner_duration_seconds", "Time each scanner took, by verdict.", ("scanner", "verdict"))
+
+_verdicts = TTLCache(maxsize=VALIDATION_MEMORY_CACHE_SIZE, ttl=max(VALIDATION_TTL_SECONDS.values()))
+
+
+async def run_scanners(scanners: dict) -> dict:
+    """Run scanner coroutines concurrently, stopping at the first malicious verdict.
+
+    `scanners` maps a name to a coroutine returning {"verdict": ..., ...}.
+    A scanner that raises is reported as an error; ones still running
+    when another finds malware are cancelled and reported as such.
+    """
+    tasks = {asyncio.ensure_future(_timed(name, coro)): name for name, coro in scanners.items()}
+    results = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    results[tasks[task]] = task.result()
+                except Exception as e:
+                    results[tasks[task]] = {"verdict": ERROR, "detail": str(e) or type(e).__name__}
+            if any(r["verdict"] == MALICIOUS for r in results.values()):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    for task in pending:
+        results[tasks[task]] = {"verdict": CANCELLED}
+    return results
+
+
+async def _timed(name: str, coro) -> dict:
+    start = time.perf_counter()
+    verdict = ERROR
+    try:
+        result = await coro
+        verdict = result["verdict"]
+        return result
+    except asyncio.CancelledError:
+        verdict = CANCELLED
+        raise
+    finally:
+        SCANNER_SECONDS.observe(time.perf_counter() - start, scanner=name, verdict=verdict)
+
+
+def merge_verdict(results: dict) -> str:
+    verdicts = [r["verdict"] for r in results.values()]
+    if MALICIOUS in verdicts:
+        return MALICIOUS
+    if verdicts and all(v == CLEAN for v in verdicts):
+        return CLEAN
+    return INCONCLUSIVE
+
+
+def _usable(result: dict, rules_version) -> bool:
+    # A clean verdict says nothing about rules added since
+    return result["verdict"] == MALICIOUS or result.get("rules_version") == rules_version
+
+
+async def load_cached(file_hash: str, rules_version=None):
+    cached = _verdicts.get(file_hash)
+    if cached is not None:
+        return cached if _usable(cached, rules_version) else None
+
+    async with database.AsyncSessionLocal() as db:
+        row = await db.get(models.ScanVerdict, file_hash)
+    if row is None:
+        return None
+    expires_at = row.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= datetime.now(timezone.utc):
+        return None
+    _verdicts.set(file_hash, row.result, expires_at=expires_at.timestamp())
+    return row.result if _usable(row.result, rules_version) else None
+
+
+async def store_cached(file_hash: str, result: dict):
+    verdict = result["verdict"]
+    if verdict not in VALIDATION_TTL_SECONDS:
+        return
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=VALIDATION_TTL_SECONDS[verdict])
+    _verdicts.set(file_hash, result, expires_at=expires_at.timestamp())
+    row = models.ScanVerdict(file_hash=file_hash, verdict=verdict, result=result, checked_at=now, expires_at=expires_at)
+    async with database.AsyncSessionLocal() as db:
+        await db.merge(row)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Another worker cached the same hash first
+            await db.rollback()
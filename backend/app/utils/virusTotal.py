@@ -1,26 +1,174 @@
+import asyncio
 import httpx
 import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from .. import database, models
+from .cache import TTLCache
 
 VT_API_KEY = os.getenv("VT_API_KEY", "")  # Store in .env
+# Point at a local stub (see scripts/vt_stub_server.py) for tests
+VT_BASE_URL = os.getenv("VT_BASE_URL", "https://www.virustotal.com/api/v3")
+VT_TIMEOUT_SECONDS = float(os.getenv("VT_TIMEOUT_SECONDS", "15"))
+
+# Public API quota. Lookups beyond it wait for a token (up to
+# VT_RATE_MAX_WAIT_SECONDS) when the policy is "queue", or fail straight
+# away with VirusTotalRateLimited when it is "reject".
+VT_RATE_PER_MINUTE = float(os.getenv("VT_RATE_PER_MINUTE", "4"))
+VT_RATE_BURST = int(os.getenv("VT_RATE_BURST", "4"))
+VT_RATE_LIMIT_POLICY = os.getenv("VT_RATE_LIMIT_POLICY", "queue").lower()
+VT_RATE_MAX_WAIT_SECONDS = float(os.getenv("VT_RATE_MAX_WAIT_SECONDS", "30"))
+
+# How long each kind of verdict is trusted. Detections rarely get
+# retracted; unknown hashes may be submitted by someone else soon.
+VT_TTL_SECONDS = {
+    "clean": float(os.getenv("VT_CACHE_TTL_CLEAN_SECONDS", str(24 * 3600))),
+    "malicious": float(os.getenv("VT_CACHE_TTL_MALICIOUS_SECONDS", str(30 * 24 * 3600))),
+    "not_found": float(os.getenv("VT_CACHE_TTL_NOT_FOUND_SECONDS", "3600")),
+}
+VT_MEMORY_CACHE_SIZE = int(os.getenv("VT_MEMORY_CACHE_SIZE", "10000"))
+
+
+class VirusTotalRateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"VirusTotal quota exhausted; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def drain(self):
+        """Empty the bucket, e.g. after the server itself answered 429."""
+        self._refill()
+        self.tokens = 0.0
+
+    async def acquire(self, max_wait: float):
+        # The lock queues waiters in arrival order
+        async with self._lock:
+            self._refill()
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+            if wait > max_wait:
+                raise VirusTotalRateLimited(wait)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+
+
+_bucket = TokenBucket(VT_RATE_PER_MINUTE / 60, VT_RATE_BURST)
+_verdicts = TTLCache(maxsize=VT_MEMORY_CACHE_SIZE, ttl=max(VT_TTL_SECONDS.values()))
+_inflight = {}
+_client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """One pooled client for all lookups, so connections and TLS sessions are reused."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(base_url=VT_BASE_URL, timeout=VT_TIMEOUT_SECONDS, headers={"x-apikey": VT_API_KEY})
+    return _client
 
-async def check_file_hash_with_virustotal(file_hash: str) -> dict:
-    url = f"https://www.virustotal.com/api/v3/files/{file_hash}"
-    headers = {
-        "x-apikey": VT_API_KEY
-    }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def verdict_of(result: dict) -> str:
+    if not result.get("found"):
+        return "not_found"
+    return "malicious" if result.get("malicious_votes") else "clean"
+
+
+async def load_cached(file_hash: str):
+    async with database.AsyncSessionLocal() as db:
+        row = await db.get(models.VirusTotalVerdict, file_hash)
+    if row is None:
+        return None
+    expires_at = row.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= datetime.now(timezone.utc):
+        return None
+    _verdicts.set(file_hash, row.result, expires_at=expires_at.timestamp())
+    return row.result
+
+
+async def store_cached(file_hash: str, result: dict):
+    verdict = verdict_of(result)
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=VT_TTL_SECONDS[verdict])
+    _verdicts.set(file_hash, result, expires_at=expires_at.timestamp())
+    row = models.VirusTotalVerdict(file_hash=file_hash, verdict=verdict, result=result, checked_at=now, expires_at=expires_at)
+    async with database.AsyncSessionLocal() as db:
+        await db.merge(row)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Another worker cached the same hash first
+            await db.rollback()
+
+
+async def fetch_verdict(file_hash: str) -> dict:
+    cached = await load_cached(file_hash)
+    if cached is not None:
+        return cached
+
+    await _bucket.acquire(VT_RATE_MAX_WAIT_SECONDS if VT_RATE_LIMIT_POLICY == "queue" else 0)
+    response = await get_client().get(f"/files/{file_hash}")
 
     if response.status_code == 200:
         result = response.json()
         malicious_votes = result["data"]["attributes"]["last_analysis_stats"]["malicious"]
-        return {
+        result = {
             "found": True,
             "malicious_votes": malicious_votes,
             "raw": result
         }
     elif response.status_code == 404:
-        return { "found": False }
+        result = { "found": False }
+    elif response.status_code == 429:
+        _bucket.drain()
+        raise VirusTotalRateLimited(60 / VT_RATE_PER_MINUTE)
     else:
+        # Not cached, so the next lookup retries
         return { "error": response.text }
+
+    await store_cached(file_hash, result)
+    return result
+
+
+async def check_file_hash_with_virustotal(file_hash: str) -> dict:
+    """Look up a hash, answering from the verdict cache when possible.
+
+    Concurrent lookups of the same hash share one outbound request.
+    Raises VirusTotalRateLimited when the quota leaves no room.
+    """
+    file_hash = file_hash.lower()
+    cached = _verdicts.get(file_hash)
+    if cached is not None:
+        return cached
+
+    task = _inflight.get(file_hash)
+    if task is None:
+        task = asyncio.ensure_future(fetch_verdict(file_hash))
+        _inflight[file_hash] = task
+        task.add_done_callback(lambda _: _inflight.pop(file_hash, None))
+    # Shielded so one caller disconnecting doesn't cancel the others' lookup
+    return await asyncio.shield(task)
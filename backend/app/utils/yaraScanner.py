@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import yara
+except ImportError:  # yara-python is only needed for YARA_BACKEND=local
+    yara = None
+
+logger = logging.getLogger(__name__)
+
+# Where /validate/yara scans: "lambda" ships the file to the remote scanner
+# (LAMBDA_URL); "local" scans it in-process against YARA_RULES_PATH.
+YARA_BACKEND = os.getenv("YARA_BACKEND", "lambda").lower()
+# A .yar/.yara file, or a directory searched recursively for them
+YARA_RULES_PATH = os.getenv("YARA_RULES_PATH", "./yara_rules")
+YARA_SCAN_WORKERS = int(os.getenv("YARA_SCAN_WORKERS", str(os.cpu_count() or 1)))
+YARA_SCAN_TIMEOUT_SECONDS = int(os.getenv("YARA_SCAN_TIMEOUT_SECONDS", "10"))
+# How often rule files are checked for changes; 0 disables hot reload
+YARA_RELOAD_INTERVAL_SECONDS = float(os.getenv("YARA_RELOAD_INTERVAL_SECONDS", "30"))
+# Local scans hold the whole file in memory
+YARA_MAX_SCAN_BYTES = int(os.getenv("YARA_MAX_SCAN_BYTES", str(64 * 1024 * 1024)))
+
+RULE_EXTENSIONS = (".yar", ".yara")
+
+
+class YaraUnavailable(Exception):
+    pass
+
+
+class YaraScanTimeout(Exception):
+    pass
+
+
+def rule_files(path: str) -> dict:
+    """Map a namespace per rule file to its path."""
+    if os.path.isfile(path):
+        return {os.path.splitext(os.path.basename(path))[0]: path}
+    files = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if filename.endswith(RULE_EXTENSIONS):
+                full = os.path.join(dirpath, filename)
+                files[os.path.relpath(full, path)] = full
+    return files
+
+
+def fingerprint(files: dict) -> str:
+    """Changes whenever a rule file is added, removed or modified."""
+    digest = hashlib.sha256()
+    for namespace, path in sorted(files.items()):
+        stat = os.stat(path)
+        digest.update(f"{namespace}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return digest.hexdigest()[:16]
+
+
+# Per worker process: the compiled rules last loaded, by version
+_worker_rules = {"version": None, "rules": None}
+
+
+def _scan_in_worker(compiled_path: str, version: str, data: bytes, timeout: int) -> list:
+    if _worker_rules["version"] != version:
+        _worker_rules["rules"] = yara.load(compiled_path)
+        _worker_rules["version"] = version
+    try:
+        matches = _worker_rules["rules"].match(data=data, timeout=timeout)
+    except yara.TimeoutError:
+        # yara's exception types don't survive the trip back from the worker
+        raise TimeoutError(f"YARA scan exceeded {timeout}s")
+    return [match.rule for match in matches]
+
+
+class YaraEngine:
+    """Scans buffers against a compiled ruleset on a process pool.
+
+    Rules are compiled once per change and saved to disk, and each worker
+    loads a given version once and keeps it. A background task recompiles
+    when the rule files change. Scans already queued against the previous
+    version still find its compiled file.
+    """
+
+    def __init__(self, rules_path: str = YARA_RULES_PATH, workers: int = YARA_SCAN_WORKERS,
+                 timeout: int = YARA_SCAN_TIMEOUT_SECONDS, reload_interval: float = YARA_RELOAD_INTERVAL_SECONDS):
+        self.rules_path = rules_path
+        self.workers = workers
+        self.timeout = timeout
+        self.reload_interval = reload_interval
+        self.version = None
+        self.rule_count = 0
+        self._compiled_dir = None
+        self._compiled = []  # (version, path), newest last
+        self._executor = None
+        self._reload_task = None
+
+    def _compile(self):
+        files = rule_files(self.rules_path)
+        if not files:
+            raise YaraUnavailable(f"No YARA rules found at {self.rules_path}")
+        version = fingerprint(files)
+        if version == self.version:
+            return False
+        rules = yara.compile(filepaths=files)
+        if self._compiled_dir is None:
+            self._compiled_dir = tempfile.mkdtemp(prefix="yara-rules-")
+        path = os.path.join(self._compiled_dir, f"{version}.yarc")
+        rules.save(path)
+        self._compiled.append((version, path))
+        # Keep the previous version for scans still in flight
+        while len(self._compiled) > 2:
+            _, old_path = self._compiled.pop(0)
+            try:
+                os.unlink(old_path)
+            except OSError:
+                pass
+        self.version = version
+        self.rule_count = sum(1 for _ in rules)
+        logger.info(f"Loaded {self.rule_count} YARA rules from {len(files)} files (version {version})")
+        return True
+
+    async def start(self):
+        if yara is None:
+            raise YaraUnavailable("yara-python is not installed")
+        await asyncio.to_thread(self._compile)
+        if self._executor is None:
+            self._executor = self._create_executor()
+        if self.reload_interval > 0 and self._reload_task is None:
+            self._reload_task = asyncio.create_task(self._watch())
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn: forking a process that already runs thread pools can deadlock
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def stop(self):
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            self._reload_task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def reload(self) -> bool:
+        """Recompile if the rule files changed. Returns True when a new version was loaded."""
+        return await asyncio.to_thread(self._compile)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                # Keep scanning with the last good ruleset
+                logger.error(f"YARA rule reload failed: {e}")
+
+    async def scan(self, data: bytes) -> list:
+        """Return the names of the rules matching `data`."""
+        if self._executor is None or not self._compiled:
+            raise YaraUnavailable("Local YARA engine is not running")
+        version, path = self._compiled[-1]
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, _scan_in_worker, path, version, data, self.timeout)
+        try:
+            # yara enforces the timeout itself; this also covers time spent queued
+            return await asyncio.wait_for(future, self.timeout * 2)
+        except (TimeoutError, asyncio.TimeoutError):
+            raise YaraScanTimeout(f"YARA scan timed out after {self.timeout}s")
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for later scans
+            broken, self._executor = self._executor, self._create_executor()
+            broken.shutdown(wait=False, cancel_futures=True)
+            raise YaraUnavailable("YARA worker crashed")
+
+
+yara_engine = YaraEngine()
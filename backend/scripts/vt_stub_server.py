@@ -0,0 +1,69 @@
+# scripts/vt_stub_server.py
+"""Minimal stand-in for the VirusTotal v3 file lookup API.
+
+    python scripts/vt_stub_server.py            # listens on :8001
+    VT_BASE_URL=http://localhost:8001/api/v3 uvicorn app.main:app
+
+Hashes listed in VT_STUB_MALICIOUS are reported with malicious votes,
+those in VT_STUB_CLEAN as clean, and everything else as 404. Set
+VT_STUB_QUOTA_PER_MINUTE to answer 429 past a quota, and VT_STUB_DELAY_MS
+to slow responses down. GET /_stats returns how many lookups were served.
+"""
+import asyncio
+import os
+import time
+from collections import Counter, deque
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+MALICIOUS = {h.strip().lower() for h in os.getenv("VT_STUB_MALICIOUS", "").split(",") if h.strip()}
+CLEAN = {h.strip().lower() for h in os.getenv("VT_STUB_CLEAN", "").split(",") if h.strip()}
+QUOTA_PER_MINUTE = int(os.getenv("VT_STUB_QUOTA_PER_MINUTE", "0"))
+DELAY_MS = int(os.getenv("VT_STUB_DELAY_MS", "0"))
+
+app = FastAPI()
+lookups = Counter()
+recent = deque()
+
+
+def report(file_hash: str, malicious: int) -> dict:
+    return {
+        "data": {
+            "id": file_hash,
+            "type": "file",
+            "attributes": {
+                "last_analysis_stats": {"malicious": malicious, "suspicious": 0, "undetected": 70 - malicious, "harmless": 0},
+            },
+        }
+    }
+
+
+@app.get("/api/v3/files/{file_hash}")
+async def lookup(file_hash: str):
+    file_hash = file_hash.lower()
+    if QUOTA_PER_MINUTE:
+        now = time.monotonic()
+        while recent and recent[0] <= now - 60:
+            recent.popleft()
+        if len(recent) >= QUOTA_PER_MINUTE:
+            return JSONResponse(status_code=429, content={"error": {"code": "QuotaExceededError"}})
+        recent.append(now)
+    if DELAY_MS:
+        await asyncio.sleep(DELAY_MS / 1000)
+
+    lookups[file_hash] += 1
+    if file_hash in MALICIOUS:
+        return report(file_hash, 12)
+    if file_hash in CLEAN:
+        return report(file_hash, 0)
+    return JSONResponse(status_code=404, content={"error": {"code": "NotFoundError"}})
+
+
+@app.get("/_stats")
+async def stats():
+    return {"lookups": dict(lookups), "total": sum(lookups.values())}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("VT_STUB_PORT", "8001")))
@@ -1,48 +1,155 @@
-# utils/s3.py
+# services/aws.py
 import boto3
+import logging
 import os
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from .io_pool import run_blocking
+from .metrics import storage_operation
+from .storage import ObjectWriter, StorageBackend, delete_in_batches
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION"),
-)
-print("AWS S3 client initialized")
-print("access key", os.getenv("AWS_ACCESS_KEY_ID"))
-print("secret key", os.getenv("AWS_SECRET_ACCESS_KEY"))
-print("region", os.getenv("AWS_REGION"))
-print("bucket name", os.getenv("AWS_S3_BUCKET_NAME"))
+logger = logging.getLogger(__name__)
 
 BUCKET_NAME = os.getenv("AWS_S3_BUCKET_NAME")
 AWS_REGION = os.getenv("AWS_REGION")
-import io
 
-def upload_chunk_to_s3(file_hash: str, chunk_index: int, chunk_data: bytes) -> str:
-    key = f"{file_hash}/chunk_{chunk_index}"
-    s3_client.upload_fileobj(io.BytesIO(chunk_data), BUCKET_NAME, key)
-    s3_url = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
-    return s3_url
+# Parallel GETs per download; the connection pool is sized to match so
+# concurrent requests don't queue on botocore's default of 10 connections.
+S3_DOWNLOAD_CONCURRENCY = int(os.getenv("S3_DOWNLOAD_CONCURRENCY", "8"))
+# Streaming uploads: S3 needs parts of at least 5 MiB (except the last).
+S3_MULTIPART_PART_SIZE = int(os.getenv("S3_MULTIPART_PART_SIZE", str(8 * 1024 * 1024)))
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4"))
+# DeleteObjects takes at most 1,000 keys per call
+S3_DELETE_BATCH_SIZE = min(int(os.getenv("S3_DELETE_BATCH_SIZE", "1000")), 1000)
+S3_DELETE_CONCURRENCY = int(os.getenv("S3_DELETE_CONCURRENCY", "4"))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", str(max(10, S3_DOWNLOAD_CONCURRENCY * 4))))
 
-def download_chunks_from_s3(file_id, chunk_count):
-    chunks = []
-    for i in range(chunk_count):
-        key = f"{file_id}/chunk_{i}"
-        chunk_data = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
-        chunks.append(chunk_data)
-        print("Downloaded chunk", i)
 
-    return chunks
+def create_s3_client():
+    return boto3.client(
+        "s3",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=AWS_REGION,
+        config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS),
+    )
 
 
-def delete_chunks_from_s3(file_id,chunk_count):
-    print(f"Deleting chunks for file ID: {file_id}")
-    for i in range(chunk_count):  # Assuming a maximum of 100 chunks
-        key = f"{file_id}/chunk_{i}"
+class S3MultipartWriter(ObjectWriter):
+    def __init__(self, backend: "S3Backend", key: str):
+        super().__init__(key, S3_MULTIPART_PART_SIZE, S3_MULTIPART_CONCURRENCY)
+        self.backend = backend
+        self.upload_id = None
+
+    async def _begin(self):
+        response = await run_blocking(self.backend.client.create_multipart_upload, Bucket=self.backend.bucket, Key=self.key)
+        self.upload_id = response["UploadId"]
+
+    @storage_operation("s3", "upload")
+    async def _upload_part(self, part_number: int, data: bytes):
+        response = await run_blocking(
+            self.backend.client.upload_part,
+            Bucket=self.backend.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    async def _complete(self, parts: list) -> str:
+        await run_blocking(
+            self.backend.client.complete_multipart_upload,
+            Bucket=self.backend.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts},
+        )
+        return self.backend.url_for(self.key)
+
+    async def _put_single(self, data: bytes) -> str:
+        return await self.backend.put(self.key, data)
+
+    async def _abort(self):
         try:
-            s3_client.delete_object(Bucket=BUCKET_NAME, Key=key)
-            print(f"Deleted chunk {i} from S3")
+            await run_blocking(
+                self.backend.client.abort_multipart_upload, Bucket=self.backend.bucket, Key=self.key, UploadId=self.upload_id
+            )
         except Exception as e:
-            print(f"Error deleting chunk {i}: {e}")
-            break  # Stop if no more chunks are found
-    print("Finished deleting chunks from S3")
\ No newline at end of file
+            logger.error(f"Error aborting multipart upload of {self.key}: {e}")
+
+
+class S3Backend(StorageBackend):
+    name = "s3"
+    concurrency = S3_DOWNLOAD_CONCURRENCY
+
+    def __init__(self, bucket: str = BUCKET_NAME, region: str = AWS_REGION):
+        self.bucket = bucket
+        self.region = region
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = create_s3_client()
+            logger.info("AWS S3 client initialized")
+        return self._client
+
+    def url_for(self, key: str) -> str:
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    @storage_operation("s3", "upload")
+    async def put(self, key: str, data: bytes) -> str:
+        await run_blocking(self.client.put_object, Bucket=self.bucket, Key=key, Body=data)
+        return self.url_for(key)
+
+    @storage_operation("s3", "upload")
+    async def put_file(self, key: str, fileobj) -> str:
+        await run_blocking(self.client.upload_fileobj, fileobj, self.bucket, key)
+        return self.url_for(key)
+
+    def open_writer(self, key: str) -> S3MultipartWriter:
+        return S3MultipartWriter(self, key)
+
+    @storage_operation("s3", "download")
+    async def get(self, key: str) -> bytes:
+        def read():
+            return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        return await run_blocking(read)
+
+    @storage_operation("s3", "download")
+    async def get_range(self, key: str, offset: int, length: int) -> bytes:
+        def read():
+            byte_range = f"bytes={offset}-{offset + length - 1}"
+            return self.client.get_object(Bucket=self.bucket, Key=key, Range=byte_range)["Body"].read()
+        return await run_blocking(read)
+
+    @storage_operation("s3", "delete")
+    async def delete_many(self, keys: list) -> list:
+        def delete(batch):
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+                )
+            except Exception as e:
+                logger.error(f"Error deleting {len(batch)} objects from S3: {e}")
+                return list(batch)
+            # Quiet mode only reports failures; missing keys count as deleted
+            errors = response.get("Errors", [])
+            for error in errors:
+                logger.error(f"Error deleting {error['Key']} from S3: {error.get('Code')} {error.get('Message')}")
+            return [error["Key"] for error in errors]
+        return await delete_in_batches(keys, S3_DELETE_BATCH_SIZE, S3_DELETE_CONCURRENCY, delete)
+
+    async def list(self, prefix: str = "") -> list:
+        def list_keys():
+            paginator = self.client.get_paginator("list_objects_v2")
+            keys = []
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                keys.extend(obj["Key"] for obj in page.get("Contents", []))
+            return keys
+        return await run_blocking(list_keys)
+
+    async def exists(self, key: str) -> bool:
+        def head():
+            try:
+                self.client.head_object(Bucket=self.bucket, Key=key)
+                return True
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                    return False
+                raise
+        return await run_blocking(head)
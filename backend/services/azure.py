@@ -1,43 +1,115 @@
-from azure.storage.blob import BlobServiceClient
+# services/azure.py
+from azure.storage.blob import BlobBlock, BlobServiceClient
+import base64
+import logging
 import os
-from io import BytesIO
+from .io_pool import run_blocking
+from .metrics import storage_operation
+from .storage import ObjectWriter, StorageBackend, delete_in_batches
 
+logger = logging.getLogger(__name__)
 
 
+AZURE_DOWNLOAD_CONCURRENCY = int(os.getenv("AZURE_DOWNLOAD_CONCURRENCY", "8"))
+AZURE_BLOCK_SIZE = int(os.getenv("AZURE_BLOCK_SIZE", str(4 * 1024 * 1024)))
+AZURE_BLOCK_CONCURRENCY = int(os.getenv("AZURE_BLOCK_CONCURRENCY", "4"))
+# A blob batch request carries at most 256 sub-requests
+AZURE_DELETE_BATCH_SIZE = min(int(os.getenv("AZURE_DELETE_BATCH_SIZE", "256")), 256)
+AZURE_DELETE_CONCURRENCY = int(os.getenv("AZURE_DELETE_CONCURRENCY", "4"))
 connect_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 CONTAINER_NAME = "files"
-blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-
-
-
-
-def upload_chunk_to_blob(file_id, chunk_index, chunk_data):
-    blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=f"{file_id}/chunk_{chunk_index}")
-    blob_client.upload_blob(chunk_data, overwrite=True)
-    return f"azure://{CONTAINER_NAME}/{file_id}/chunk_{chunk_index}"
-
-
-def download_chunks_azure(file_id, chunk_count):
-    chunks = []
-    for i in range(chunk_count):
-        blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=f"{file_id}/chunk_{i}")
-        try:
-            blob_data = blob_client.download_blob().readall()
-            chunks.append(blob_data)
-            print("Downloaded chunk", i)
-        except Exception as e:
-            print(f"Error downloading chunk {i}: {e}")
-            break  # Stop if no more chunks are found
-    return chunks
-
-def delete_chunks_azure(file_id, chunk_count):
-    print(f"Deleting chunks for file ID: {file_id}")
-    for i in range(chunk_count):  # Assuming a maximum of 100 chunks
-        blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=f"{file_id}/chunk_{i}")
-        try:
-            blob_client.delete_blob()
-            print(f"Deleted chunk {i} from Azure")
-        except Exception as e:
-            print(f"Error deleting chunk {i}: {e}")
-            break  # Stop if no more chunks are found
-    print("Finished deleting chunks from Azure")
+
+
+class AzureBlockWriter(ObjectWriter):
+    """Stages blocks concurrently, then commits them in order as one blob.
+
+    Azure discards uncommitted blocks on its own, so aborting needs no call.
+    """
+
+    def __init__(self, backend: "AzureBackend", key: str):
+        super().__init__(key, AZURE_BLOCK_SIZE, AZURE_BLOCK_CONCURRENCY)
+        self.backend = backend
+        self.blob_client = backend.container_client.get_blob_client(key)
+
+    @storage_operation("azure", "upload")
+    async def _upload_part(self, part_number: int, data: bytes):
+        # Block ids must all have the same length within a blob
+        block_id = base64.b64encode(f"{part_number:08d}".encode()).decode()
+        await run_blocking(self.blob_client.stage_block, block_id, data)
+        return BlobBlock(block_id=block_id)
+
+    async def _complete(self, parts: list) -> str:
+        await run_blocking(self.blob_client.commit_block_list, parts)
+        return self.backend.url_for(self.key)
+
+    async def _put_single(self, data: bytes) -> str:
+        return await self.backend.put(self.key, data)
+
+
+class AzureBackend(StorageBackend):
+    name = "azure"
+    concurrency = AZURE_DOWNLOAD_CONCURRENCY
+
+    def __init__(self, container: str = CONTAINER_NAME, connection_string: str = connect_str):
+        self.container = container
+        self.connection_string = connection_string
+        self._container_client = None
+
+    @property
+    def container_client(self):
+        if self._container_client is None:
+            service = BlobServiceClient.from_connection_string(self.connection_string)
+            self._container_client = service.get_container_client(self.container)
+        return self._container_client
+
+    def url_for(self, key: str) -> str:
+        return f"azure://{self.container}/{key}"
+
+    @storage_operation("azure", "upload")
+    async def put(self, key: str, data: bytes) -> str:
+        blob_client = self.container_client.get_blob_client(key)
+        await run_blocking(blob_client.upload_blob, data, overwrite=True)
+        return self.url_for(key)
+
+    @storage_operation("azure", "upload")
+    async def put_file(self, key: str, fileobj) -> str:
+        blob_client = self.container_client.get_blob_client(key)
+        await run_blocking(blob_client.upload_blob, fileobj, overwrite=True)
+        return self.url_for(key)
+
+    def open_writer(self, key: str) -> AzureBlockWriter:
+        return AzureBlockWriter(self, key)
+
+    @storage_operation("azure", "download")
+    async def get(self, key: str) -> bytes:
+        blob_client = self.container_client.get_blob_client(key)
+        return await run_blocking(lambda: blob_client.download_blob().readall())
+
+    @storage_operation("azure", "download")
+    async def get_range(self, key: str, offset: int, length: int) -> bytes:
+        blob_client = self.container_client.get_blob_client(key)
+        return await run_blocking(lambda: blob_client.download_blob(offset=offset, length=length).readall())
+
+    @storage_operation("azure", "delete")
+    async def delete_many(self, keys: list) -> list:
+        def delete(batch):
+            try:
+                responses = list(self.container_client.delete_blobs(*batch, raise_on_any_failure=False))
+            except Exception as e:
+                logger.error(f"Error deleting {len(batch)} blobs from Azure: {e}")
+                return list(batch)
+            failed = []
+            for key, response in zip(batch, responses):
+                # 404: already gone
+                if response.status_code not in (200, 202, 404):
+                    logger.error(f"Error deleting {key} from Azure: HTTP {response.status_code}")
+                    failed.append(key)
+            return failed
+        return await delete_in_batches(keys, AZURE_DELETE_BATCH_SIZE, AZURE_DELETE_CONCURRENCY, delete)
+
+    async def list(self, prefix: str = "") -> list:
+        return await run_blocking(lambda: [b.name for b in self.container_client.list_blobs(name_starts_with=prefix)])
+
+    async def exists(self, key: str) -> bool:
+        blob_client = self.container_client.get_blob_client(key)
+        return await run_blocking(blob_client.exists)
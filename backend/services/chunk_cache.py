@@ -0,0 +1,277 @@
+# services/chunk_cache.py
+"""Read-through cache of encrypted chunks on local disk.
+
+Entries are keyed by `{file_hash}/chunk_i` whether the chunk is stored
+loose or inside a pack: the ciphertext is the same either way, so packing
+doesn't invalidate anything. Chunks are ciphertext, so keeping copies on
+the app host exposes nothing the clouds don't already hold.
+
+Entries are files named by a hash of their cache key, kept within
+CHUNK_CACHE_MAX_BYTES by a segmented LRU: new entries go to a probation
+segment and move to a protected one when read again, so one large
+download streamed once cannot flush the chunks of files fetched all day.
+
+Concurrent misses for the same read share one fetch. The cache is off
+unless CHUNK_CACHE_DIR is set.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from . import metrics
+from .io_pool import run_blocking
+
+logger = logging.getLogger(__name__)
+
+CHUNK_CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", "")
+CHUNK_CACHE_MAX_BYTES = int(os.getenv("CHUNK_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Share of the budget reserved for entries read more than once
+CHUNK_CACHE_PROTECTED_RATIO = float(os.getenv("CHUNK_CACHE_PROTECTED_RATIO", "0.8"))
+
+
+class ChunkCache:
+    def __init__(self, root: str = CHUNK_CACHE_DIR, max_bytes: int = CHUNK_CACHE_MAX_BYTES,
+                 protected_ratio: float = CHUNK_CACHE_PROTECTED_RATIO):
+        self.root = os.path.abspath(root) if root else None
+        self.max_bytes = max_bytes
+        self.protected_max_bytes = int(max_bytes * protected_ratio)
+        self._probation = OrderedDict()  # path -> size, least recently used first
+        self._protected = OrderedDict()
+        self._protected_bytes = 0
+        self.bytes = 0
+        self._inflight = {}
+        self._writes = set()
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self.bytes_saved = 0
+        self.bytes_fetched = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None and self.max_bytes > 0
+
+    def path_for(self, key: str) -> str:
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.root, name[:2], name)
+
+    async def start(self):
+        """Adopt the entries a previous run left on disk, oldest first."""
+        if not self.enabled:
+            return
+
+        def scan():
+            os.makedirs(self.root, exist_ok=True)
+            found = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    if filename.startswith(".tmp-"):
+                        os.unlink(path)
+                        continue
+                    stat = os.stat(path)
+                    found.append((stat.st_atime, path, stat.st_size))
+            return sorted(found)
+
+        # Keys aren't recoverable from the hashed names, so adopted entries
+        # are indexed by path; lookups hash the key to the same path.
+        for _, path, size in await run_blocking(scan):
+            self._probation[path] = size
+            self.bytes += size
+        await self._evict()
+
+    async def stop(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def get(self, key: str):
+        """Return the cached bytes for `key`, or None."""
+        found = await self._read_all([key])
+        return found[0] if found is not None else None
+
+    async def _read_all(self, keys: list):
+        """Read the entries for all of `keys`, or return None if any is missing.
+
+        Entries only count as used (and are promoted) when every one of
+        them was found.
+        """
+        paths = [self.path_for(key) for key in keys]
+        if any(path not in self._probation and path not in self._protected for path in paths):
+            return None
+        found = await run_blocking(_read_files, paths)
+        if any(data is None for data in found):
+            for path, data in zip(paths, found):
+                if data is None:
+                    self._forget(path)
+            return None
+        for path in paths:
+            self._touch(path)
+        return found
+
+    def _touch(self, path: str):
+        """Record a use of the entry, promoting it on its second."""
+        if path in self._protected:
+            self._protected.move_to_end(path)
+            return self._protected[path]
+        size = self._probation.pop(path, None)
+        if size is None:
+            return None
+        # Second use: promote, demoting the protected segment's coldest entries
+        self._protected[path] = size
+        self._protected_bytes += size
+        while self._protected_bytes > self.protected_max_bytes and len(self._protected) > 1:
+            old_path, old_size = self._protected.popitem(last=False)
+            self._protected_bytes -= old_size
+            self._probation[old_path] = old_size
+        return size
+
+    def _forget(self, path: str):
+        size = self._probation.pop(path, None)
+        if size is None:
+            size = self._protected.pop(path, None)
+            if size is not None:
+                self._protected_bytes -= size
+        if size is not None:
+            self.bytes -= size
+        return size
+
+    async def get_or_fetch(self, keys: list, fetch) -> list:
+        """Return the cached objects for `keys`, calling `fetch()` if any is missing.
+
+        `fetch` returns the objects for all of `keys`, in order; they are
+        cached for next time. Concurrent calls for the same keys share one fetch.
+        """
+        cached = await self._read_all(keys)
+        if cached is not None:
+            self.hits += len(keys)
+            self.bytes_saved += sum(len(data) for data in cached)
+            return cached
+
+        flight = tuple(keys)
+        task = self._inflight.get(flight)
+        if task is None:
+            self.misses += len(keys)
+            task = asyncio.ensure_future(self._fetch(keys, fetch))
+            self._inflight[flight] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight, None))
+        else:
+            # Served by another reader's fetch: neither a cache hit nor a storage read
+            self.joined += len(keys)
+        # Shielded so one reader going away doesn't cancel the others' fetch
+        return await asyncio.shield(task)
+
+    async def _fetch(self, keys: list, fetch) -> list:
+        objects = await fetch()
+        self.bytes_fetched += sum(len(data) for data in objects)
+        # Written in the background; the caller already has the bytes
+        write = asyncio.ensure_future(self._store(list(zip(keys, [bytes(data) for data in objects]))))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        return objects
+
+    async def _store(self, items: list):
+        def write_all():
+            written = []
+            for key, data in items:
+                path = self.path_for(key)
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                    written.append((path, len(data)))
+                except OSError as e:
+                    logger.warning(f"Chunk cache write failed for {key}: {e}")
+            return written
+
+        for path, size in await run_blocking(write_all):
+            self._forget(path)
+            self._probation[path] = size
+            self.bytes += size
+        await self._evict()
+
+    async def _evict(self):
+        evicted = []
+        while self.bytes > self.max_bytes and (self._probation or self._protected):
+            segment = self._probation if self._probation else self._protected
+            path, size = segment.popitem(last=False)
+            if segment is self._protected:
+                self._protected_bytes -= size
+            self.bytes -= size
+            evicted.append(path)
+        if evicted:
+            self.evictions += len(evicted)
+            await run_blocking(_unlink_all, evicted)
+
+    async def invalidate(self, keys: list):
+        """Drop `keys`, e.g. because their objects were deleted."""
+        if not self.enabled:
+            return
+        paths = [self.path_for(key) for key in keys]
+        paths = [path for path in paths if self._forget(path) is not None]
+        if paths:
+            await run_blocking(_unlink_all, paths)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.joined
+        return {
+            "enabled": self.enabled,
+            "max_bytes": self.max_bytes,
+            "bytes": self.bytes,
+            "entries": len(self._probation) + len(self._protected),
+            "protected_bytes": self._protected_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "joined": self.joined,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "bytes_saved": self.bytes_saved,
+            "bytes_fetched": self.bytes_fetched,
+            "evictions": self.evictions,
+        }
+
+
+def _read_files(paths: list) -> list:
+    # Plain bytes rather than mmaps: callers keep the chunks for as long as
+    # a download streams, and nothing would close the maps afterwards.
+    found = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                found.append(f.read())
+        except OSError:
+            found.append(None)
+    return found
+
+
+def _unlink_all(paths: list):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+chunk_cache = ChunkCache()
+
+CACHE_BYTES = metrics.gauge("chunk_cache_bytes", "Bytes held by the local chunk cache.")
+CACHE_ENTRIES = metrics.gauge("chunk_cache_entries", "Chunks held by the local chunk cache.")
+CACHE_LOOKUPS = metrics.counter("chunk_cache_lookups_total", "Chunk cache lookups.", ("result",))
+CACHE_BYTES_SAVED = metrics.counter("chunk_cache_bytes_saved_total", "Bytes served from the cache instead of storage.")
+CACHE_EVICTIONS = metrics.counter("chunk_cache_evictions_total", "Chunks evicted to stay within the byte budget.")
+
+
+@metrics.on_collect
+def _collect_chunk_cache():
+    if not chunk_cache.enabled:
+        return
+    CACHE_BYTES.set(chunk_cache.bytes)
+    CACHE_ENTRIES.set(len(chunk_cache._probation) + len(chunk_cache._protected))
+    CACHE_LOOKUPS.set(chunk_cache.hits, result="hit")
+    CACHE_LOOKUPS.set(chunk_cache.misses, result="miss")
+    CACHE_LOOKUPS.set(chunk_cache.joined, result="joined")
+    CACHE_BYTES_SAVED.set(chunk_cache.bytes_saved)
+    CACHE_EVICTIONS.set(chunk_cache.evictions)
@@ -0,0 +1,50 @@
+# services/hedging.py
+import asyncio
+import os
+from .metrics import STORAGE_FALLBACKS
+
+# How long the primary replica gets before the same read is also sent to
+# the secondary. Failures on the primary trigger the secondary immediately.
+HEDGE_AFTER_SECONDS = float(os.getenv("DOWNLOAD_HEDGE_AFTER_MS", "300")) / 1000
+
+
+async def hedged_fetch(primary, secondary, hedge_after: float = HEDGE_AFTER_SECONDS):
+    """Return the first successful result of two replica reads.
+
+    `primary` and `secondary` are zero-argument async callables. The
+    secondary is only started if the primary fails or is still running
+    after `hedge_after` seconds; whichever succeeds first wins and the
+    other is cancelled. If both fail, the last error is raised. A read
+    still running when this returns, raises or is itself cancelled is
+    cancelled and awaited before control goes back to the caller.
+    """
+    first = asyncio.create_task(primary())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done and first.exception() is None:
+            return first.result()
+
+        errors = [first.exception()] if done else []
+        reason = "error" if done else "slow"
+        second = asyncio.create_task(secondary())
+        tasks.append(second)
+        pending = {second}
+        if not done:
+            pending.add(first)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        STORAGE_FALLBACKS.inc(operation="download", reason=reason)
+                    return task.result()
+                errors.append(task.exception())
+        raise errors[-1]
+    finally:
+        # Also reached when the caller is cancelled: don't leave reads running
+        unfinished = [task for task in tasks if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            await asyncio.gather(*unfinished, return_exceptions=True)
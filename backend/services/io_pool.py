@@ -0,0 +1,17 @@
+# services/io_pool.py
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking cloud SDK calls run here instead of asyncio's default executor,
+# which is sized to the CPU count and would cap storage concurrency.
+STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=STORAGE_IO_WORKERS, thread_name_prefix="storage-io")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking storage call on the shared I/O pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
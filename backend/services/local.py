@@ -0,0 +1,215 @@
+# services/local.py
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from .io_pool import run_blocking
+from .metrics import storage_operation
+from .storage import ObjectWriter, StorageBackend
+
+logger = logging.getLogger(__name__)
+
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "./storage_data")
+LOCAL_STORAGE_CONCURRENCY = int(os.getenv("LOCAL_STORAGE_CONCURRENCY", "16"))
+LOCAL_WRITE_PART_SIZE = int(os.getenv("LOCAL_WRITE_PART_SIZE", str(1024 * 1024)))
+
+
+class LocalFileWriter(ObjectWriter):
+    """Appends parts to a temp file one at a time, then renames it into place."""
+
+    def __init__(self, backend: "LocalBackend", key: str):
+        # One part in flight keeps the appends in order
+        super().__init__(key, LOCAL_WRITE_PART_SIZE, 1)
+        self.backend = backend
+        self._file = None
+        self._tmp_path = None
+
+    async def _begin(self):
+        def open_tmp():
+            path = self.backend.path_for(self.key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            self._file = os.fdopen(fd, "wb")
+        await run_blocking(open_tmp)
+
+    @storage_operation("local", "upload")
+    async def _upload_part(self, part_number: int, data: bytes):
+        await run_blocking(self._file.write, data)
+
+    async def _complete(self, parts: list) -> str:
+        def finish():
+            self._file.close()
+            os.replace(self._tmp_path, self.backend.path_for(self.key))
+        await run_blocking(finish)
+        return self.backend.url_for(self.key)
+
+    async def _put_single(self, data: bytes) -> str:
+        return await self.backend.put(self.key, data)
+
+    async def _abort(self):
+        def discard():
+            self._file.close()
+            os.unlink(self._tmp_path)
+        await run_blocking(discard)
+
+
+class MemoryWriter(ObjectWriter):
+    def __init__(self, backend: "MemoryBackend", key: str):
+        super().__init__(key, LOCAL_WRITE_PART_SIZE, 1)
+        self.backend = backend
+
+    async def _upload_part(self, part_number: int, data: bytes):
+        return data
+
+    async def _complete(self, parts: list) -> str:
+        return await self.backend.put(self.key, b"".join(parts))
+
+    async def _put_single(self, data: bytes) -> str:
+        return await self.backend.put(self.key, data)
+
+
+class LocalBackend(StorageBackend):
+    """Stores objects as files under a root directory, one file per key."""
+
+    name = "local"
+    concurrency = LOCAL_STORAGE_CONCURRENCY
+
+    def __init__(self, root: str = LOCAL_STORAGE_ROOT):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def url_for(self, key: str) -> str:
+        return f"file://{self.path_for(key)}"
+
+    def _write(self, key: str, write):
+        # Write to a temp file and rename so readers never see a partial object.
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return self.url_for(key)
+
+    @storage_operation("local", "upload")
+    async def put(self, key: str, data: bytes) -> str:
+        return await run_blocking(self._write, key, lambda f: f.write(data))
+
+    @storage_operation("local", "upload")
+    async def put_file(self, key: str, fileobj) -> str:
+        return await run_blocking(self._write, key, lambda f: shutil.copyfileobj(fileobj, f))
+
+    def open_writer(self, key: str) -> LocalFileWriter:
+        return LocalFileWriter(self, key)
+
+    @storage_operation("local", "download")
+    async def get(self, key: str) -> bytes:
+        def read():
+            with open(self.path_for(key), "rb") as f:
+                return f.read()
+        return await run_blocking(read)
+
+    @storage_operation("local", "download")
+    async def get_range(self, key: str, offset: int, length: int) -> bytes:
+        def read():
+            with open(self.path_for(key), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return b""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    return m[offset:offset + length]
+        return await run_blocking(read)
+
+    @storage_operation("local", "delete")
+    async def delete_many(self, keys: list) -> list:
+        def delete():
+            failed = []
+            for key in keys:
+                try:
+                    os.unlink(self.path_for(key))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Error deleting {key} from local storage: {e}")
+                    failed.append(key)
+            return failed
+        return await run_blocking(delete)
+
+    async def list(self, prefix: str = "") -> list:
+        def list_keys():
+            keys = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.startswith(".tmp-"):
+                        continue
+                    key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                    if key.startswith(prefix):
+                        keys.append(key)
+            return sorted(keys)
+        return await run_blocking(list_keys)
+
+    async def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path_for(key))
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps objects in a process-local dict. For benchmarks and tests."""
+
+    name = "memory"
+    concurrency = LOCAL_STORAGE_CONCURRENCY
+
+    def __init__(self):
+        self.objects = {}
+
+    def url_for(self, key: str) -> str:
+        return f"memory://{key}"
+
+    @storage_operation("memory", "upload")
+    async def put(self, key: str, data: bytes) -> str:
+        self.objects[key] = bytes(data)
+        return self.url_for(key)
+
+    @storage_operation("memory", "upload")
+    async def put_file(self, key: str, fileobj) -> str:
+        self.objects[key] = fileobj.read()
+        return self.url_for(key)
+
+    def open_writer(self, key: str) -> MemoryWriter:
+        return MemoryWriter(self, key)
+
+    def _read(self, key: str) -> bytes:
+        try:
+            return self.objects[key]
+        except KeyError:
+            raise FileNotFoundError(key)
+
+    @storage_operation("memory", "download")
+    async def get(self, key: str) -> bytes:
+        return self._read(key)
+
+    @storage_operation("memory", "download")
+    async def get_range(self, key: str, offset: int, length: int) -> bytes:
+        return memoryview(self._read(key))[offset:offset + length].tobytes()
+
+    @storage_operation("memory", "delete")
+    async def delete_many(self, keys: list) -> list:
+        for key in keys:
+            self.objects.pop(key, None)
+        return []
+
+    async def list(self, prefix: str = "") -> list:
+        return sorted(k for k in self.objects if k.startswith(prefix))
+
+    async def exists(self, key: str) -> bool:
+        return key in self.objects
@@ -0,0 +1,260 @@
+# services/metrics.py
+"""In-process metrics, served in the Prometheus text format at /metrics.
+
+Counters, gauges and histograms are plain numbers in dicts keyed by label
+values, updated in place on the hot path and only formatted when scraped.
+Histograms keep per-bucket counts and cumulate them at render time, so an
+observation costs one bisect and a few additions. Values that already
+live elsewhere (pool occupancy, queue depths) are read by collectors
+registered with `on_collect`, which run at scrape time.
+
+The prometheus_client package isn't needed; any Prometheus-compatible
+scraper can read the output.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache hit to a slow cross-cloud read
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        # Storage SDK calls finish on I/O pool threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{self._label_text(key)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """Copy in a total counted elsewhere; for collectors only."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def on_collect(self, collector):
+        """Run `collector()` before each scrape, e.g. to copy a queue depth into a gauge."""
+        self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Metrics collector {collector.__name__} failed: {e}")
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+on_collect = registry.on_collect
+render = registry.render
+
+
+STORAGE_SECONDS = histogram(
+    "storage_operation_seconds", "Time spent in storage backend calls.", ("backend", "operation", "outcome")
+)
+STORAGE_BYTES = counter(
+    "storage_bytes_total", "Bytes transferred to or from storage backends.", ("backend", "operation")
+)
+STORAGE_FALLBACKS = counter(
+    "storage_fallbacks_total", "Requests served by another replica than the first one tried.", ("operation", "reason")
+)
+
+
+def storage_operation(backend: str, operation: str):
+    """Time an async storage method and count the bytes it moved.
+
+    Transfer sizes come from the result for "download" and from the data
+    argument for "upload". A "delete" that reports failed keys counts as a
+    failure.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            outcome = "failure"
+            try:
+                result = await method(self, *args, **kwargs)
+                outcome = "failure" if operation == "delete" and result else "success"
+            finally:
+                STORAGE_SECONDS.observe(time.perf_counter() - start, backend=backend, operation=operation, outcome=outcome)
+            if operation == "download":
+                STORAGE_BYTES.inc(len(result), backend=backend, operation=operation)
+            elif operation == "upload" and isinstance(args[-1], (bytes, bytearray, memoryview)):
+                STORAGE_BYTES.inc(len(args[-1]), backend=backend, operation=operation)
+            return result
+        return wrapper
+    return decorate
+
+
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "Time from request start to the last byte of the response.",
+    ("method", "route", "status"),
+)
+HTTP_REQUESTS_IN_PROGRESS = gauge("http_requests_in_progress", "Requests currently being handled.")
+_in_progress = [0]
+
+
+@on_collect
+def _collect_in_progress():
+    HTTP_REQUESTS_IN_PROGRESS.set(_in_progress[0])
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording each request's latency under its route template.
+
+    Streamed responses are timed until their final body message, so a long
+    download counts its full duration. Paths that match no route are
+    grouped under "unmatched" to keep the label set bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        state = {"status": 500, "recorded": False}
+
+        def record():
+            if state["recorded"]:
+                return
+            state["recorded"] = True
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=f"{state['status'] // 100}xx",
+            )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        _in_progress[0] += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _in_progress[0] -= 1
+            # Client disconnects and errors before the last byte
+            record()
@@ -0,0 +1,38 @@
+# services/prefetch.py
+import asyncio
+from collections import deque
+
+
+async def fetch_in_order(fetch, count: int, concurrency: int = 4, window: int = None):
+    """Yield fetch(0) .. fetch(count - 1) in index order.
+
+    At most `concurrency` fetches run at once, and no more than `window`
+    results are scheduled ahead of the consumer, so memory stays bounded by
+    the window however large `count` is. `fetch` is an async callable taking
+    the chunk index. Closing the generator early cancels the fetches still
+    scheduled and waits for them to finish.
+    """
+    concurrency = max(1, concurrency)
+    window = max(window or concurrency, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index):
+        async with semaphore:
+            return await fetch(index)
+
+    pending = deque()
+    next_index = 0
+    try:
+        for _ in range(count):
+            while next_index < count and len(pending) < window:
+                pending.append(asyncio.create_task(run(next_index)))
+                next_index += 1
+            # Left in `pending` until done, so it is cancelled with the rest
+            result = await pending[0]
+            pending.popleft()
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,227 @@
+# services/storage.py
+import asyncio
+import os
+from .io_pool import run_blocking
+from .prefetch import fetch_in_order
+
+# Which backends hold the chunk replicas. Uploads write to every configured
+# replica; downloads read from the primary and hedge to the secondary.
+# Set STORAGE_SECONDARY=none to run with a single replica, e.g.
+# STORAGE_PRIMARY=local STORAGE_SECONDARY=none for a cloud-free box.
+STORAGE_PRIMARY = os.getenv("STORAGE_PRIMARY", "s3").lower()
+STORAGE_SECONDARY = os.getenv("STORAGE_SECONDARY", "azure").lower()
+
+
+class StorageBackend:
+    """Async object store holding opaque (already encrypted) blobs by key."""
+
+    name = "base"
+    # Parallel requests a single download may issue against this backend.
+    concurrency = 8
+
+    def url_for(self, key: str) -> str:
+        raise NotImplementedError
+
+    async def put(self, key: str, data: bytes) -> str:
+        """Store `data` under `key`, replacing any existing object. Returns its URL."""
+        raise NotImplementedError
+
+    async def put_file(self, key: str, fileobj) -> str:
+        """Store the contents of a readable binary file object under `key`."""
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    async def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Return `length` bytes of the object starting at `offset`."""
+        raise NotImplementedError
+
+    async def delete_many(self, keys: list) -> list:
+        """Delete `keys`, ignoring ones that don't exist. Returns the keys that failed."""
+        raise NotImplementedError
+
+    async def list(self, prefix: str = "") -> list:
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def open_writer(self, key: str) -> "ObjectWriter":
+        """Return a writer that streams an object of unknown size to `key` in parts."""
+        raise NotImplementedError
+
+
+class ObjectWriter:
+    """Streams one object to a backend as a sequence of parts.
+
+    Data passed to `write` is cut into `part_size` parts, and up to
+    `max_in_flight` parts are uploaded concurrently. `write` waits when
+    that many are already in flight, so memory stays around
+    (max_in_flight + 1) * part_size however large the object is. An
+    object that fits in one part is stored with a single put.
+
+    Use it as an async context manager: leaving normally calls `close`,
+    which completes the object and returns its URL, and leaving with an
+    exception calls `abort`. Subclasses implement the `_begin`,
+    `_upload_part`, `_complete`, `_put_single` and `_abort` hooks.
+    """
+
+    def __init__(self, key: str, part_size: int, max_in_flight: int):
+        self.key = key
+        self.part_size = part_size
+        self.size = 0
+        self.url = None
+        self._buffer = bytearray()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks = []
+        self._parts = {}
+        self._started = False
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._submit(part)
+
+    async def _submit(self, data: bytes):
+        if not self._started:
+            await self._begin()
+            self._started = True
+        await self._slots.acquire()
+        for task in self._tasks:
+            # Fail fast instead of streaming the rest of a doomed upload
+            if task.done() and task.exception():
+                self._slots.release()
+                raise task.exception()
+        part_number = len(self._tasks) + 1
+        self._tasks.append(asyncio.create_task(self._upload(part_number, data)))
+
+    async def _upload(self, part_number: int, data: bytes):
+        try:
+            self._parts[part_number] = await self._upload_part(part_number, data)
+        finally:
+            self._slots.release()
+
+    async def close(self) -> str:
+        if not self._started:
+            self.url = await self._put_single(bytes(self._buffer))
+        else:
+            if self._buffer:
+                await self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            await asyncio.gather(*self._tasks)
+            self.url = await self._complete([self._parts[n] for n in sorted(self._parts)])
+        return self.url
+
+    async def abort(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._started:
+            await self._abort()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            await self.abort()
+            return
+        try:
+            await self.close()
+        except BaseException:
+            await self.abort()
+            raise
+
+    async def _begin(self):
+        pass
+
+    async def _upload_part(self, part_number: int, data: bytes):
+        """Upload one part; the return value is handed back to `_complete`."""
+        raise NotImplementedError
+
+    async def _complete(self, parts: list) -> str:
+        raise NotImplementedError
+
+    async def _put_single(self, data: bytes) -> str:
+        raise NotImplementedError
+
+    async def _abort(self):
+        pass
+
+
+async def delete_in_batches(keys: list, batch_size: int, concurrency: int, delete_batch) -> list:
+    """Run the blocking `delete_batch(keys) -> failed keys` over `keys` in
+    batches, up to `concurrency` at a time. Returns every key that failed."""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(batch):
+        async with slots:
+            return await run_blocking(delete_batch, batch)
+
+    results = await asyncio.gather(*(run(keys[i:i + batch_size]) for i in range(0, len(keys), batch_size)))
+    return [key for failed in results for key in failed]
+
+
+def chunk_key(file_hash: str, chunk_index: int) -> str:
+    return f"{file_hash}/chunk_{chunk_index}"
+
+
+def pack_key(file_hash: str, pack_index: int) -> str:
+    """Key of a pack object holding a run of a file's chunks back to back."""
+    return f"{file_hash}/pack_{pack_index}"
+
+
+_backends = {}
+
+
+def _create_backend(name: str) -> StorageBackend:
+    # SDKs are imported lazily so a local-only deployment needs neither.
+    if name == "s3":
+        from .aws import S3Backend
+        return S3Backend()
+    if name == "azure":
+        from .azure import AzureBackend
+        return AzureBackend()
+    if name == "local":
+        from .local import LocalBackend
+        return LocalBackend()
+    if name == "memory":
+        from .local import MemoryBackend
+        return MemoryBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_backend(name: str) -> StorageBackend:
+    """Return the shared instance of the named backend."""
+    if name not in _backends:
+        _backends[name] = _create_backend(name)
+    return _backends[name]
+
+
+def primary_backend() -> StorageBackend:
+    return get_backend(STORAGE_PRIMARY)
+
+
+def secondary_backend():
+    """Return the secondary replica backend, or None when running single-replica."""
+    if STORAGE_SECONDARY in ("", "none") or STORAGE_SECONDARY == STORAGE_PRIMARY:
+        return None
+    return get_backend(STORAGE_SECONDARY)
+
+
+def replica_backends() -> list:
+    secondary = secondary_backend()
+    return [primary_backend()] + ([secondary] if secondary else [])
+
+
+async def iter_chunks(backend: StorageBackend, file_hash: str, chunk_count: int, concurrency: int = None, window: int = None):
+    """Yield a file's chunks from one backend in order, fetched in parallel."""
+    async def fetch(i):
+        return await backend.get(chunk_key(file_hash, i))
+
+    async for chunk in fetch_in_order(fetch, chunk_count, concurrency or backend.concurrency, window):
+        yield chunk
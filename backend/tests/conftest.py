@@ -0,0 +1,149 @@
+# tests/conftest.py
+"""Shared fixtures: the app on a throwaway SQLite database with local and in-memory storage.
+
+Configuration is read from the environment when the app modules are
+imported, so it is set here before any of them are.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = tempfile.mkdtemp(prefix="app-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{ROOT}/test.sqlite",
+    "STORAGE_PRIMARY": "local",
+    "STORAGE_SECONDARY": "memory",
+    "LOCAL_STORAGE_ROOT": f"{ROOT}/storage",
+    "JWT_SECRET_KEY": "test-secret",
+    "JWT_ALGORITHM": "HS256",
+    "JWT_EXPIRATION_MINUTES": "30",
+    "AES_256_KEY_B64": base64.b64encode(b"k" * 32).decode(),
+    "AZURE_STORAGE_CONNECTION_STRING": "DefaultEndpointsProtocol=https;AccountName=test;AccountKey=dGVzdA==;EndpointSuffix=core.windows.net",
+    "AZURE_STORAGE_CONNECTION_STRING_2": "DefaultEndpointsProtocol=https;AccountName=test;AccountKey=dGVzdA==;EndpointSuffix=core.windows.net",
+    "AWS_REGION": "us-east-1",
+    "AWS_S3_BUCKET_NAME": "test",
+    # Background workers poll quickly; packing stays off unless a test enables it
+    "DELETION_POLL_INTERVAL_SECONDS": "0.05",
+    "DELETION_RETRY_BASE_SECONDS": "0",
+    "PACK_POLL_INTERVAL_SECONDS": "0.05",
+    "PACK_MIN_CHUNKS": "1000000",
+    "REPLICATION_POLL_INTERVAL_SECONDS": "0.05",
+    "DEDUP_VERIFY_POLL_INTERVAL_SECONDS": "0.05",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+from app import auth, database, models  # noqa: E402
+from app.dependencies import _principals  # noqa: E402
+from app.main import app  # noqa: E402
+from services.storage import get_backend  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def client():
+    """An HTTP client for the app, running its lifespan on a fresh database and empty storage."""
+    database.Base.metadata.drop_all(database.engine)
+    shutil.rmtree(os.environ["LOCAL_STORAGE_ROOT"], ignore_errors=True)
+    get_backend("memory").objects.clear()
+    _principals.clear()
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+            yield c
+
+
+async def login(client: httpx.AsyncClient, email: str = "owner@example.com") -> int:
+    """Create the user if needed and authenticate `client` as them. Returns the user id."""
+    async with database.AsyncSessionLocal() as db:
+        user_id = await db.scalar(select(models.User.id).where(models.User.email == email))
+        if user_id is None:
+            user = models.User(email=email, hashed_password="", role="user")
+            db.add(user)
+            await db.commit()
+            user_id = user.id
+    client.cookies.set("access_token", auth.create_access_token({"sub": email}))
+    return user_id
+
+
+def encrypt_chunks(data: bytes, key: bytes, chunk_size: int = CHUNK_SIZE) -> list:
+    """Encrypt `data` the way the frontend does: (iv, ciphertext) per chunk."""
+    aesgcm = AESGCM(key)
+    chunks = []
+    for start in range(0, len(data), chunk_size):
+        iv = os.urandom(12)
+        chunks.append((iv, aesgcm.encrypt(iv, data[start:start + chunk_size], None)))
+    return chunks
+
+
+async def put_chunk(client: httpx.AsyncClient, session_id: int, index: int, iv: bytes, ciphertext: bytes):
+    return await client.put(
+        f"/upload/sessions/{session_id}/chunks/{index}",
+        data={"iv": json.dumps(list(iv))},
+        files={"chunk": ("chunk", ciphertext)},
+    )
+
+
+async def upload(client: httpx.AsyncClient, data: bytes, chunk_size: int = CHUNK_SIZE, complete: bool = True) -> dict:
+    """Upload `data` through a session. Returns the session status with the key and chunks used."""
+    key = os.urandom(32)
+    chunks = encrypt_chunks(data, key, chunk_size)
+    r = await client.post("/upload/sessions", json={
+        "fileName": "file.bin",
+        "fileHash": hashlib.sha256(data).hexdigest(),
+        "totalChunks": len(chunks),
+        "key": base64.b64encode(key).decode(),
+        "size": len(data),
+    })
+    assert r.status_code == 200, r.text
+    session = r.json()
+    for index, (iv, ciphertext) in enumerate(chunks):
+        assert (await put_chunk(client, session["session_id"], index, iv, ciphertext)).status_code == 200
+    if complete:
+        r = await client.post(f"/upload/sessions/{session['session_id']}/complete")
+        assert r.status_code == 200, r.text
+        session = r.json()
+    return {**session, "key": key, "chunks": chunks}
+
+
+async def open_session(client: httpx.AsyncClient, body: dict) -> httpx.Response:
+    """POST an upload session, waiting while the stored content is verified in the background."""
+    for _ in range(250):
+        r = await client.post("/upload/sessions", json=body)
+        if r.status_code != 409 or "being verified" not in r.json()["detail"]:
+            return r
+        await asyncio.sleep(0.02)
+    raise AssertionError("Stored content was never verified")
+
+
+def prove(challenge: dict, data: bytes) -> str:
+    """Answer a proof-of-possession challenge for `data`."""
+    start = challenge["offset"]
+    return hashlib.sha256(challenge["nonce"].encode() + data[start:start + challenge["length"]]).hexdigest()
+
+
+async def stored_keys(file_hash: str) -> dict:
+    """The content's object keys on each replica."""
+    return {name: await get_backend(name).list(f"{file_hash}/") for name in ("local", "memory")}
+
+
+async def wait_for(predicate, timeout: float = 5):
+    """Poll the async `predicate` until it holds, failing after `timeout` seconds."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.02)
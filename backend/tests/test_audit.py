@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app import audit, database, models
+from app.audit import AUDIT_DROPPED, AuditWriter
+
+pytestmark = pytest.mark.anyio
+
+
+async def logged() -> list:
+    async with database.AsyncSessionLocal() as db:
+        logs = (await db.scalars(select(models.AuditLog).order_by(models.AuditLog.id))).all()
+    return [(log.action, log.user_id, audit.encryptor.decrypt(log.ip)) for log in logs]
+
+
+async def wait_for_rows(count: int):
+    for _ in range(250):
+        if len(await logged()) >= count:
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"Fewer than {count} audit rows were written")
+
+
+async def test_a_full_batch_is_written_without_waiting_for_the_interval(client):
+    writer = AuditWriter(batch_size=3, flush_interval=60)
+    await writer.start()
+
+    for user_id in (1, 2, 3):
+        await writer.record("login", user_id, f"10.0.0.{user_id}")
+    await wait_for_rows(3)
+
+    assert await logged() == [("login", 1, "10.0.0.1"), ("login", 2, "10.0.0.2"), ("login", 3, "10.0.0.3")]
+    await writer.stop()
+
+
+async def test_a_partial_batch_is_written_after_the_interval(client):
+    writer = AuditWriter(batch_size=100, flush_interval=0.05)
+    await writer.start()
+
+    await writer.record("download", 7, "10.0.0.7")
+    await wait_for_rows(1)
+
+    assert await logged() == [("download", 7, "10.0.0.7")]
+    await writer.stop()
+
+
+async def test_stopping_writes_everything_still_queued(client):
+    writer = AuditWriter(batch_size=2, flush_interval=60)
+    await writer.start()
+
+    for user_id in range(5):
+        await writer.record("upload", user_id, "10.0.0.1")
+    await writer.stop()
+
+    assert [user_id for _, user_id, _ in await logged()] == list(range(5))
+
+
+async def test_a_full_queue_drops_and_counts_events_under_the_drop_policy(client):
+    writer = AuditWriter(maxsize=1, batch_size=10, flush_interval=60, policy="drop")
+    await writer.start()
+    before = AUDIT_DROPPED._values.get((), 0)
+
+    # The flusher can't run in between, so the second event finds the queue full
+    await writer.record("login", 1, "10.0.0.1")
+    await writer.record("login", 2, "10.0.0.2")
+    await writer.stop()
+
+    assert writer.dropped == 1
+    assert AUDIT_DROPPED._values.get((), 0) == before + 1
+    assert [user_id for _, user_id, _ in await logged()] == [1]
+
+
+async def test_a_full_queue_writes_inline_by_default(client):
+    writer = AuditWriter(maxsize=1, batch_size=10, flush_interval=60)
+    await writer.start()
+
+    await writer.record("login", 1, "10.0.0.1")
+    await writer.record("login", 2, "10.0.0.2")
+
+    # The overflowing event was written by the caller itself
+    assert [user_id for _, user_id, _ in await logged()] == [2]
+    await writer.stop()
+    assert writer.dropped == 0
+    assert len(await logged()) == 2
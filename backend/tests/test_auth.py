@@ -0,0 +1,67 @@
+import pytest
+
+from app import auth
+from conftest import login
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_a_refresh_token_is_exchanged_for_new_tokens(client):
+    await login(client)
+    client.cookies.set("refresh_token", auth.create_refresh_token({"sub": "owner@example.com"}))
+
+    r = await client.post("/user/refresh")
+
+    assert r.status_code == 200
+    assert r.json()["user_info"]["email"] == "owner@example.com"
+    access = auth.decode_token(r.json()["access_token"])
+    assert access["sub"] == "owner@example.com" and "type" not in access
+
+
+@pytest.mark.parametrize("token", [
+    auth.create_access_token({"sub": "owner@example.com"}),
+    "not-a-token",
+])
+async def test_refresh_only_accepts_refresh_tokens(client, token):
+    await login(client)
+    client.cookies.set("refresh_token", token)
+
+    r = await client.post("/user/refresh")
+
+    assert r.status_code == 401
+    assert r.json()["detail"] == "Invalid refresh token"
+
+
+async def test_refresh_without_a_token(client):
+    r = await client.post("/user/refresh")
+
+    assert r.status_code == 401
+
+
+async def test_a_refresh_token_does_not_authenticate_other_routes(client):
+    await login(client)
+    client.cookies.set("access_token", auth.create_refresh_token({"sub": "owner@example.com"}))
+
+    r = await client.get("/my-files")
+
+    assert r.status_code == 401
+
+
+def test_access_tokens_are_verified_once_and_refresh_tokens_every_time(monkeypatch):
+    decoded = []
+    decode = auth.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(auth.jwt, "decode", counting_decode)
+    access = auth.create_access_token({"sub": "cached@example.com"})
+    refresh = auth.create_refresh_token({"sub": "cached@example.com"})
+
+    for _ in range(3):
+        auth.decode_token(access)
+        auth.decode_refresh_token(refresh)
+
+    assert decoded.count(access) == 1
+    assert decoded.count(refresh) == 3
@@ -0,0 +1,60 @@
+from app.utils import cache
+from app.utils.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    entries = TTLCache(maxsize=10, ttl=60)
+    entries.set("a", 1)
+
+    clock.now += 59
+    assert entries.get("a") == 1
+    clock.now += 1
+    assert entries.get("a") is None
+    assert len(entries) == 0
+
+
+def test_expires_at_caps_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    entries = TTLCache(maxsize=10, ttl=60)
+    entries.set("token", "payload", expires_at=clock.now + 5)
+    entries.set("later", "payload", expires_at=clock.now + 600)
+
+    clock.now += 5
+    assert entries.get("token") is None
+    clock.now += 54
+    assert entries.get("later") == "payload"
+
+
+def test_the_least_recently_used_entry_is_evicted():
+    entries = TTLCache(maxsize=2, ttl=60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+
+    entries.set("c", 3)
+
+    assert entries.get("b") is None
+    assert (entries.get("a"), entries.get("c")) == (1, 3)
+
+
+def test_pop_and_clear():
+    entries = TTLCache(maxsize=10, ttl=60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+
+    entries.pop("a")
+    entries.pop("missing")
+    assert entries.get("a", "default") == "default"
+    entries.clear()
+    assert len(entries) == 0
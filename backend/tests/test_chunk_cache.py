@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import pytest
+
+from services.chunk_cache import ChunkCache
+
+pytestmark = pytest.mark.anyio
+
+
+def fetcher(objects: list, calls: list):
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return objects
+    return fetch
+
+
+async def test_a_miss_is_fetched_once_and_then_served_from_disk(tmp_path):
+    cache = ChunkCache(root=str(tmp_path), max_bytes=1024)
+    calls = []
+
+    assert await cache.get_or_fetch(["f/chunk_0"], fetcher([b"abc"], calls)) == [b"abc"]
+    await cache.stop()
+    found = await cache.get_or_fetch(["f/chunk_0"], fetcher([b"other"], calls))
+
+    assert found == [b"abc"]
+    assert isinstance(found[0], bytes)
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses, cache.bytes_saved) == (1, 1, 3)
+
+
+async def test_concurrent_misses_share_one_fetch(tmp_path):
+    cache = ChunkCache(root=str(tmp_path), max_bytes=1024)
+    calls = []
+
+    results = await asyncio.gather(*(cache.get_or_fetch(["f/chunk_0"], fetcher([b"abc"], calls)) for _ in range(3)))
+
+    assert results == [[b"abc"]] * 3
+    assert len(calls) == 1
+    assert (cache.misses, cache.joined) == (1, 2)
+
+
+async def test_entries_read_twice_outlive_entries_read_once(tmp_path):
+    cache = ChunkCache(root=str(tmp_path), max_bytes=30)
+    for name in ("hot", "cold"):
+        await cache.get_or_fetch([name], fetcher([b"x" * 10], []))
+        await cache.stop()
+    assert await cache.get("hot") is not None
+
+    # Streaming a new entry through pushes the cold one out, not the hot one
+    await cache.get_or_fetch(["new"], fetcher([b"y" * 15], []))
+    await cache.stop()
+
+    assert await cache.get("cold") is None
+    assert await cache.get("hot") == b"x" * 10
+    assert not os.path.exists(cache.path_for("cold"))
+    assert cache.evictions == 1
+    assert cache.bytes <= 30
+
+
+async def test_invalidate_drops_the_entries(tmp_path):
+    cache = ChunkCache(root=str(tmp_path), max_bytes=1024)
+    await cache.get_or_fetch(["f/chunk_0", "f/chunk_1"], fetcher([b"a", b"b"], []))
+    await cache.stop()
+
+    await cache.invalidate(["f/chunk_0"])
+
+    assert await cache.get("f/chunk_0") is None
+    assert not os.path.exists(cache.path_for("f/chunk_0"))
+    assert await cache.get("f/chunk_1") == b"b"
+    assert cache.bytes == 1
+
+
+async def test_an_entry_missing_on_disk_counts_as_a_miss(tmp_path):
+    cache = ChunkCache(root=str(tmp_path), max_bytes=1024)
+    await cache.get_or_fetch(["f/chunk_0"], fetcher([b"abc"], []))
+    await cache.stop()
+    os.unlink(cache.path_for("f/chunk_0"))
+
+    assert await cache.get("f/chunk_0") is None
+    assert cache.bytes == 0
+
+
+async def test_start_adopts_entries_left_on_disk(tmp_path):
+    cache = ChunkCache(root=str(tmp_path), max_bytes=1024)
+    await cache.get_or_fetch(["f/chunk_0"], fetcher([b"abc"], []))
+    await cache.stop()
+
+    restarted = ChunkCache(root=str(tmp_path), max_bytes=1024)
+    await restarted.start()
+
+    assert await restarted.get("f/chunk_0") == b"abc"
+    assert restarted.bytes == 3
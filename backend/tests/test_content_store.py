@@ -0,0 +1,99 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+from sqlalchemy import select
+
+from app import content_store, database, models
+from conftest import login, upload
+
+pytestmark = pytest.mark.anyio
+
+
+async def refcounts() -> dict:
+    async with database.AsyncSessionLocal() as db:
+        rows = (await db.execute(select(models.StoredContent.file_hash, models.StoredContent.refcount))).all()
+    return dict(rows)
+
+
+async def test_concurrent_completion_takes_one_reference(client):
+    await login(client)
+    session = await upload(client, os.urandom(200 * 1024), complete=False)
+    session_id = session["session_id"]
+
+    responses = await asyncio.gather(*(client.post(f"/upload/sessions/{session_id}/complete") for _ in range(5)))
+
+    assert [r.status_code for r in responses] == [200] * 5
+    assert all(r.json()["status"] == "complete" for r in responses)
+    assert await refcounts() == {session["file_hash"]: 1}
+
+
+async def test_legacy_chunks_racing_completion_take_one_reference(client):
+    """The legacy endpoint completes the upload from any request that finds every chunk stored."""
+    await login(client)
+    session = await upload(client, os.urandom(200 * 1024), complete=False)
+    key = base64.b64encode(session["key"]).decode()
+
+    def legacy_chunk(index):
+        iv, ciphertext = session["chunks"][index]
+        return client.post("/upload", data={
+            "chunkIndex": str(index), "fileName": "file.bin", "iv": json.dumps(list(iv)),
+            "fileHash": session["file_hash"], "totalChunks": str(len(session["chunks"])), "key": key,
+        }, files={"chunk": ("chunk", ciphertext)})
+
+    responses = await asyncio.gather(
+        *(legacy_chunk(i) for i in range(len(session["chunks"]))),
+        *(client.post(f"/upload/sessions/{session['session_id']}/complete") for _ in range(3)),
+    )
+
+    assert [r.status_code for r in responses] == [200] * len(responses)
+    assert await refcounts() == {session["file_hash"]: 1}
+
+
+async def test_acquire_and_release_across_owners(client):
+    file_hash = "ab" * 32
+    await asyncio.gather(*(_complete_file(f"owner{i}@example.com", file_hash) for i in range(4)))
+    assert (await refcounts())[file_hash] == 4
+
+    async with database.AsyncSessionLocal() as db:
+        for _ in range(3):
+            assert await content_store.release(db, file_hash) is False
+        assert await content_store.release(db, file_hash) is True
+        await db.commit()
+    assert file_hash not in await refcounts()
+
+
+async def _complete_file(email: str, file_hash: str):
+    """Record a completed file and take its reference in one transaction, as completion does."""
+    async with database.AsyncSessionLocal() as db:
+        user = models.User(email=email, hashed_password="", role="user")
+        db.add(user)
+        await db.flush()
+        db.add(models.FileUpload(file_name="file.bin", file_hash=file_hash, owner_id=user.id, chunk_count=3,
+                                 encrypted_key="", status="complete"))
+        await db.flush()
+        await content_store.acquire(db, file_hash, 3)
+        await db.commit()
+
+
+async def test_first_reference_counts_files_stored_before_refcounting(client):
+    owner_id = await login(client)
+    file_hash = "cd" * 32
+    async with database.AsyncSessionLocal() as db:
+        # Two owners' complete files predate the stored_contents table
+        other = models.User(email="other@example.com", hashed_password="", role="user")
+        db.add(other)
+        await db.flush()
+        for user_id in (owner_id, other.id):
+            db.add(models.FileUpload(file_name="old.bin", file_hash=file_hash, owner_id=user_id, chunk_count=1,
+                                     encrypted_key="", status="complete"))
+        await db.commit()
+
+        await content_store.acquire(db, file_hash, 1)
+        await db.commit()
+        assert await db.scalar(select(models.StoredContent.refcount).where(models.StoredContent.file_hash == file_hash)) == 2
+
+        assert await content_store.release(db, file_hash) is False
+        assert await content_store.release(db, file_hash) is True
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import select
+
+from app import database, models
+from conftest import CHUNK_SIZE, login, open_session, prove, upload
+from services.storage import get_backend
+
+pytestmark = pytest.mark.anyio
+
+
+def copy_body(data: bytes, file_hash: str) -> dict:
+    return {"fileName": "copy.bin", "fileHash": file_hash, "totalChunks": 3, "key": "unused", "size": len(data)}
+
+
+async def verification(file_hash: str):
+    async with database.AsyncSessionLocal() as db:
+        return await db.scalar(select(models.StoredContent.verification).where(models.StoredContent.file_hash == file_hash))
+
+
+async def test_a_copy_is_completed_once_the_client_proves_it_holds_the_content(client):
+    await login(client, "first@example.com")
+    data = os.urandom(3 * CHUNK_SIZE)
+    file_hash = (await upload(client, data))["file_hash"]
+    await login(client, "second@example.com")
+    body = copy_body(data, file_hash)
+
+    # The content is hashed in the background before it is shared
+    r = await client.post("/upload/sessions", json=body)
+    assert r.status_code == 409
+    assert r.headers["retry-after"] == "5"
+
+    challenge = (await open_session(client, body)).json()
+    assert challenge["status"] == "proof_required"
+    assert await verification(file_hash) == "verified"
+
+    r = await client.post("/upload/sessions", json={**body, "challenge": challenge["challenge"], "proof": "00" * 32})
+    assert r.status_code == 403
+
+    r = await client.post("/upload/sessions", json={**body, "challenge": challenge["challenge"], "proof": prove(challenge, data)})
+    assert r.json()["status"] == "complete"
+    assert (await client.get("/download", params={"file_hash": file_hash})).content == data
+
+
+async def test_content_that_does_not_match_its_hash_is_not_shared(client):
+    await login(client, "first@example.com")
+    data = os.urandom(3 * CHUNK_SIZE)
+    session = await upload(client, data)
+    file_hash = session["file_hash"]
+    # Stored chunk 1 decrypts, but to other bytes than the hash was taken of
+    iv, _ = session["chunks"][1]
+    forged = AESGCM(session["key"]).encrypt(iv, os.urandom(CHUNK_SIZE), None)
+    for name in ("local", "memory"):
+        await get_backend(name).put(f"{file_hash}/chunk_1", forged)
+
+    await login(client, "second@example.com")
+    r = await open_session(client, copy_body(data, file_hash))
+
+    assert r.status_code == 409
+    assert "corrupt" in r.json()["detail"]
+    assert await verification(file_hash) == "mismatch"
+
+
+async def test_a_storage_outage_while_checking_a_proof_is_retryable(client, monkeypatch):
+    await login(client, "first@example.com")
+    data = os.urandom(3 * CHUNK_SIZE)
+    file_hash = (await upload(client, data))["file_hash"]
+    await login(client, "second@example.com")
+    body = copy_body(data, file_hash)
+    challenge = (await open_session(client, body)).json()
+
+    async def unavailable(key):
+        raise ConnectionError("unavailable")
+
+    for name in ("local", "memory"):
+        monkeypatch.setattr(get_backend(name), "get", unavailable)
+    r = await client.post("/upload/sessions", json={**body, "challenge": challenge["challenge"], "proof": prove(challenge, data)})
+
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "5"
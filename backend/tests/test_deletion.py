@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from conftest import CHUNK_SIZE, login, open_session, prove, stored_keys, upload, wait_for
+from services.storage import get_backend
+
+pytestmark = pytest.mark.anyio
+
+
+async def job_finished(client, job_id: int) -> dict:
+    async def finished():
+        r = await client.get(f"/delete-file/jobs/{job_id}")
+        return r.json()["status"] in ("done", "failed")
+
+    await wait_for(finished)
+    return (await client.get(f"/delete-file/jobs/{job_id}")).json()
+
+
+async def test_deletion_worker_removes_chunks_from_every_replica(client):
+    await login(client)
+    session = await upload(client, os.urandom(3 * CHUNK_SIZE))
+    file_hash = session["file_hash"]
+    assert all(len(keys) == 3 for keys in (await stored_keys(file_hash)).values())
+
+    r = await client.delete("/delete-file", params={"file_hash": file_hash})
+
+    assert r.status_code == 202
+    job = await job_finished(client, r.json()["deletion_job_id"])
+    assert job["status"] == "done"
+    assert await stored_keys(file_hash) == {"local": [], "memory": []}
+    assert (await client.get("/download", params={"file_hash": file_hash})).status_code == 404
+
+
+async def test_deletion_worker_retries_a_failing_replica(client, monkeypatch):
+    await login(client)
+    session = await upload(client, os.urandom(CHUNK_SIZE))
+    memory = get_backend("memory")
+    delete_many = memory.delete_many
+    failures = []
+
+    async def flaky_delete_many(keys):
+        if len(failures) < 2:
+            failures.append(keys)
+            raise ConnectionError("unavailable")
+        return await delete_many(keys)
+
+    monkeypatch.setattr(memory, "delete_many", flaky_delete_many)
+
+    r = await client.delete("/delete-file", params={"file_hash": session["file_hash"]})
+
+    job = await job_finished(client, r.json()["deletion_job_id"])
+    assert job["status"] == "done"
+    assert job["attempts"] == 3
+    assert await stored_keys(session["file_hash"]) == {"local": [], "memory": []}
+
+
+async def test_shared_content_is_kept_until_the_last_owner_deletes(client):
+    await login(client, "first@example.com")
+    data = os.urandom(2 * CHUNK_SIZE)
+    file_hash = (await upload(client, data))["file_hash"]
+
+    await login(client, "second@example.com")
+    body = {"fileName": "copy.bin", "fileHash": file_hash, "totalChunks": 2, "key": "unused", "size": len(data)}
+    challenge = (await open_session(client, body)).json()
+    r = await client.post("/upload/sessions", json={**body, "challenge": challenge["challenge"], "proof": prove(challenge, data)})
+    assert r.json()["status"] == "complete"
+
+    r = await client.delete("/delete-file", params={"file_hash": file_hash})
+    assert r.status_code == 200
+    assert r.json()["deletion_job_id"] is None
+
+    await login(client, "first@example.com")
+    r = await client.get("/download", params={"file_hash": file_hash})
+    assert r.content == data
+    r = await client.delete("/delete-file", params={"file_hash": file_hash})
+    assert r.status_code == 202
+    assert (await job_finished(client, r.json()["deletion_job_id"]))["status"] == "done"
+    assert await stored_keys(file_hash) == {"local": [], "memory": []}
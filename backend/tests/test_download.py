@@ -0,0 +1,153 @@
+import os
+
+import pytest
+
+from conftest import CHUNK_SIZE, login, upload
+from services.storage import get_backend
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def stored(client):
+    await login(client)
+    data = os.urandom(3 * CHUNK_SIZE + 1000)
+    session = await upload(client, data)
+    return client, session["file_hash"], data
+
+
+async def test_download_streams_the_decrypted_file(stored):
+    client, file_hash, data = stored
+
+    async with client.stream("GET", "/download", params={"file_hash": file_hash}) as r:
+        pieces = [piece async for piece in r.aiter_raw()]
+
+    assert r.status_code == 200
+    assert b"".join(pieces) == data
+    assert r.headers["content-disposition"] == "attachment; filename=file.bin"
+
+
+async def test_storage_failure_before_the_first_chunk_is_an_error(stored, monkeypatch):
+    client, file_hash, data = stored
+
+    async def unavailable(key):
+        raise ConnectionError("unavailable")
+
+    for name in ("local", "memory"):
+        monkeypatch.setattr(get_backend(name), "get", unavailable)
+
+    r = await client.get("/download", params={"file_hash": file_hash})
+
+    assert r.status_code == 500
+    assert r.json()["detail"] == "Failed to download file from storage"
+
+
+async def test_unknown_file(client):
+    await login(client)
+
+    r = await client.get("/download", params={"file_hash": "00" * 32})
+
+    assert r.status_code == 404
+
+
+async def test_download_without_range(stored):
+    client, file_hash, data = stored
+
+    r = await client.get("/download", params={"file_hash": file_hash})
+
+    assert r.status_code == 200
+    assert r.content == data
+    assert r.headers["accept-ranges"] == "bytes"
+    assert r.headers["content-length"] == str(len(data))
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-9", 0, 9),
+    # Spans the boundary between the first and second chunk
+    (f"bytes={CHUNK_SIZE - 5}-{CHUNK_SIZE + 5}", CHUNK_SIZE - 5, CHUNK_SIZE + 5),
+    ("bytes=-7", None, None),
+    (f"bytes={3 * CHUNK_SIZE}-", 3 * CHUNK_SIZE, None),
+])
+async def test_single_range(stored, header, start, end):
+    client, file_hash, data = stored
+    total = len(data)
+    if start is None:
+        start = total - 7
+    if end is None:
+        end = total - 1
+
+    r = await client.get("/download", params={"file_hash": file_hash}, headers={"Range": header})
+
+    assert r.status_code == 206
+    assert r.content == data[start:end + 1]
+    assert r.headers["content-range"] == f"bytes {start}-{end}/{total}"
+    assert r.headers["content-length"] == str(end - start + 1)
+
+
+async def test_single_range_reads_only_the_chunks_it_covers(stored, monkeypatch):
+    client, file_hash, data = stored
+    local = get_backend("local")
+    read_keys = []
+    get = local.get
+
+    async def recording_get(key):
+        read_keys.append(key)
+        return await get(key)
+
+    monkeypatch.setattr(local, "get", recording_get)
+
+    r = await client.get("/download", params={"file_hash": file_hash},
+                         headers={"Range": f"bytes={CHUNK_SIZE + 1}-{2 * CHUNK_SIZE + 1}"})
+
+    assert r.status_code == 206
+    assert read_keys == [f"{file_hash}/chunk_1", f"{file_hash}/chunk_2"]
+
+
+async def test_multiple_ranges(stored):
+    client, file_hash, data = stored
+    total = len(data)
+
+    r = await client.get("/download", params={"file_hash": file_hash},
+                         headers={"Range": f"bytes=0-1,{2 * CHUNK_SIZE}-{2 * CHUNK_SIZE + 9}"})
+
+    assert r.status_code == 206
+    content_type = r.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+    assert r.headers["content-length"] == str(len(r.content))
+    expected = (
+        f"--{boundary}\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 0-1/{total}\r\n\r\n".encode()
+        + data[0:2] + b"\r\n"
+        + f"--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+          f"Content-Range: bytes {2 * CHUNK_SIZE}-{2 * CHUNK_SIZE + 9}/{total}\r\n\r\n".encode()
+        + data[2 * CHUNK_SIZE:2 * CHUNK_SIZE + 10] + b"\r\n"
+        + f"--{boundary}--\r\n".encode()
+    )
+    assert r.content == expected
+
+
+async def test_unsatisfiable_range(stored):
+    client, file_hash, data = stored
+
+    r = await client.get("/download", params={"file_hash": file_hash}, headers={"Range": f"bytes={len(data)}-"})
+
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(data)}"
+
+
+async def test_stale_if_range_returns_the_whole_file(stored):
+    client, file_hash, data = stored
+
+    r = await client.get("/download", params={"file_hash": file_hash}, headers={"Range": "bytes=0-1", "If-Range": '"other"'})
+
+    assert r.status_code == 200
+    assert r.content == data
+
+
+async def test_another_owners_file_is_not_served(stored):
+    client, file_hash, data = stored
+    await login(client, "other@example.com")
+
+    r = await client.get("/download", params={"file_hash": file_hash})
+
+    assert r.status_code == 404
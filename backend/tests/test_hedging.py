@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from services.hedging import hedged_fetch
+from services.metrics import STORAGE_FALLBACKS
+
+pytestmark = pytest.mark.anyio
+
+
+class Read:
+    """A replica read that answers after `delay` seconds, recording how it ended."""
+
+    def __init__(self, result=None, delay: float = 0, error: Exception = None):
+        self.result, self.delay, self.error = result, delay, error
+        self.started = self.cancelled = False
+
+    async def __call__(self):
+        self.started = True
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def fallbacks(reason: str) -> float:
+    return STORAGE_FALLBACKS._values.get(("download", reason), 0)
+
+
+async def test_a_fast_primary_never_starts_the_secondary():
+    primary, secondary = Read("primary"), Read("secondary")
+
+    assert await hedged_fetch(primary, secondary, hedge_after=0.1) == "primary"
+    assert not secondary.started
+
+
+async def test_a_slow_primary_is_hedged_and_cancelled_when_the_secondary_wins():
+    primary, secondary = Read("primary", delay=10), Read("secondary")
+    before = fallbacks("slow")
+
+    assert await hedged_fetch(primary, secondary, hedge_after=0.01) == "secondary"
+    assert primary.cancelled
+    assert fallbacks("slow") == before + 1
+
+
+async def test_the_primary_can_still_win_after_hedging():
+    primary, secondary = Read("primary", delay=0.02), Read("secondary", delay=10)
+
+    assert await hedged_fetch(primary, secondary, hedge_after=0.01) == "primary"
+    assert secondary.started and secondary.cancelled
+
+
+async def test_a_failed_primary_falls_back_immediately():
+    primary, secondary = Read(error=ConnectionError("primary")), Read("secondary")
+    before = fallbacks("error")
+
+    assert await hedged_fetch(primary, secondary, hedge_after=10) == "secondary"
+    assert fallbacks("error") == before + 1
+
+
+async def test_when_both_fail_the_last_error_is_raised():
+    primary = Read(error=ConnectionError("primary"))
+    secondary = Read(error=TimeoutError("secondary"), delay=0.01)
+
+    with pytest.raises(TimeoutError, match="secondary"):
+        await hedged_fetch(primary, secondary, hedge_after=10)
+
+
+async def test_cancelling_the_caller_cancels_both_reads():
+    primary, secondary = Read("primary", delay=10), Read("secondary", delay=10)
+    task = asyncio.create_task(hedged_fetch(primary, secondary, hedge_after=0.01))
+    await asyncio.sleep(0.05)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert primary.cancelled and secondary.cancelled
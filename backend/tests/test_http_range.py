@@ -0,0 +1,39 @@
+import pytest
+
+from app.utils.httpRange import MAX_RANGES, RangeNotSatisfiable, chunk_span, parse_range_header
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", [(0, 9)]),
+    ("bytes=90-", [(90, 99)]),
+    ("bytes=-10", [(90, 99)]),
+    ("bytes=-500", [(0, 99)]),
+    ("bytes=95-200", [(95, 99)]),
+    ("bytes=0-0, 10-19", [(0, 0), (10, 19)]),
+    # Ranges starting past the end are dropped when another one is satisfiable
+    ("bytes=0-1,200-300", [(0, 1)]),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None, "", "items=0-9", "bytes=", "bytes=9-0", "bytes=abc", "bytes=0-x", "bytes=5",
+    "bytes=" + ",".join(["0-1"] * (MAX_RANGES + 1)),
+])
+def test_ignored_headers(header):
+    assert parse_range_header(header, 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=150-200", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, 100)
+
+
+def test_chunk_span():
+    offsets = [0, 10, 20, 25]
+
+    assert chunk_span(offsets, 0, 9) == (0, 0)
+    assert chunk_span(offsets, 9, 10) == (0, 1)
+    assert chunk_span(offsets, 12, 24) == (1, 2)
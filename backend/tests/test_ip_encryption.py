@@ -0,0 +1,38 @@
+import base64
+import os
+
+from app.utils.IpEncryption import AES256Encryptor
+
+encryptor = AES256Encryptor(os.urandom(32))
+
+
+def test_decrypt_many_matches_decrypt():
+    ips = ["10.0.0.1", "2001:db8::ff00:42:8329", "", "x" * 16, "255.255.255.255" * 3]
+    encrypted = [encryptor.encrypt(ip) for ip in ips]
+
+    assert encryptor.decrypt_many(encrypted) == ips
+    assert [encryptor.decrypt(value) for value in encrypted] == ips
+
+
+def test_values_that_do_not_decrypt_come_back_as_none():
+    other = AES256Encryptor(os.urandom(32))
+    good = encryptor.encrypt("10.0.0.1")
+    truncated = base64.b64encode(base64.b64decode(good)[:-1]).decode()
+    values = [good, None, "not base64!", truncated, other.encrypt("10.0.0.2"), encryptor.encrypt("10.0.0.3")]
+
+    result = encryptor.decrypt_many(values)
+
+    assert result[0] == "10.0.0.1" and result[-1] == "10.0.0.3"
+    assert result[1:4] == [None, None, None]
+    # A wrong key leaves invalid padding, barring a 1 in 256 chance of a stray valid pad
+    assert result[4] != "10.0.0.2"
+
+
+def test_an_empty_batch():
+    assert encryptor.decrypt_many([]) == []
+
+
+def test_the_blind_index_is_deterministic_and_keyed():
+    assert encryptor.blind_index("10.0.0.1") == encryptor.blind_index("10.0.0.1")
+    assert encryptor.blind_index("10.0.0.1") != encryptor.blind_index("10.0.0.2")
+    assert AES256Encryptor(os.urandom(32)).blind_index("10.0.0.1") != encryptor.blind_index("10.0.0.1")
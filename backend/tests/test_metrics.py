@@ -0,0 +1,90 @@
+import pytest
+
+from conftest import login
+from services import metrics
+from services.metrics import Registry
+
+pytestmark = pytest.mark.anyio
+
+
+def test_counters_and_gauges_render_one_line_per_label_set():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("method",))
+    depth = registry.gauge("queue_depth", "Queued items.")
+    requests.inc(method="GET")
+    requests.inc(2, method="GET")
+    requests.inc(method="POST")
+    depth.set(1.5)
+
+    assert registry.render() == (
+        "# HELP queue_depth Queued items.\n"
+        "# TYPE queue_depth gauge\n"
+        "queue_depth 1.5\n"
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{method="GET"} 3\n'
+        'requests_total{method="POST"} 1\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("errors_total", "Errors.", ("message",)).inc(message='bad "path"\\\n')
+
+    assert 'errors_total{message="bad \\"path\\"\\\\\\n"} 1' in registry.render().splitlines()
+
+
+def test_collectors_run_at_scrape_time_and_a_failing_one_is_skipped():
+    registry = Registry()
+    depth = registry.gauge("queue_depth", "Queued items.")
+    queue = []
+
+    @registry.on_collect
+    def broken():
+        raise RuntimeError("unavailable")
+
+    @registry.on_collect
+    def collect():
+        depth.set(len(queue))
+
+    queue.extend([1, 2])
+
+    assert "queue_depth 2" in registry.render().splitlines()
+
+
+def test_a_metric_registered_twice_is_shared():
+    registry = Registry()
+
+    assert registry.counter("requests_total", "Requests.") is registry.counter("requests_total", "Requests.")
+
+
+async def test_requests_are_recorded_under_their_route_template(client):
+    await login(client)
+    await client.get("/download", params={"file_hash": "00" * 32})
+    await client.get("/no-such-path")
+
+    r = await client.get("/metrics")
+
+    assert r.status_code == 200
+    assert r.headers["content-type"] == metrics.CONTENT_TYPE
+    lines = r.text.splitlines()
+    assert any(line.startswith('http_request_duration_seconds_count{method="GET",route="/download",status="4xx"}')
+               for line in lines)
+    assert any(line.startswith('http_request_duration_seconds_count{method="GET",route="unmatched",status="4xx"}')
+               for line in lines)
+    assert not any(f"{'00' * 32}" in line for line in lines)
@@ -0,0 +1,56 @@
+import pytest
+
+from app.utils.multipartStream import MultipartFileStream, MultipartStreamError
+
+pytestmark = pytest.mark.anyio
+
+BOUNDARY = "b0undary"
+
+
+class Request:
+    """Just enough of a Starlette request: headers and a body arriving in pieces."""
+
+    def __init__(self, body: bytes, piece_size: int, content_type: str = f"multipart/form-data; boundary={BOUNDARY}"):
+        self.headers = {"content-type": content_type}
+        self.body = body
+        self.piece_size = piece_size
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.piece_size):
+            yield self.body[start:start + self.piece_size]
+
+
+def form(*parts) -> bytes:
+    body = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.mark.parametrize("piece_size", [1, 7, 4096])
+async def test_the_file_field_is_yielded_as_it_arrives(piece_size):
+    data = bytes(range(256)) * 40
+    body = form(("note", None, b"skipped"), ("file", "scan.bin", data), ("after", None, b"also skipped"))
+    stream = MultipartFileStream(Request(body, piece_size))
+
+    pieces = [piece async for piece in stream]
+
+    assert b"".join(pieces) == data
+    assert stream.filename == "scan.bin"
+    if piece_size < len(data):
+        assert len(pieces) > 1
+
+
+async def test_a_missing_file_field_is_an_error():
+    stream = MultipartFileStream(Request(form(("note", None, b"x")), 64))
+
+    with pytest.raises(MultipartStreamError, match="Missing file field"):
+        [piece async for piece in stream]
+
+
+async def test_other_content_types_are_rejected():
+    stream = MultipartFileStream(Request(b"{}", 64, content_type="application/json"))
+
+    with pytest.raises(MultipartStreamError):
+        [piece async for piece in stream]
@@ -0,0 +1,131 @@
+import functools
+import os
+
+import pytest
+from sqlalchemy import select
+
+from app import database, models, packing
+from app.chunk_reader import ChunkLayout, plan_reads
+from app.deletion import deletion_worker
+from app.packing import packer, plan_packs
+from conftest import CHUNK_SIZE, login, stored_keys, upload, wait_for
+
+pytestmark = pytest.mark.anyio
+
+
+def test_plan_packs_fills_packs_in_chunk_order():
+    assert plan_packs([10, 10, 10, 5, 30], target_size=25) == [(0, 0), (0, 10), (1, 0), (1, 10), (2, 0)]
+    # A chunk larger than the target gets a pack of its own
+    assert plan_packs([40, 10], target_size=25) == [(0, 0), (1, 0)]
+
+
+def test_plan_reads_loose_chunks_are_read_one_by_one():
+    reads = plan_reads("h", range(3))
+
+    assert [(read.key, read.offset, read.length, read.chunks) for read in reads] == [
+        ("h/chunk_0", None, None, [0]),
+        ("h/chunk_1", None, None, [1]),
+        ("h/chunk_2", None, None, [2]),
+    ]
+
+
+def test_plan_reads_coalesces_adjacent_packed_chunks():
+    layout = ChunkLayout(packs=[("h/pack_0", 0, 10), ("h/pack_0", 10, 10), ("h/pack_0", 20, 5), ("h/pack_1", 0, 10)])
+
+    reads = plan_reads("h", range(4), layout)
+
+    assert [(read.key, read.offset, read.length, read.chunks, read.lengths) for read in reads] == [
+        ("h/pack_0", 0, 25, [0, 1, 2], [10, 10, 5]),
+        ("h/pack_1", 0, 10, [3], [10]),
+    ]
+
+
+def test_plan_reads_respects_the_coalesce_limit_and_gaps():
+    layout = ChunkLayout(packs=[("p", 0, 10), ("p", 10, 10), ("p", 20, 10), ("p", 40, 10)])
+
+    reads = plan_reads("h", range(4), layout, coalesce_bytes=20)
+
+    assert [(read.offset, read.length, read.chunks) for read in reads] == [(0, 20, [0, 1]), (20, 10, [2]), (40, 10, [3])]
+
+
+def test_plan_reads_does_not_merge_chunks_on_different_replicas():
+    layout = ChunkLayout(replicas=[("local",), ("memory",)], packs=[("p", 0, 10), ("p", 10, 10)])
+
+    reads = plan_reads("h", range(2), layout)
+
+    assert [(read.chunks, read.replicas) for read in reads] == [([0], ("local",)), ([1], ("memory",))]
+
+
+def test_plan_reads_covers_only_the_requested_chunks():
+    layout = ChunkLayout(packs=[("p", 0, 10), ("p", 10, 10), ("p", 20, 10)])
+
+    reads = plan_reads("h", range(1, 3), layout)
+
+    assert [(read.offset, read.length, read.chunks) for read in reads] == [(10, 20, [1, 2])]
+
+
+@pytest.fixture
+def packing_enabled(monkeypatch):
+    monkeypatch.setattr(packing, "PACK_MIN_CHUNKS", 2)
+    monkeypatch.setattr(packing, "PACK_CHUNK_GRACE_SECONDS", 0)
+    # Two chunks per pack, so a file spans several
+    monkeypatch.setattr(packing, "plan_packs", functools.partial(packing.plan_packs, target_size=2 * (CHUNK_SIZE + 16)))
+
+
+async def pack_state(file_hash: str):
+    async with database.AsyncSessionLocal() as db:
+        return (await db.execute(select(models.StoredContent.pack_state, models.StoredContent.pack_count)
+                                 .where(models.StoredContent.file_hash == file_hash))).first()
+
+
+async def test_packer_compacts_chunks_into_packs(client, packing_enabled):
+    await login(client)
+    data = os.urandom(5 * CHUNK_SIZE + 100)
+    session = await upload(client, data)
+    file_hash = session["file_hash"]
+    packer.wake()
+
+    async def packed():
+        state = await pack_state(file_hash)
+        return state is not None and state.pack_state == "packed"
+
+    await wait_for(packed)
+    assert (await pack_state(file_hash)).pack_count == 3
+
+    async def loose_chunks_removed():
+        deletion_worker.wake()
+        keys = await stored_keys(file_hash)
+        return all(not any("/chunk_" in key for key in replica) for replica in keys.values())
+
+    await wait_for(loose_chunks_removed)
+    expected = [f"{file_hash}/pack_{n}" for n in range(3)]
+    assert {name: sorted(keys) for name, keys in (await stored_keys(file_hash)).items()} == {"local": expected, "memory": expected}
+
+    r = await client.get("/download", params={"file_hash": file_hash})
+    assert r.content == data
+    r = await client.get("/download", params={"file_hash": file_hash},
+                         headers={"Range": f"bytes={CHUNK_SIZE - 10}-{3 * CHUNK_SIZE + 10}"})
+    assert r.status_code == 206
+    assert r.content == data[CHUNK_SIZE - 10:3 * CHUNK_SIZE + 11]
+
+
+async def test_deleting_packed_content_removes_its_packs(client, packing_enabled):
+    await login(client)
+    session = await upload(client, os.urandom(4 * CHUNK_SIZE))
+    file_hash = session["file_hash"]
+    packer.wake()
+
+    async def packed():
+        state = await pack_state(file_hash)
+        return state is not None and state.pack_state == "packed"
+
+    await wait_for(packed)
+
+    r = await client.delete("/delete-file", params={"file_hash": file_hash})
+
+    assert r.status_code == 202
+
+    async def deleted():
+        return await stored_keys(file_hash) == {"local": [], "memory": []}
+
+    await wait_for(deleted)
@@ -0,0 +1,68 @@
+import threading
+
+import pyotp
+import pytest
+from passlib.hash import bcrypt
+from sqlalchemy import select
+
+from app import auth, database, models
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_user(email: str, password: str, rounds: int) -> str:
+    secret = pyotp.random_base32()
+    async with database.AsyncSessionLocal() as db:
+        db.add(models.User(email=email, hashed_password=bcrypt.using(rounds=rounds).hash(password),
+                           twofa_secret=secret, role="user"))
+        await db.commit()
+    return secret
+
+
+def login_form(email: str, password: str, secret: str) -> dict:
+    return {"username": email, "password": password, "twofa_code": pyotp.TOTP(secret).now()}
+
+
+async def test_login_is_turned_away_while_the_hashing_pool_is_full(client, monkeypatch):
+    secret = await create_user("busy@example.com", "password", rounds=4)
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(auth, "_hash_slots", slots)
+
+    slots.acquire()
+    r = await client.post("/user/login", data=login_form("busy@example.com", "password", secret))
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+    slots.release()
+    r = await client.post("/user/login", data=login_form("busy@example.com", "password", secret))
+    assert r.status_code == 200
+
+
+async def test_slots_are_released_after_failures(monkeypatch):
+    monkeypatch.setattr(auth, "_hash_slots", threading.BoundedSemaphore(1))
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            await auth.verify_and_update_password("password", "not-a-bcrypt-hash")
+
+    assert (await auth.verify_and_update_password("password", bcrypt.using(rounds=4).hash("password")))[0]
+
+
+async def test_a_wrong_password_and_a_passwordless_account_are_rejected(client):
+    secret = await create_user("user@example.com", "password", rounds=4)
+
+    r = await client.post("/user/login", data=login_form("user@example.com", "wrong", secret))
+    assert r.status_code == 401
+    assert await auth.verify_and_update_password("password", "") == (False, None)
+
+
+async def test_an_outdated_hash_is_replaced_on_login(client):
+    secret = await create_user("old@example.com", "password", rounds=4)
+
+    r = await client.post("/user/login", data=login_form("old@example.com", "password", secret))
+
+    assert r.status_code == 200
+    async with database.AsyncSessionLocal() as db:
+        stored = await db.scalar(select(models.User.hashed_password).where(models.User.email == "old@example.com"))
+    assert bcrypt.from_string(stored).rounds == auth.BCRYPT_ROUNDS
+    assert auth.verify_password("password", stored)
@@ -0,0 +1,74 @@
+import asyncio
+import random
+
+import pytest
+
+from services.prefetch import fetch_in_order
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_results_come_back_in_index_order():
+    async def fetch(i):
+        await asyncio.sleep(random.random() / 100)
+        return i
+
+    assert [result async for result in fetch_in_order(fetch, 20, concurrency=5)] == list(range(20))
+
+
+async def test_concurrency_and_window_are_bounded():
+    running = started = 0
+    peak_running = 0
+    consumed = []
+    peak_ahead = 0
+
+    async def fetch(i):
+        nonlocal running, started, peak_running, peak_ahead
+        started += 1
+        peak_ahead = max(peak_ahead, started - len(consumed))
+        running += 1
+        peak_running = max(peak_running, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return i
+
+    async for result in fetch_in_order(fetch, 30, concurrency=3, window=6):
+        consumed.append(result)
+        await asyncio.sleep(0.002)
+
+    assert peak_running == 3
+    assert peak_ahead <= 6
+
+
+async def test_closing_early_cancels_and_awaits_outstanding_fetches():
+    finished, cancelled = [], []
+
+    async def fetch(i):
+        try:
+            await asyncio.sleep(0 if i == 0 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+        finished.append(i)
+        return i
+
+    results = fetch_in_order(fetch, 10, concurrency=4, window=4)
+    assert await results.__anext__() == 0
+    await results.aclose()
+
+    # Every scheduled fetch has already seen its cancellation
+    assert sorted(cancelled) == [1, 2, 3]
+    assert finished == [0]
+
+
+async def test_a_failed_fetch_is_raised_to_the_consumer():
+    async def fetch(i):
+        if i == 2:
+            raise IOError("chunk 2")
+        return i
+
+    results = []
+    with pytest.raises(IOError, match="chunk 2"):
+        async for result in fetch_in_order(fetch, 5, concurrency=2):
+            results.append(result)
+    assert results == [0, 1]
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+from sqlalchemy import select
+
+from app import database, models, replication
+from app.routes import file_upload
+from conftest import CHUNK_SIZE, login, stored_keys, upload, wait_for
+from services.storage import get_backend
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(replication, "REPLICATION_RETRY_BASE_SECONDS", 0)
+
+
+async def replication_state(file_hash: str):
+    async with database.AsyncSessionLocal() as db:
+        return await db.scalar(select(models.FileUpload.replication_state).where(models.FileUpload.file_hash == file_hash))
+
+
+async def outbox() -> list:
+    async with database.AsyncSessionLocal() as db:
+        return (await db.scalars(select(models.ReplicationTask))).all()
+
+
+async def replicated(file_hash: str, chunk_count: int):
+    async def done():
+        keys = await stored_keys(file_hash)
+        return all(len(replica) == chunk_count for replica in keys.values()) and await replication_state(file_hash) == "replicated"
+
+    await wait_for(done)
+
+
+async def test_async_uploads_are_acknowledged_from_the_primary_and_copied_later(client, monkeypatch):
+    monkeypatch.setattr(file_upload, "UPLOAD_REPLICATION_MODE", "async")
+    await login(client)
+    data = os.urandom(3 * CHUNK_SIZE)
+    # Hold the copies back until every chunk is in
+    await replication.replicator.stop()
+
+    session = await upload(client, data)
+    file_hash = session["file_hash"]
+    assert await stored_keys(file_hash) == {"local": [f"{file_hash}/chunk_{i}" for i in range(3)], "memory": []}
+    assert await replication_state(file_hash) == "pending"
+    assert len(await outbox()) == 3
+    # Until then reads stay on the replica holding each chunk
+    assert (await client.get("/download", params={"file_hash": file_hash})).content == data
+
+    await replication.replicator.start()
+    replication.replicator.wake()
+    await replicated(file_hash, 3)
+    assert await outbox() == []
+    assert (await client.get("/download", params={"file_hash": file_hash})).content == data
+
+
+async def test_a_failed_primary_write_is_repaired_from_the_secondary(client, monkeypatch):
+    monkeypatch.setattr(file_upload, "UPLOAD_REPLICATION_MODE", "async")
+    await login(client)
+    local = get_backend("local")
+    put = local.put
+    failed = []
+
+    async def failing_put(key, data):
+        if len(failed) < 2:
+            failed.append(key)
+            raise ConnectionError("unavailable")
+        return await put(key, data)
+
+    monkeypatch.setattr(local, "put", failing_put)
+    data = os.urandom(2 * CHUNK_SIZE)
+    file_hash = (await upload(client, data))["file_hash"]
+
+    await replicated(file_hash, 2)
+    assert (await client.get("/download", params={"file_hash": file_hash})).content == data
+
+
+async def test_sync_uploads_queue_repairs_for_a_failed_replica(client, monkeypatch):
+    await login(client)
+    memory = get_backend("memory")
+    put = memory.put
+    attempts = []
+
+    async def flaky_put(key, data):
+        attempts.append(key)
+        if len(attempts) <= 3:
+            raise ConnectionError("unavailable")
+        return await put(key, data)
+
+    monkeypatch.setattr(memory, "put", flaky_put)
+    session = await upload(client, os.urandom(CHUNK_SIZE))
+
+    await replicated(session["file_hash"], 1)
+    # The chunk's own write and two retries failed
+    assert len(attempts) == 4
+
+
+async def test_deleting_content_drops_its_queued_copies(client, monkeypatch):
+    monkeypatch.setattr(file_upload, "UPLOAD_REPLICATION_MODE", "async")
+    await login(client)
+    await replication.replicator.stop()
+    file_hash = (await upload(client, os.urandom(2 * CHUNK_SIZE)))["file_hash"]
+    assert len(await outbox()) == 2
+
+    r = await client.delete("/delete-file", params={"file_hash": file_hash})
+
+    assert r.status_code == 202
+    assert await outbox() == []
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.utils.scanPipeline import CANCELLED, CLEAN, ERROR, INCONCLUSIVE, MALICIOUS, merge_verdict, run_scanners
+
+pytestmark = pytest.mark.anyio
+
+
+class Scanner:
+    """A scanner answering `verdict` after `delay` seconds, recording whether it was cancelled."""
+
+    def __init__(self, verdict: str = CLEAN, delay: float = 0, error: Exception = None):
+        self.verdict, self.delay, self.error = verdict, delay, error
+        self.cancelled = False
+
+    async def __call__(self):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return {"verdict": self.verdict}
+
+
+async def test_every_scanner_runs_when_none_finds_malware():
+    results = await run_scanners({"a": Scanner()(), "b": Scanner(delay=0.01)()})
+
+    assert results == {"a": {"verdict": CLEAN}, "b": {"verdict": CLEAN}}
+
+
+async def test_the_first_malicious_verdict_cancels_the_rest():
+    slow = Scanner(delay=10)
+    started = asyncio.get_running_loop().time()
+
+    results = await run_scanners({"fast": Scanner(MALICIOUS, delay=0.01)(), "slow": slow()})
+
+    assert results == {"fast": {"verdict": MALICIOUS}, "slow": {"verdict": CANCELLED}}
+    assert slow.cancelled
+    assert asyncio.get_running_loop().time() - started < 1
+
+
+async def test_a_failing_scanner_is_reported_as_an_error():
+    results = await run_scanners({"broken": Scanner(error=ConnectionError())(), "ok": Scanner()()})
+
+    assert results["broken"] == {"verdict": ERROR, "detail": "ConnectionError"}
+    assert results["ok"] == {"verdict": CLEAN}
+
+
+async def test_cancelling_the_caller_cancels_every_scanner():
+    scanners = [Scanner(delay=10), Scanner(delay=10)]
+    task = asyncio.create_task(run_scanners({str(n): s() for n, s in enumerate(scanners)}))
+    await asyncio.sleep(0.01)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert all(s.cancelled for s in scanners)
+
+
+@pytest.mark.parametrize("verdicts, merged", [
+    ([CLEAN, CLEAN], CLEAN),
+    ([CLEAN, MALICIOUS, ERROR], MALICIOUS),
+    ([CLEAN, ERROR], INCONCLUSIVE),
+    ([], INCONCLUSIVE),
+])
+def test_merge_verdict(verdicts, merged):
+    assert merge_verdict({str(n): {"verdict": v} for n, v in enumerate(verdicts)}) == merged
@@ -0,0 +1,167 @@
+import asyncio
+import io
+
+import pytest
+
+from services import local
+from services.local import LocalBackend, MemoryBackend
+from services.metrics import STORAGE_BYTES, STORAGE_SECONDS
+from services.storage import ObjectWriter
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(params=["local", "memory"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return LocalBackend(str(tmp_path))
+    return MemoryBackend()
+
+
+def operations(backend, operation: str, outcome: str = "success") -> int:
+    series = STORAGE_SECONDS._values.get((backend.name, operation, outcome))
+    return sum(series[:-1]) if series else 0
+
+
+def transferred(backend, operation: str) -> int:
+    return STORAGE_BYTES._values.get((backend.name, operation), 0)
+
+
+async def test_put_get_and_ranges(backend):
+    await backend.put("h/chunk_0", b"0123456789")
+
+    assert await backend.get("h/chunk_0") == b"0123456789"
+    assert await backend.get_range("h/chunk_0", 2, 5) == b"23456"
+    assert await backend.exists("h/chunk_0")
+    assert not await backend.exists("h/chunk_1")
+
+
+async def test_missing_objects_raise_file_not_found(backend):
+    with pytest.raises(FileNotFoundError):
+        await backend.get("h/chunk_9")
+
+
+async def test_list_and_delete_many(backend):
+    for key in ("a/chunk_0", "a/chunk_1", "b/chunk_0"):
+        await backend.put(key, b"x")
+
+    assert await backend.list("a/") == ["a/chunk_0", "a/chunk_1"]
+    # Keys that don't exist count as deleted
+    assert await backend.delete_many(["a/chunk_0", "a/chunk_1", "a/chunk_2"]) == []
+    assert await backend.list() == ["b/chunk_0"]
+
+
+async def test_writer_streams_an_object_in_parts(backend, monkeypatch):
+    monkeypatch.setattr(local, "LOCAL_WRITE_PART_SIZE", 4)
+
+    async with backend.open_writer("h/upload") as writer:
+        for piece in (b"abc", b"defgh", b"ij"):
+            await writer.write(piece)
+
+    assert writer.size == 10
+    assert await backend.get("h/upload") == b"abcdefghij"
+
+
+async def test_put_file(backend):
+    await backend.put_file("h/file", io.BytesIO(b"from a file"))
+
+    assert await backend.get("h/file") == b"from a file"
+
+
+async def test_operations_are_instrumented(backend):
+    uploads, downloads, deletes = (operations(backend, op) for op in ("upload", "download", "delete"))
+    uploaded, downloaded = transferred(backend, "upload"), transferred(backend, "download")
+
+    await backend.put("h/chunk_0", b"0123456789")
+    await backend.get("h/chunk_0")
+    await backend.get_range("h/chunk_0", 0, 4)
+    await backend.delete_many(["h/chunk_0"])
+
+    assert operations(backend, "upload") == uploads + 1
+    assert operations(backend, "download") == downloads + 2
+    assert operations(backend, "delete") == deletes + 1
+    assert transferred(backend, "upload") == uploaded + 10
+    assert transferred(backend, "download") == downloaded + 14
+
+
+async def test_failed_reads_are_counted_as_failures(backend):
+    failures = operations(backend, "download", "failure")
+
+    with pytest.raises(FileNotFoundError):
+        await backend.get("missing")
+
+    assert operations(backend, "download", "failure") == failures + 1
+
+
+async def test_local_keys_cannot_escape_the_root(tmp_path):
+    backend = LocalBackend(str(tmp_path / "root"))
+
+    with pytest.raises(ValueError):
+        await backend.put("../outside", b"x")
+
+
+class RecordingWriter(ObjectWriter):
+    """Collects parts in memory, tracking how many uploads overlap."""
+
+    def __init__(self, part_size: int, max_in_flight: int, fail_part: int = None):
+        super().__init__("h/object", part_size, max_in_flight)
+        self.fail_part = fail_part
+        self.in_flight = self.peak = 0
+        self.single = self.completed = None
+        self.aborted = False
+
+    async def _upload_part(self, part_number: int, data: bytes):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if part_number == self.fail_part:
+                raise ConnectionError(f"part {part_number}")
+            return data
+        finally:
+            self.in_flight -= 1
+
+    async def _complete(self, parts: list) -> str:
+        self.completed = b"".join(parts)
+        return "url"
+
+    async def _put_single(self, data: bytes) -> str:
+        self.single = data
+        return "url"
+
+    async def _abort(self):
+        self.aborted = True
+
+
+async def test_writer_bounds_the_parts_in_flight():
+    writer = RecordingWriter(part_size=4, max_in_flight=2)
+
+    async with writer:
+        for _ in range(10):
+            await writer.write(b"abc")
+
+    assert writer.completed == b"abc" * 10
+    assert writer.peak == 2
+    assert writer.single is None
+
+
+async def test_a_small_object_is_stored_with_a_single_put():
+    writer = RecordingWriter(part_size=4, max_in_flight=2)
+
+    async with writer:
+        await writer.write(b"abc")
+
+    assert writer.single == b"abc"
+    assert writer.completed is None
+
+
+async def test_a_failed_part_aborts_the_upload():
+    writer = RecordingWriter(part_size=4, max_in_flight=1, fail_part=2)
+
+    with pytest.raises(ConnectionError):
+        async with writer:
+            for _ in range(10):
+                await writer.write(b"abcd")
+
+    assert writer.aborted
+    assert writer.completed is None
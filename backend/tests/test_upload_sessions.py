@@ -0,0 +1,135 @@
+import asyncio
+import base64
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from app import database, models
+from conftest import CHUNK_SIZE, encrypt_chunks, login, put_chunk, upload
+from services.storage import get_backend
+
+pytestmark = pytest.mark.anyio
+
+
+def received(session: dict) -> list:
+    bitmap = base64.b64decode(session["received_bitmap"])
+    return [i for i in range(session["chunk_count"]) if bitmap[i // 8] & (1 << (i % 8))]
+
+
+def session_body(data: bytes, key: bytes, chunk_count: int) -> dict:
+    return {
+        "fileName": "file.bin",
+        "fileHash": hashlib.sha256(data).hexdigest(),
+        "totalChunks": chunk_count,
+        "key": base64.b64encode(key).decode(),
+        "size": len(data),
+    }
+
+
+async def test_chunks_arrive_out_of_order_and_the_session_resumes(client):
+    await login(client)
+    data = os.urandom(5 * CHUNK_SIZE)
+    key = os.urandom(32)
+    chunks = encrypt_chunks(data, key)
+    body = session_body(data, key, len(chunks))
+    session = (await client.post("/upload/sessions", json=body)).json()
+
+    for index in (4, 1, 3):
+        assert (await put_chunk(client, session["session_id"], index, *chunks[index])).status_code == 200
+
+    # Reopening with the same key picks up where the upload stopped
+    resumed = (await client.post("/upload/sessions", json=body)).json()
+    assert resumed["session_id"] == session["session_id"]
+    assert received(resumed) == [1, 3, 4]
+    assert resumed["received_count"] == 3
+
+    r = await client.post(f"/upload/sessions/{session['session_id']}/complete")
+    assert r.status_code == 409
+
+    for index in (0, 2):
+        await put_chunk(client, session["session_id"], index, *chunks[index])
+    r = await client.post(f"/upload/sessions/{session['session_id']}/complete")
+    assert r.json()["status"] == "complete"
+    assert (await client.get("/download", params={"file_hash": body["fileHash"]})).content == data
+
+
+async def test_resuming_with_another_key_discards_received_chunks(client):
+    await login(client)
+    data = os.urandom(2 * CHUNK_SIZE)
+    key = os.urandom(32)
+    chunks = encrypt_chunks(data, key)
+    session = (await client.post("/upload/sessions", json=session_body(data, key, 2))).json()
+    await put_chunk(client, session["session_id"], 0, *chunks[0])
+
+    resumed = (await client.post("/upload/sessions", json=session_body(data, os.urandom(32), 2))).json()
+
+    assert resumed["session_id"] == session["session_id"]
+    assert received(resumed) == []
+
+
+async def test_a_chunk_index_outside_the_session_is_rejected(client):
+    await login(client)
+    data = os.urandom(CHUNK_SIZE)
+    key = os.urandom(32)
+    session = (await client.post("/upload/sessions", json=session_body(data, key, 1))).json()
+    iv, ciphertext = encrypt_chunks(data, key)[0]
+
+    r = await put_chunk(client, session["session_id"], 1, iv, ciphertext)
+
+    assert r.status_code == 400
+
+
+async def test_another_owner_cannot_upload_the_same_content_concurrently(client):
+    await login(client, "first@example.com")
+    data = os.urandom(CHUNK_SIZE)
+    await upload(client, data, complete=False)
+
+    await login(client, "second@example.com")
+    r = await client.post("/upload/sessions", json=session_body(data, os.urandom(32), 1))
+
+    assert r.status_code == 409
+
+
+async def test_a_stale_session_is_discarded_and_its_chunks_reclaimed(client):
+    await login(client, "first@example.com")
+    data = os.urandom(3 * CHUNK_SIZE)
+    stale = await upload(client, data, complete=False)
+    file_hash = stale["file_hash"]
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(update(models.FileUpload).where(models.FileUpload.id == stale["session_id"])
+                         .values(created_at=datetime.now(timezone.utc) - timedelta(days=2)))
+        await db.commit()
+
+    await login(client, "second@example.com")
+    body = session_body(data, os.urandom(32), 3)
+    r = await client.post("/upload/sessions", json=body)
+
+    # The stale chunks are deleted first, so the new upload waits for that
+    assert r.status_code == 409
+    async with database.AsyncSessionLocal() as db:
+        assert await db.get(models.FileUpload, stale["session_id"]) is None
+        job = await db.scalar(select(models.DeletionJob).where(models.DeletionJob.file_hash == file_hash))
+    assert job.chunk_count == 3
+
+    for _ in range(250):
+        async with database.AsyncSessionLocal() as db:
+            if await db.scalar(select(models.DeletionJob.status).filter_by(id=job.id)) == "done":
+                break
+        await asyncio.sleep(0.02)
+    assert await get_backend("local").list(f"{file_hash}/") == []
+    assert await get_backend("memory").list(f"{file_hash}/") == []
+    assert (await client.post("/upload/sessions", json=body)).json()["status"] == "uploading"
+
+
+async def test_aborting_a_session_reclaims_its_chunks(client):
+    await login(client)
+    session = await upload(client, os.urandom(2 * CHUNK_SIZE), complete=False)
+
+    r = await client.delete(f"/upload/sessions/{session['session_id']}")
+
+    assert r.status_code == 200
+    assert r.json()["deletion_job_id"] is not None
+    assert (await client.get(f"/upload/sessions/{session['session_id']}")).status_code == 404
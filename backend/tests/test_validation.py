@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+
+import httpx
+import pytest
+
+from app.routes import file_validation
+from app.utils import scanPipeline
+from services.local import MemoryBackend
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def scanners(monkeypatch):
+    """Stage scanner copies in memory and answer scanner calls from `verdicts`.
+
+    Returns (staging backend, staged copies as the scanners saw them, verdicts by scanner URL).
+    """
+    staging = MemoryBackend()
+    seen = {}
+    verdicts = {}
+
+    async def handler(request: httpx.Request):
+        payload = json.loads(request.content)
+        key = payload.get("blob_name") or payload.get("s3_key")
+        seen[key] = staging.objects[key]
+        return httpx.Response(200, json=verdicts[str(request.url)])
+
+    monkeypatch.setattr(file_validation, "scan_blob", staging)
+    monkeypatch.setattr(file_validation, "scan_s3", staging)
+    monkeypatch.setattr(file_validation, "AZURE_FUNCTION_URL", "http://clamav/scan")
+    monkeypatch.setattr(file_validation, "LAMBDA_URL", "http://yara/scan")
+    monkeypatch.setattr(file_validation, "_scanner_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return staging, seen, verdicts
+
+
+async def test_clamav_scans_a_streamed_copy_and_removes_it(client, scanners):
+    staging, seen, verdicts = scanners
+    verdicts["http://clamav/scan"] = {"status": "clean"}
+    data = os.urandom(3 * 1024 * 1024 + 17)
+
+    r = await client.post("/validate/clamav", files={"file": ("report.pdf", data)})
+
+    assert r.status_code == 200
+    assert r.json()["sha256"] == hashlib.sha256(data).hexdigest()
+    blob_name = r.json()["blob_name"]
+    assert blob_name.endswith("_report.pdf")
+    assert seen == {blob_name: data}
+    assert staging.objects == {}
+
+
+async def test_clamav_detections_are_rejected(client, scanners):
+    staging, _, verdicts = scanners
+    verdicts["http://clamav/scan"] = {"status": "infected", "message": "Eicar-Test-Signature"}
+
+    r = await client.post("/validate/clamav", files={"file": ("eicar.com", b"X5O!P%@AP")})
+
+    assert r.status_code == 422
+    assert "Eicar-Test-Signature" in r.json()["detail"]
+    assert staging.objects == {}
+
+
+async def test_a_body_without_the_file_field_is_a_bad_request(client, scanners):
+    staging, seen, _ = scanners
+
+    r = await client.post("/validate/clamav", files={"other": ("x.bin", b"x")})
+
+    assert r.status_code == 400
+    assert seen == {} and staging.objects == {}
+
+
+@pytest.fixture
+def remote_scanners(scanners, monkeypatch):
+    monkeypatch.setattr(file_validation, "VALIDATION_SCANNERS", ["yara", "clamav"])
+    scanPipeline._verdicts.clear()
+    yield scanners
+    scanPipeline._verdicts.clear()
+
+
+async def test_validate_runs_every_scanner_and_caches_a_clean_verdict(client, remote_scanners):
+    staging, seen, verdicts = remote_scanners
+    verdicts["http://yara/scan"] = {"yara": []}
+    verdicts["http://clamav/scan"] = {"status": "clean"}
+    data = os.urandom(1024)
+
+    r = await client.post("/validate", files={"file": ("file.bin", data)})
+
+    assert r.status_code == 200
+    assert r.json()["verdict"] == "clean" and r.json()["cached"] is False
+    assert set(r.json()["scanners"]) == {"yara", "clamav"}
+    assert list(seen.values()) == [data, data]
+    assert staging.objects == {}
+
+    r = await client.post("/validate", files={"file": ("again.bin", data)})
+    assert r.json()["cached"] is True
+    assert len(seen) == 2
+
+
+async def test_validate_rejects_malware_found_by_any_scanner(client, remote_scanners):
+    staging, _, verdicts = remote_scanners
+    verdicts["http://yara/scan"] = {"yara": ["Eicar"]}
+    verdicts["http://clamav/scan"] = {"status": "clean"}
+
+    r = await client.post("/validate", files={"file": ("eicar.com", b"X5O!P%@AP")})
+
+    assert r.status_code == 422
+    assert r.json()["detail"]["verdict"] == "malicious"
+    assert r.json()["detail"]["scanners"]["yara"]["matches"] == ["Eicar"]
+    assert staging.objects == {}
+
+
+async def test_a_failed_scanner_makes_validation_inconclusive(client, remote_scanners):
+    _, _, verdicts = remote_scanners
+    verdicts["http://yara/scan"] = {"yara": []}
+    verdicts["http://clamav/scan"] = {"status": "error", "message": "definitions missing"}
+
+    r = await client.post("/validate", files={"file": ("file.bin", os.urandom(64))})
+
+    assert r.status_code == 502
+    assert r.json()["detail"]["verdict"] == "inconclusive"
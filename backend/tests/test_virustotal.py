@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.utils import virusTotal
+from app.utils.virusTotal import TokenBucket, VirusTotalRateLimited, check_file_hash_with_virustotal
+
+pytestmark = pytest.mark.anyio
+
+FILE_HASH = "ab" * 32
+
+
+@pytest.fixture
+async def virustotal(client, monkeypatch):
+    """Route lookups to a fake VirusTotal; returns the list of hashes it was asked for."""
+    requests = []
+    responses = {}
+
+    async def handler(request: httpx.Request):
+        requests.append(request.url.path.rsplit("/", 1)[-1])
+        await asyncio.sleep(0.05)
+        status, body = responses.get(requests[-1], (404, {}))
+        return httpx.Response(status, json=body)
+
+    monkeypatch.setattr(virusTotal, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://vt"))
+    monkeypatch.setattr(virusTotal, "_bucket", TokenBucket(rate=100, capacity=100))
+    virusTotal._verdicts.clear()
+    yield requests, responses
+    virusTotal._verdicts.clear()
+
+
+def found(malicious: int) -> dict:
+    return {"data": {"attributes": {"last_analysis_stats": {"malicious": malicious}}}}
+
+
+async def test_concurrent_lookups_share_one_request(virustotal):
+    requests, responses = virustotal
+    responses[FILE_HASH] = (200, found(3))
+
+    results = await asyncio.gather(*(check_file_hash_with_virustotal(FILE_HASH.upper()) for _ in range(5)))
+
+    assert requests == [FILE_HASH]
+    assert all(result["found"] and result["malicious_votes"] == 3 for result in results)
+    assert virusTotal._inflight == {}
+
+
+async def test_verdicts_are_cached_in_memory_and_in_the_database(virustotal):
+    requests, _ = virustotal
+
+    assert await check_file_hash_with_virustotal(FILE_HASH) == {"found": False}
+    assert await check_file_hash_with_virustotal(FILE_HASH) == {"found": False}
+    # Another worker's empty memory cache falls back to the stored verdict
+    virusTotal._verdicts.clear()
+    assert await check_file_hash_with_virustotal(FILE_HASH) == {"found": False}
+
+    assert requests == [FILE_HASH]
+
+
+async def test_errors_are_not_cached(virustotal):
+    requests, responses = virustotal
+    responses[FILE_HASH] = (500, {})
+
+    for _ in range(2):
+        assert "error" in await check_file_hash_with_virustotal(FILE_HASH)
+
+    assert requests == [FILE_HASH, FILE_HASH]
+
+
+async def test_a_429_from_virustotal_empties_the_bucket(virustotal):
+    _, responses = virustotal
+    responses[FILE_HASH] = (429, {})
+
+    with pytest.raises(VirusTotalRateLimited):
+        await check_file_hash_with_virustotal(FILE_HASH)
+
+    assert virusTotal._bucket.tokens < 1
+
+
+async def test_the_bucket_allows_a_burst_then_paces_requests():
+    bucket = TokenBucket(rate=20, capacity=3)
+    for _ in range(3):
+        await bucket.acquire(max_wait=0)
+
+    with pytest.raises(VirusTotalRateLimited) as raised:
+        await bucket.acquire(max_wait=0)
+    assert 0 < raised.value.retry_after <= 0.05
+
+    started = time.monotonic()
+    await bucket.acquire(max_wait=1)
+    assert time.monotonic() - started >= 0.03
+
+
+async def test_waiters_are_served_in_turn():
+    bucket = TokenBucket(rate=50, capacity=1)
+    finished = []
+
+    async def lookup(n):
+        await bucket.acquire(max_wait=1)
+        finished.append(n)
+
+    started = time.monotonic()
+    await asyncio.gather(*(lookup(n) for n in range(4)))
+
+    assert finished == [0, 1, 2, 3]
+    # One token up front, then one every 20 ms
+    assert time.monotonic() - started >= 0.05
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from app.utils.yaraScanner import YaraEngine, YaraUnavailable, fingerprint, rule_files
+
+pytest.importorskip("yara")
+pytestmark = pytest.mark.anyio
+
+
+def write_rule(path, name: str, needle: str):
+    path.write_text(f'rule {name} {{ strings: $a = "{needle}" condition: $a }}\n')
+
+
+@pytest.fixture
+async def engine(tmp_path):
+    rules = tmp_path / "rules"
+    rules.mkdir()
+    write_rule(rules / "test.yar", "Needle", "needle")
+    engine = YaraEngine(str(rules), workers=1, timeout=5, reload_interval=0)
+    await engine.start()
+    yield engine, rules
+    await engine.stop()
+
+
+async def test_scans_match_the_compiled_rules(engine):
+    engine, _ = engine
+
+    assert await engine.scan(b"hay needle hay") == ["Needle"]
+    assert await engine.scan(b"just hay") == []
+    assert engine.rule_count == 1
+
+
+async def test_changed_rules_are_picked_up_on_reload(engine):
+    engine, rules = engine
+    old_version = engine.version
+    assert await engine.reload() is False
+
+    write_rule(rules / "more.yara", "Pin", "pin")
+    assert await engine.reload() is True
+
+    assert engine.version != old_version
+    assert sorted(await engine.scan(b"needle and pin")) == ["Needle", "Pin"]
+
+
+async def test_scanning_before_start_is_unavailable(tmp_path):
+    with pytest.raises(YaraUnavailable):
+        await YaraEngine(str(tmp_path), workers=1).scan(b"data")
+
+
+async def test_starting_without_rules_is_unavailable(tmp_path):
+    with pytest.raises(YaraUnavailable, match="No YARA rules"):
+        await YaraEngine(str(tmp_path), workers=1, reload_interval=0).start()
+
+
+def test_the_fingerprint_follows_the_rule_files(tmp_path):
+    write_rule(tmp_path / "a.yar", "A", "a")
+    (tmp_path / "notes.txt").write_text("not a rule")
+    files = rule_files(str(tmp_path))
+    before = fingerprint(files)
+
+    assert list(files) == ["a.yar"]
+    write_rule(tmp_path / "a.yar", "A", "changed")
+    os.utime(tmp_path / "a.yar", ns=(0, 1))
+    assert fingerprint(rule_files(str(tmp_path))) != before
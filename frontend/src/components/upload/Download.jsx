@@ -3,11 +3,24 @@ import axios from "axios";
 
 const Download = () => {
   const [files, setFiles] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+
+  // /my-files is paginated; each page carries the cursor for the next one
+  const loadFiles = (cursor = null) => {
+    axios.get("http://localhost:8000/my-files", {
+      params: cursor ? { cursor } : {},
+      withCredentials: true,
+    })
+      .then(res => {
+        setFiles(prev => cursor ? [...prev, ...res.data.items] : res.data.items);
+        setNextCursor(res.data.next_cursor);
+      })
+      .catch(err => console.error(err));
+  };
+
 // we will pass cors headers in the axios request
   useEffect(() => {
-    axios.get("http://localhost:8000/my-files", { withCredentials: true })
-      .then(res => setFiles(res.data))
-      .catch(err => console.error(err));
+    loadFiles();
   }, []);
 
   const downloadFile = async (fileHash, fileName) => {
@@ -96,6 +109,14 @@ const deleteFile = async (fileHash) => {
       
         </table>
       )}
+      {nextCursor && (
+        <button
+          className="mt-4 bg-gray-200 px-3 py-1 rounded"
+          onClick={() => loadFiles(nextCursor)}
+        >
+          Load more
+        </button>
+      )}
     </div>
   );
 };
@@ -12,6 +12,8 @@ const Upload = () => {
   const [totalChunks, setTotalChunks] = useState(0);
 
   const chunkSize = 300 * 1024; // 300KB
+  const parallelUploads = 4;
+  const maxChunkAttempts = 4;
 
   const handleFileChange = (e) => {
     setFile(e.target.files[0]);
@@ -48,29 +50,20 @@ const Upload = () => {
       setUploading(false);
       setProgress(0);
       setScanProgress(0);
-      setScanPhase("Scanning with YARA...");
-
-      const formData = new FormData();
-      formData.append("file", file);
-
-      await axios.post("http://localhost:8000/validate/yara", formData, {
-        withCredentials: true,
-      });
-      setScanProgress(33);
-      setScanPhase("Scanning with ClamAV...");
-
-      await axios.post("http://localhost:8000/validate/clamav", formData, {
-        withCredentials: true,
-      });
-      setScanProgress(66);
-      setScanPhase("Scanning with VirusTotal...");
+      setScanPhase("Scanning with YARA, ClamAV and VirusTotal...");
 
       const arrayBuffer = await readFileAsArrayBuffer(file);
       const hashBuffer = await crypto.subtle.digest("SHA-256", arrayBuffer);
       const hashArray = Array.from(new Uint8Array(hashBuffer));
       const hashHex = hashArray.map((b) => b.toString(16).padStart(2, "0")).join("");
 
-      await axios.post("http://localhost:8000/validate/virustotal", {fileHash:hashHex});
+      // One upload; the server runs every scanner on it concurrently
+      const formData = new FormData();
+      formData.append("file", file);
+
+      await axios.post("http://localhost:8000/validate", formData, {
+        withCredentials: true,
+      });
 
       setScanProgress(100);
       setScanPhase("Scan completed");
@@ -79,48 +72,120 @@ const Upload = () => {
       setScanning(false);
       setUploading(true);
 
-      const key = await crypto.subtle.generateKey(
-        { name: "AES-GCM", length: 256 },
-        true,
-        ["encrypt"]
-      );
-
       const total = Math.ceil(file.size / chunkSize);
       setTotalChunks(total);
 
+      // Resuming must reuse the key the received chunks were encrypted
+      // with (a new one makes the server discard them). The server keeps
+      // one session per file hash and chunk count, so the key is stored
+      // under those until the upload completes.
+      const resumeStorageKey = `upload-key:${hashHex}:${total}`;
+      let rawKey = localStorage.getItem(resumeStorageKey);
+      if (!rawKey) {
+        const generated = await crypto.subtle.generateKey(
+          { name: "AES-GCM", length: 256 },
+          true,
+          ["encrypt"]
+        );
+        rawKey = btoa(
+          String.fromCharCode(
+            ...new Uint8Array(await crypto.subtle.exportKey("raw", generated))
+          )
+        );
+        localStorage.setItem(resumeStorageKey, rawKey);
+      }
+      const key = await crypto.subtle.importKey(
+        "raw",
+        Uint8Array.from(atob(rawKey), (c) => c.charCodeAt(0)),
+        "AES-GCM",
+        false,
+        ["encrypt"]
+      );
+
+      // Open (or resume) an upload session; chunks already received are skipped.
+      // While stored content is being verified the server answers with a
+      // Retry-After header; wait as told and ask again.
+      const sessionBody = { fileName: file.name, fileHash: hashHex, totalChunks: total, key: rawKey, size: file.size };
+      const openSession = async (body) => {
+        for (let attempt = 1; ; attempt++) {
+          try {
+            const { data } = await axios.post(
+              "http://localhost:8000/upload/sessions",
+              body,
+              { withCredentials: true }
+            );
+            return data;
+          } catch (err) {
+            const retryAfter = Number(err.response?.headers["retry-after"]);
+            if (!retryAfter || attempt >= maxChunkAttempts) throw err;
+            await new Promise((r) => setTimeout(r, retryAfter * 1000));
+          }
+        }
+      };
+      let session = await openSession(sessionBody);
+      if (session.status === "proof_required") {
+        // The content is already stored: prove we hold it by hashing the
+        // nonce followed by the requested range of the file.
+        const range = new Uint8Array(
+          await file.slice(session.offset, session.offset + session.length).arrayBuffer()
+        );
+        const nonce = new TextEncoder().encode(session.nonce);
+        const message = new Uint8Array(nonce.length + range.length);
+        message.set(nonce);
+        message.set(range, nonce.length);
+        const proofBuffer = await crypto.subtle.digest("SHA-256", message);
+        const proof = Array.from(new Uint8Array(proofBuffer)).map((b) => b.toString(16).padStart(2, "0")).join("");
+        session = await openSession({ ...sessionBody, challenge: session.challenge, proof });
+      }
+      const received = Uint8Array.from(atob(session.received_bitmap), (c) => c.charCodeAt(0));
+      const pending = [];
       for (let i = 0; i < total; i++) {
+        if (!(received[i >> 3] & (1 << (i & 7)))) pending.push(i);
+      }
+
+      let done = total - pending.length;
+      const uploadOne = async (i) => {
         const start = i * chunkSize;
         const end = Math.min(start + chunkSize, file.size);
-        const chunkBlob = file.slice(start, end);
-        const chunkArrayBuffer = await chunkBlob.arrayBuffer();
+        const chunkArrayBuffer = await file.slice(start, end).arrayBuffer();
 
         const iv = crypto.getRandomValues(new Uint8Array(12));
         const encryptedChunk = await encryptChunk(chunkArrayBuffer, key, iv);
 
         const chunkFormData = new FormData();
         chunkFormData.append("chunk", new Blob([encryptedChunk]));
-        chunkFormData.append("chunkIndex", i);
-        chunkFormData.append("fileName", file.name);
         chunkFormData.append("iv", JSON.stringify(Array.from(iv)));
-        chunkFormData.append("fileHash", hashHex);
-        chunkFormData.append("totalChunks", total);
-        chunkFormData.append(
-          "key",
-          btoa(
-            String.fromCharCode(
-              ...new Uint8Array(await crypto.subtle.exportKey("raw", key))
-            )
-          )
-        );
 
-        await axios.post("http://localhost:8000/upload", chunkFormData, {
-     
-          withCredentials: true,
-        });
+        for (let attempt = 1; ; attempt++) {
+          try {
+            await axios.put(
+              `http://localhost:8000/upload/sessions/${session.session_id}/chunks/${i}`,
+              chunkFormData,
+              { withCredentials: true }
+            );
+            break;
+          } catch (err) {
+            if (attempt >= maxChunkAttempts) throw err;
+            await new Promise((r) => setTimeout(r, 500 * 2 ** attempt));
+          }
+        }
 
-        setCurrentChunk(i + 1);
-        setProgress(Math.round(((i + 1) / total) * 100));
-      }
+        done += 1;
+        setCurrentChunk(done);
+        setProgress(Math.round((done / total) * 100));
+      };
+
+      const workers = Array.from({ length: parallelUploads }, async () => {
+        while (pending.length) await uploadOne(pending.shift());
+      });
+      await Promise.all(workers);
+
+      await axios.post(
+        `http://localhost:8000/upload/sessions/${session.session_id}/complete`,
+        {},
+        { withCredentials: true }
+      );
+      localStorage.removeItem(resumeStorageKey);
 
       alert("Upload completed successfully.");
     } catch (error) {